@@ -1,6 +1,10 @@
 from django.contrib import admin
 
-from .models import Post, Subscribe
+from .models import AuthorStats, Job, Post, ReadException, Subscribe, UnreadCounter
 
 admin.site.register(Post)
 admin.site.register(Subscribe)
+admin.site.register(AuthorStats)
+admin.site.register(UnreadCounter)
+admin.site.register(Job)
+admin.site.register(ReadException)
@@ -0,0 +1,185 @@
+import asyncio
+import weakref
+from types import SimpleNamespace
+
+import redis.asyncio
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django_redis.cache import RedisCache
+
+from .authentication import TOKEN_USER_KEY, get_token_key, get_user
+from .cache import GENERATION_KEY, GENERATION_TIME_KEY, make_page_key
+from .conditional import get_http_last_modified
+from .instrumentation import record_cache
+from .throttling import SlidingWindowThrottle
+
+
+class AsyncCache:
+    """
+    Non-blocking reads of the default cache.
+    Keys written by django-redis are read with the redis.asyncio client
+    of the running event loop, other backends use their async methods.
+    """
+
+    def __init__(self):
+        self.clients = weakref.WeakKeyDictionary()
+
+    def get_client(self):
+        loop = asyncio.get_running_loop()
+        client = self.clients.get(loop)
+        if client is None:
+            location = settings.CACHES[DEFAULT_CACHE_ALIAS]["LOCATION"]
+            if not isinstance(location, str):
+                location = location[0]
+            client = self.clients[loop] = redis.asyncio.from_url(location)
+        return client
+
+    async def get_many(self, keys):
+        cache = caches[DEFAULT_CACHE_ALIAS]
+        if not isinstance(cache, RedisCache):
+            return await cache.aget_many(keys)
+        values = await self.get_client().mget(
+            [cache.client.make_key(key) for key in keys]
+        )
+        return {
+            key: cache.client.decode(value)
+            for key, value in zip(keys, values)
+            if value is not None
+        }
+
+    async def get(self, key):
+        return (await self.get_many([key])).get(key)
+
+
+async_cache = AsyncCache()
+
+
+def call_sync_view(view, request, *args, **kwargs):
+    """Runs the DRF view and renders its response in the same thread"""
+    response = view(request, *args, **kwargs)
+    if hasattr(response, "render"):
+        response.render()
+    return response
+
+
+async def authenticate(request):
+    """
+    User of the request for the cached page, False when only the
+    sync view can tell (basic auth, session, unknown token)
+    """
+    if request.headers.get("Authorization") is None:
+        if settings.SESSION_COOKIE_NAME in request.COOKIES:
+            return False
+        return AnonymousUser()
+    token = get_token_key(request)
+    if token is None:
+        return False
+    user_id = await async_cache.get(TOKEN_USER_KEY % token)
+    if user_id is None:
+        return False
+    return get_user(user_id)
+
+
+def is_allowed(view):
+    """The throttles of the view, they count the request when allowed"""
+    return all(
+        throttle.allow_request(view.request, view) for throttle in view.get_throttles()
+    )
+
+
+async def ais_allowed(view):
+    """
+    is_allowed() from the event loop. With django-redis the throttles
+    count with the redis.asyncio client, other backends need a thread.
+    """
+    throttles = view.get_throttles()
+    if not isinstance(caches[DEFAULT_CACHE_ALIAS], RedisCache) or not all(
+        isinstance(throttle, SlidingWindowThrottle) for throttle in throttles
+    ):
+        return await sync_to_async(is_allowed)(view)
+    client = async_cache.get_client()
+    for throttle in throttles:
+        if not await throttle.aallow_request(view.request, view, client):
+            return False
+    return True
+
+
+async def get_cached_page(view_class, request, args, kwargs):
+    """
+    The cached page of the list view, None when it has to be built or
+    the sync view has to answer (denied permission, throttled request)
+    """
+    user = await authenticate(request)
+    if user is False:
+        return None
+    auth = get_token_key(request)
+    view = view_class(
+        request=SimpleNamespace(
+            user=user, auth=auth, method=request.method, META=request.META
+        ),
+        args=args,
+        kwargs=kwargs,
+        format_kwarg=None,
+    )
+    for permission in view.get_permissions():
+        if not permission.has_permission(view.request, view):
+            return None
+    names = view.get_cache_generations()
+    keys = [GENERATION_KEY % name for name in names]
+    time_keys = [GENERATION_TIME_KEY % name for name in names]
+    values = await async_cache.get_many(keys + time_keys)
+    if any(key not in values for key in keys):
+        return None
+    key = make_page_key(
+        view.cache_prefix,
+        [values[key] for key in keys],
+        view.get_cache_user(),
+        request,
+    )
+    etag = quote_etag(key.rsplit(":", 1)[-1])
+    last_modified = None
+    if time_keys and all(key in values for key in time_keys):
+        last_modified = get_http_last_modified(max(values[key] for key in time_keys))
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        data = await async_cache.get(key)
+        record_cache(data is not None)
+        if data is None:
+            return None
+        renderer = view.renderer_classes[0]()
+        response = HttpResponse(renderer.render(data), content_type=renderer.media_type)
+    # Only requests answered here are counted, the sync view counts the others
+    if not await ais_allowed(view):
+        return None
+    for name, value in view.default_response_headers.items():
+        response[name] = value
+    response["ETag"] = etag
+    if last_modified is not None:
+        response["Last-Modified"] = http_date(last_modified)
+    return response
+
+
+def async_list_view(view_class, **initkwargs):
+    """
+    ASGI-native variant of a cached DRF list view.
+    Cached pages are read from the event loop without a thread,
+    every other request runs the sync view in one thread hop.
+    Django 4.0 has no async ORM, so pages are still built synchronously.
+    """
+    sync_view = view_class.as_view(**initkwargs)
+
+    async def view(request, *args, **kwargs):
+        if request.method == "GET":
+            response = await get_cached_page(view_class, request, args, kwargs)
+            if response is not None:
+                return response
+        return await sync_to_async(call_sync_view)(sync_view, request, *args, **kwargs)
+
+    view.csrf_exempt = True
+    view.view_class = view_class
+    return view
@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import router
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+TOKEN_USER_KEY = "token-user:%s"
+TOKEN_USER_TTL = getattr(settings, "TOKEN_USER_TTL", 300)
+TOKEN_LOCAL_CACHE_SIZE = getattr(settings, "TOKEN_LOCAL_CACHE_SIZE", 1024)
+# Other processes only see an invalidation when their entry expires
+TOKEN_LOCAL_TTL = getattr(settings, "TOKEN_LOCAL_TTL", 10)
+
+
+class LocalCache:
+    """Bounded least recently used cache whose entries expire"""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_tokens = LocalCache(TOKEN_LOCAL_CACHE_SIZE, TOKEN_LOCAL_TTL)
+
+
+def get_token_key(request):
+    """Key of the `Authorization: Token <key>` header, None without it"""
+    parts = request.headers.get("Authorization", "").split()
+    if len(parts) == 2 and parts[0] == "Token":
+        return parts[1]
+    return None
+
+
+def get_user(user_id):
+    """
+    User with only its id loaded, the other fields are read from the
+    database when first used. Saving it writes only the fields loaded
+    or set, so it cannot overwrite newer data with stale values.
+    """
+    return User.from_db(router.db_for_write(User), ["id"], [user_id])
+
+
+def get_token_user_id(key):
+    """
+    Id of the active user of the token, looked up in the process, then
+    in the cache (where async views find it), then in the database
+    """
+    user_id = local_tokens.get(key)
+    if user_id is None:
+        user_id = cache.get(TOKEN_USER_KEY % key)
+        if user_id is None:
+            user_id = (
+                Token.objects.filter(key=key, user__is_active=True)
+                .values_list("user_id", flat=True)
+                .first()
+            )
+            if user_id is None:
+                return None
+            cache.set(TOKEN_USER_KEY % key, user_id, TOKEN_USER_TTL)
+        local_tokens.set(key, user_id)
+    return user_id
+
+
+def get_token_user(key):
+    """User of the token, every call gets its own instance"""
+    user_id = get_token_user_id(key)
+    return None if user_id is None else get_user(user_id)
+
+
+def forget_token(key):
+    local_tokens.delete(key)
+    cache.delete(TOKEN_USER_KEY % key)
+
+
+def forget_user_tokens(user):
+    for key in Token.objects.filter(user=user).values_list("key", flat=True):
+        forget_token(key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Token authentication without a query once the token is cached.
+    Entries are forgotten on logout (the token is deleted) and whenever
+    the user is saved (password change, deactivation).
+    """
+
+    def authenticate_credentials(self, key):
+        user = get_token_user(key)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_("Invalid token."))
+        return user, Token(key=key, user=user)
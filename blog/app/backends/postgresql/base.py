@@ -0,0 +1,7 @@
+from django.db.backends.postgresql import base
+
+from app.connections import HealthCheckMixin
+
+
+class DatabaseWrapper(HealthCheckMixin, base.DatabaseWrapper):
+    """PostgreSQL with persistent connections checked on first use"""
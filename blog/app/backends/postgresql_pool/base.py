@@ -0,0 +1,115 @@
+import threading
+
+import psycopg2
+import psycopg2.extras
+from django.db import OperationalError
+from django.db.backends.postgresql import base
+from django.utils.asyncio import async_unsafe
+from psycopg2 import extensions, pool
+
+from app.instrumentation import registry
+
+pools = {}
+pools_lock = threading.Lock()
+
+
+class PooledConnection(extensions.connection):
+    """Counts how many times the pool handed out the connection"""
+
+    uses = 0
+
+
+class BlockingPool:
+    """
+    Pool of up to `size` connections, opened when first needed.
+    When all of them are in use, callers wait up to `timeout` seconds
+    for one to come back instead of failing at once.
+    """
+
+    def __init__(self, size, timeout, conn_params):
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(size)
+        self.connections = pool.ThreadedConnectionPool(
+            0, size, connection_factory=PooledConnection, **conn_params
+        )
+
+    def getconn(self):
+        if not self.slots.acquire(timeout=self.timeout):
+            registry.increment("db_pool_timeouts")
+            raise OperationalError(
+                "No pooled connection was free within %s seconds" % self.timeout
+            )
+        try:
+            return self.connections.getconn()
+        except Exception:
+            self.slots.release()
+            raise
+
+    def putconn(self, connection, close=False):
+        try:
+            self.connections.putconn(connection, close=close)
+        finally:
+            self.slots.release()
+
+
+class DatabaseWrapper(base.DatabaseWrapper):
+    """
+    PostgreSQL connections of a per-process pool of POOL_SIZE
+    connections per database. Django closes them at the end of the
+    request (CONN_MAX_AGE 0), which gives them back to the pool.
+    With CONN_HEALTH_CHECKS a reused connection is checked first.
+    """
+
+    pooled = True
+
+    def get_pool(self, conn_params):
+        with pools_lock:
+            if self.alias not in pools:
+                pools[self.alias] = BlockingPool(
+                    self.settings_dict.get("POOL_SIZE", 10),
+                    self.settings_dict.get("POOL_TIMEOUT", 10),
+                    conn_params,
+                )
+            return pools[self.alias]
+
+    def is_healthy(self, connection):
+        if connection.closed:
+            return False
+        if connection.uses == 0 or not self.settings_dict.get("CONN_HEALTH_CHECKS"):
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        except psycopg2.Error:
+            return False
+        return True
+
+    @async_unsafe
+    def get_new_connection(self, conn_params):
+        connections = self.get_pool(conn_params)
+        connection = connections.getconn()
+        while not self.is_healthy(connection):
+            registry.increment("db_connections_broken")
+            connections.putconn(connection, close=True)
+            connection = connections.getconn()
+        connection.uses += 1
+        if connection.uses == 1:
+            registry.increment("db_connections_opened")
+            psycopg2.extras.register_default_jsonb(
+                conn_or_curs=connection, loads=lambda x: x
+            )
+        else:
+            registry.increment("db_connections_reused")
+        self.isolation_level = self.settings_dict["OPTIONS"].get(
+            "isolation_level", extensions.ISOLATION_LEVEL_DEFAULT
+        )
+        if connection.isolation_level != self.isolation_level:
+            connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                pools[self.alias].putconn(
+                    self.connection, close=bool(self.connection.closed)
+                )
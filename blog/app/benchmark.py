@@ -0,0 +1,440 @@
+import json
+import random
+import statistics
+import time
+from types import SimpleNamespace
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, F
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from . import throttling
+from .cache import bump_generation
+from .feed import rebuild_feed
+from .models import FeedEntry, Post, ReadException, Subscribe
+from .reads import compact_read_state, get_read_post_ids
+from .renderers import FastJSONRenderer
+from .serializers import (
+    AuthorSerializer,
+    AuthorValuesSerializer,
+    PostSerializer,
+    PostSubscribeSerializer,
+    PostSubscribeValuesSerializer,
+    PostValuesSerializer,
+    SubscribeSerializer,
+    SubscribeValuesSerializer,
+)
+from .service import get_row_value
+from .stats import reconcile_author_stats
+from .subscriptions import subscribe, unsubscribe
+from .unread import rebuild_unread_counters
+
+SEED_BATCH_SIZE = 1000
+
+
+def seed(users=100, posts=1000, follows=20, alpha=1.2, read_ratio=0.3, seed=0):
+    """
+    Fills the database with benchmark data.
+    Authors are followed with power-law weights (the first ones are
+    the most popular), each user follows up to `follows` authors and
+    has read `read_ratio` of the posts of the feed.
+    """
+    rng = random.Random(seed)
+    password = make_password(None)
+    User.objects.bulk_create(
+        [User(username="bench%s" % index, password=password) for index in range(users)],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    user_ids = list(
+        User.objects.filter(username__startswith="bench")
+        .order_by("id")
+        .values_list("id", flat=True)
+    )
+    Token.objects.bulk_create(
+        [Token(user_id=user_id, key=Token.generate_key()) for user_id in user_ids],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    weights = [1 / (rank + 1) ** alpha for rank in range(len(user_ids))]
+    Post.objects.bulk_create(
+        [
+            Post(
+                title="Post %s" % index,
+                content="Content of the post %s " % index * 10,
+                author_id=rng.choices(user_ids, weights)[0],
+            )
+            for index in range(posts)
+        ],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    subscriptions = set()
+    for subscriber in user_ids:
+        for author in rng.choices(user_ids, weights, k=follows):
+            if author != subscriber:
+                subscriptions.add((author, subscriber))
+    Subscribe.objects.bulk_create(
+        [
+            Subscribe(author_id=author, subscriber_id=subscriber)
+            for author, subscriber in subscriptions
+        ],
+        batch_size=SEED_BATCH_SIZE,
+    )
+    rebuild_feed()
+    reads = [
+        ReadException(user_id=subscriber, post_id=post, is_read=True)
+        for subscriber, post in FeedEntry.objects.values_list(
+            "subscriber_id", "post_id"
+        ).iterator()
+        if rng.random() < read_ratio
+    ]
+    ReadException.objects.bulk_create(reads, batch_size=SEED_BATCH_SIZE)
+    compact_read_state()
+    reconcile_author_stats()
+    rebuild_unread_counters()
+    bump_generation("post", "subscribe", "user")
+    return {
+        "users": len(user_ids),
+        "posts": posts,
+        "subscriptions": len(subscriptions),
+        "reads": len(reads),
+    }
+
+
+def get_routes():
+    """
+    The routes of blog/urls.py as (name, method, url, data, user id),
+    read by the subscriber who follows the most authors, the admin routes
+    by an admin. Data can be a function, called before each request to
+    reset what the previous request changed.
+    """
+    reader = User.objects.get(
+        id=Subscribe.objects.values("subscriber")
+        .annotate(follows=Count("id"))
+        .order_by("-follows")
+        .first()["subscriber"]
+    )
+    authors = list(
+        User.objects.filter(username__startswith="bench")
+        .exclude(id=reader.id)
+        .order_by("-stats__subscriber_count")
+        .values_list("username", flat=True)[:3]
+    )
+    admin, _ = User.objects.get_or_create(username="admin", defaults={"is_staff": True})
+    post = FeedEntry.objects.filter(subscriber=reader).first().post_id
+    posts = "".join(
+        json.dumps(
+            {"type": "posts", "author": authors[0], "title": "T", "content": "C"}
+        )
+        + "\n"
+        for _ in range(10)
+    )
+
+    def subscribe_author():
+        unsubscribe(reader, authors[:1])
+        return {"author": authors[0]}
+
+    def subscribe_authors():
+        unsubscribe(reader, authors)
+        return {"authors": authors}
+
+    def unsubscribe_authors():
+        subscribe(reader, authors)
+        return {"authors": authors}
+
+    return reader.id, [
+        ("post_list_anonymous", "get", reverse("post"), None, None),
+        ("post_list", "get", reverse("post"), None, reader.id),
+        ("post_list_cursor", "get", reverse("post") + "?cursor=", None, reader.id),
+        (
+            "post_create",
+            "post",
+            reverse("post"),
+            {"title": "T", "content": "C"},
+            reader.id,
+        ),
+        (
+            "post_search",
+            "get",
+            reverse("post_search") + "?q=content",
+            None,
+            reader.id,
+        ),
+        ("authors_list", "get", reverse("authors"), None, reader.id),
+        (
+            "authors_list_ordered",
+            "get",
+            reverse("authors") + "?o=-count_post",
+            None,
+            reader.id,
+        ),
+        ("subscribe_list", "get", reverse("subscribe"), None, reader.id),
+        ("post_subscribe_list", "get", reverse("post_subscribe"), None, reader.id),
+        (
+            "post_subscribe_unread_filter",
+            "get",
+            reverse("post_subscribe") + "?is_read=false",
+            None,
+            reader.id,
+        ),
+        (
+            "post_subscribe_unread",
+            "get",
+            reverse("post_subscribe_unread"),
+            None,
+            reader.id,
+        ),
+        (
+            "post_subscribe_preview",
+            "get",
+            reverse("post_subscribe") + "?preview=100&fields=id,author,title,content",
+            None,
+            reader.id,
+        ),
+        (
+            "post_subscribe_cursor",
+            "get",
+            reverse("post_subscribe") + "?cursor=",
+            None,
+            reader.id,
+        ),
+        (
+            "post_subscribe_detail",
+            "get",
+            reverse("post_subscribe_detail", args=[post]),
+            None,
+            reader.id,
+        ),
+        (
+            "post_subscribe_detail_update",
+            "patch",
+            reverse("post_subscribe_detail", args=[post]),
+            {"is_read": "true"},
+            reader.id,
+        ),
+        (
+            "post_subscribe_read",
+            "post",
+            reverse("post_subscribe_read"),
+            {"posts": [post]},
+            reader.id,
+        ),
+        (
+            "export",
+            "get",
+            reverse("export") + "?type=posts&author=%s" % authors[0],
+            None,
+            admin.id,
+        ),
+        ("import", "post", reverse("import"), posts, admin.id),
+        ("metrics", "get", reverse("metrics"), None, admin.id),
+        # Last, they change the subscriptions the other routes read
+        ("authors_subscribe", "post", reverse("authors"), subscribe_author, reader.id),
+        (
+            "unsubscribe_bulk",
+            "delete",
+            reverse("subscribe"),
+            unsubscribe_authors,
+            reader.id,
+        ),
+        ("subscribe_bulk", "post", reverse("subscribe"), subscribe_authors, reader.id),
+    ]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+def run(requests=50, warmup=5, cold=False, routes=None):
+    """
+    Measures each route with the test client.
+    With `cold` the cache is cleared before every request.
+    Returns latency percentiles and CPU time in milliseconds, queries
+    per request, response size and throughput of a single client.
+    """
+    with throttling.unthrottled():
+        return run_routes(requests, warmup, cold, routes)
+
+
+def run_routes(requests, warmup, cold, routes):
+    _, all_routes = get_routes()
+    results = {}
+    for name, method, url, data, user_id in all_routes:
+        if routes and name not in routes:
+            continue
+        client = Client()
+        headers = {}
+        if user_id is not None:
+            token, _ = Token.objects.get_or_create(user_id=user_id)
+            headers["HTTP_AUTHORIZATION"] = "Token " + token.key
+        send = getattr(client, method)
+        latencies = []
+        cpu_times = []
+        queries = []
+        status_codes = set()
+        sizes = []
+        for index in range(warmup + requests):
+            if cold:
+                cache.clear()
+            body = data() if callable(data) else data
+            with CaptureQueriesContext(connection) as context:
+                start = time.perf_counter()
+                cpu_start = time.process_time()
+                if method == "get":
+                    response = send(url, **headers)
+                else:
+                    response = send(
+                        url, body, content_type="application/json", **headers
+                    )
+                if response.streaming:
+                    content = b"".join(response.streaming_content)
+                else:
+                    content = response.content
+                elapsed = time.perf_counter() - start
+                cpu_time = time.process_time() - cpu_start
+            if index >= warmup:
+                latencies.append(elapsed * 1000)
+                cpu_times.append(cpu_time * 1000)
+                queries.append(len(context.captured_queries))
+                status_codes.add(response.status_code)
+                sizes.append(len(content))
+        results[name] = {
+            "method": method.upper(),
+            "url": url,
+            "status": sorted(status_codes),
+            "p50_ms": round(percentile(latencies, 0.5), 3),
+            "p90_ms": round(percentile(latencies, 0.9), 3),
+            "p99_ms": round(percentile(latencies, 0.99), 3),
+            "mean_ms": round(statistics.mean(latencies), 3),
+            "cpu_ms": round(statistics.mean(cpu_times), 3),
+            "queries": round(statistics.mean(queries), 2),
+            "max_queries": max(queries),
+            "bytes": round(statistics.mean(sizes)),
+            "rps": round(len(latencies) / (sum(latencies) / 1000), 1),
+        }
+    return results
+
+
+def measure_cpu(function, repeat):
+    """Mean CPU time of the function in milliseconds and its last result"""
+    start = time.process_time()
+    for _ in range(repeat):
+        result = function()
+    return (time.process_time() - start) * 1000 / repeat, result
+
+
+def serialization(page_size=100, repeat=20):
+    """
+    CPU time per page of the model serializers and of the `.values()`
+    serializers of the list views, from the query to the JSON bytes.
+    The outputs of both have to be identical.
+    """
+    reader, _ = get_routes()
+    request = SimpleNamespace(user=User.objects.get(id=reader))
+    feed = (
+        Post.objects.select_related("author")
+        .filter(feed_entries__subscriber_id=reader)
+        .order_by("-feed_entries__time_create")
+    )
+    authors = (
+        User.objects.filter(stats__post_count__isnull=False)
+        .annotate(count_post=F("stats__post_count"))
+        .order_by("id")
+    )
+    subscriptions = Subscribe.objects.filter(subscriber_id=reader)
+    pages = [
+        ("posts", Post.objects.all(), PostSerializer, PostValuesSerializer, False),
+        ("feed", feed, PostSubscribeSerializer, PostSubscribeValuesSerializer, True),
+        ("authors", authors, AuthorSerializer, AuthorValuesSerializer, False),
+        (
+            "subscriptions",
+            subscriptions.select_related("author"),
+            SubscribeSerializer,
+            SubscribeValuesSerializer,
+            False,
+        ),
+    ]
+    results = {}
+    for name, queryset, model_class, values_class, with_reads in pages:
+
+        def render(serializer_class, renderer, page):
+            context = {}
+            if with_reads:
+                ids = [get_row_value(row, "id") for row in page]
+                context = {
+                    "request": request,
+                    "read_post_ids": get_read_post_ids(request.user, ids),
+                }
+            data = serializer_class(page, many=True, context=context).data
+            return renderer.render(data)
+
+        model_ms, model_output = measure_cpu(
+            lambda: render(model_class, JSONRenderer(), list(queryset[:page_size])),
+            repeat,
+        )
+        values_page = queryset.values(*values_class.columns)[:page_size]
+        values_ms, values_output = measure_cpu(
+            lambda: render(values_class, FastJSONRenderer(), list(values_page)),
+            repeat,
+        )
+        results[name] = {
+            "rows": len(queryset[:page_size]),
+            "model_cpu_ms": round(model_ms, 3),
+            "values_cpu_ms": round(values_ms, 3),
+            "saved_cpu_ms": round(model_ms - values_ms, 3),
+            "identical": model_output == values_output,
+        }
+    return results
+
+
+def rate_limiting(repeat=10000, keys=1000):
+    """
+    Overhead of a rate limit check in microseconds, with the local
+    counters and with the store of the configured cache, over `keys`
+    clients whose requests stay under the limit
+    """
+    results = {}
+    stores = [
+        ("local", throttling.local_store, throttling.local_store.hit),
+        ("cache", throttling.get_store(), throttling.hit),
+    ]
+    for name, store, hit in stores:
+        start = time.perf_counter()
+        for index in range(repeat):
+            hit("throttle_bench_%s" % (index % keys), repeat, 60)
+        elapsed = time.perf_counter() - start
+        results[name] = {
+            "store": type(store).__name__,
+            "check_us": round(elapsed * 1000000 / repeat, 3),
+        }
+    throttling.local_store.clear()
+    return results
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Regressions of the results against a baseline: more queries per
+    request, or a p50 latency slower by more than `tolerance`
+    """
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        if result["queries"] > previous["queries"]:
+            regressions.append(
+                "%s: %s queries per request, was %s"
+                % (name, result["queries"], previous["queries"])
+            )
+        if result["p50_ms"] > previous["p50_ms"] * (1 + tolerance):
+            regressions.append(
+                "%s: p50 %s ms, was %s ms"
+                % (name, result["p50_ms"], previous["p50_ms"])
+            )
+    return regressions
@@ -0,0 +1,131 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from rest_framework.response import Response
+
+from .instrumentation import record_cache
+
+CACHE_TTL = getattr(settings, "CACHE_TTL", DEFAULT_TIMEOUT)
+CACHE_LOCK_TIMEOUT = getattr(settings, "CACHE_LOCK_TIMEOUT", 10)
+CACHE_LOCK_WAIT = getattr(settings, "CACHE_LOCK_WAIT", 2)
+
+GENERATION_KEY = "generation:%s"
+GENERATION_TIME_KEY = "generation-time:%s"
+
+
+def get_generations(names):
+    """
+    Current generations of the named data sets.
+    A missing generation starts from the clock, so a generation lost
+    by the cache never repeats a value that keyed older pages.
+    """
+    keys = [GENERATION_KEY % name for name in names]
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time_ns(), timeout=None)
+        generations.update(cache.get_many(missing))
+    return [generations[key] for key in keys]
+
+
+def bump_generation(*names):
+    """Invalidates every page built from the named data sets"""
+    for name in names:
+        key = GENERATION_KEY % name
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+    cache.set_many({GENERATION_TIME_KEY % name: time.time() for name in names}, None)
+
+
+def get_last_modified(names):
+    """Time of the last change of the named data sets, None when unknown"""
+    keys = [GENERATION_TIME_KEY % name for name in names]
+    times = cache.get_many(keys)
+    if not keys or len(times) < len(keys):
+        return None
+    return max(times.values())
+
+
+def make_key(prefix, *parts):
+    digest = hashlib.sha1(repr(parts).encode()).hexdigest()
+    return "%s:%s" % (prefix, digest)
+
+
+def make_page_key(prefix, generations, user, request):
+    """Key of a list page, shared by the sync and the async views"""
+    return make_key(
+        prefix,
+        generations,
+        user,
+        request.build_absolute_uri(request.path),
+        sorted(request.GET.lists()),
+    )
+
+
+def get_or_build(key, build, timeout=CACHE_TTL):
+    """
+    Returns the cached value or builds it.
+    Only one worker builds a missing value, the others wait for it
+    instead of sending the same queries to the database.
+    """
+    value = cache.get(key)
+    record_cache(value is not None)
+    if value is not None:
+        return value
+    lock_key = "%s:lock" % key
+    if cache.add(lock_key, 1, timeout=CACHE_LOCK_TIMEOUT):
+        try:
+            value = build()
+            cache.set(key, value, timeout=timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+    deadline = time.monotonic() + CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = cache.get(key)
+        if value is not None:
+            return value
+    return build()
+
+
+class CachedListMixin:
+    """
+    Caches the serialized pages of a list view.
+    The key holds the generations of `cache_generations`, the
+    query parameters and the user returned by `get_cache_user`.
+    """
+
+    cache_prefix = None
+    cache_generations = ()
+    _cache_key = None
+
+    def get_cache_user(self):
+        """The user the page depends on, None for shared pages"""
+        return None
+
+    def get_cache_generations(self):
+        return self.cache_generations
+
+    def get_cache_key(self, request):
+        if self._cache_key is None:
+            self._cache_key = make_page_key(
+                self.cache_prefix,
+                get_generations(self.get_cache_generations()),
+                self.get_cache_user(),
+                request,
+            )
+        return self._cache_key
+
+    def list(self, request, *args, **kwargs):
+        data = get_or_build(
+            self.get_cache_key(request),
+            lambda: super(CachedListMixin, self).list(request, *args, **kwargs).data,
+        )
+        return Response(data)
@@ -0,0 +1,79 @@
+import hashlib
+import time
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+from .cache import get_last_modified
+
+
+def get_http_last_modified(last_modified):
+    """
+    The time of the last change in whole seconds, None while that second
+    is not over: a later change in the same second would keep the value
+    and a poll with If-Modified-Since would get a stale 304
+    """
+    if last_modified is None or int(last_modified) >= int(time.time()):
+        return None
+    return int(last_modified)
+
+
+class ConditionalListMixin:
+    """
+    Answers 304 Not Modified to the polls of a cached list view.
+    The validators come from the cache key and the generation times
+    of the page, the page itself is neither queried nor serialized.
+    """
+
+    def list(self, request, *args, **kwargs):
+        etag = quote_etag(self.get_cache_key(request).rsplit(":", 1)[-1])
+        last_modified = get_http_last_modified(
+            get_last_modified(self.get_cache_generations())
+        )
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if response is None:
+            response = super().list(request, *args, **kwargs)
+        response["ETag"] = etag
+        if last_modified is not None:
+            response["Last-Modified"] = http_date(last_modified)
+        return response
+
+
+class ConditionalUpdateMixin:
+    """
+    ETag on a detail view, updates are refused with
+    412 Precondition Failed when If-Match does not match it.
+    """
+
+    def get_etag(self, instance, data):
+        parts = [instance.pk, instance.time_update.isoformat(), sorted(data.items())]
+        return quote_etag(hashlib.sha1(repr(parts).encode()).hexdigest())
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        serializer = self.get_serializer(instance)
+        return Response(
+            serializer.data,
+            headers={"ETag": self.get_etag(instance, serializer.data)},
+        )
+
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop("partial", False)
+        instance = self.get_object()
+        if_match = request.headers.get("If-Match")
+        if if_match:
+            current = self.get_etag(instance, self.get_serializer(instance).data)
+            etags = parse_etags(if_match)
+            if "*" not in etags and current not in etags:
+                return Response(status=status.HTTP_412_PRECONDITION_FAILED)
+        serializer = self.get_serializer(instance, data=request.data, partial=partial)
+        serializer.is_valid(raise_exception=True)
+        self.perform_update(serializer)
+        return Response(
+            serializer.data,
+            headers={"ETag": self.get_etag(instance, serializer.data)},
+        )
@@ -0,0 +1,32 @@
+from django.db import connections
+
+from .instrumentation import registry
+
+
+class HealthCheckMixin:
+    """
+    Checks a persistent connection when a request first uses it, the
+    way CONN_HEALTH_CHECKS of Django 4.1 does: one that stopped working
+    is closed and a new one opened instead of failing the first query.
+    Connections the request never touches are neither checked nor
+    counted as reused.
+    """
+
+    health_check_done = True
+
+    def ensure_connection(self):
+        if self.connection is not None and not self.health_check_done:
+            self.health_check_done = True
+            if self.settings_dict.get("CONN_HEALTH_CHECKS") and not self.is_usable():
+                registry.increment("db_connections_broken")
+                self.close()
+            else:
+                registry.increment("db_connections_reused")
+        super().ensure_connection()
+
+
+def check_connections(**kwargs):
+    """The open connections are checked again on their next use"""
+    for connection in connections.all():
+        if connection.connection is not None:
+            connection.health_check_done = False
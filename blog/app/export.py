@@ -0,0 +1,94 @@
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Exists, F, OuterRef
+
+from .models import Post, ReadException, Subscribe
+
+EXPORT_CHUNK_SIZE = getattr(settings, "EXPORT_CHUNK_SIZE", 2000)
+EXPORT_TYPES = ("posts", "subscriptions", "reads")
+
+
+def get_posts(author=None, since=None):
+    posts = Post.objects.order_by("time_update", "id")
+    if author is not None:
+        posts = posts.filter(author__username=author)
+    if since is not None:
+        posts = posts.filter(time_update__gt=since)
+    return posts.values(
+        "id", "author__username", "title", "content", "time_create", "time_update"
+    )
+
+
+def get_subscriptions(author=None, since=None):
+    subscriptions = Subscribe.objects.order_by("id")
+    if author is not None:
+        subscriptions = subscriptions.filter(author__username=author)
+    return subscriptions.values("id", "author__username", "subscriber__username")
+
+
+def get_reads(author=None, since=None):
+    """Read posts of the exceptions, then the posts covered by the marks"""
+    exceptions = ReadException.objects.filter(is_read=True)
+    marked = (
+        Post.objects.annotate(
+            reader=F("author__author_post__subscriber"),
+            reader_username=F("author__author_post__subscriber__username"),
+            read_up_to=F("author__author_post__read_up_to"),
+        )
+        .filter(read_up_to__gte=F("time_create"))
+        .exclude(
+            Exists(
+                ReadException.objects.filter(
+                    user=OuterRef("reader"), post=OuterRef("pk"), is_read=False
+                )
+            )
+        )
+    )
+    if author is not None:
+        exceptions = exceptions.filter(post__author__username=author)
+        marked = marked.filter(author__username=author)
+    return (
+        exceptions.order_by()
+        .values("post_id", "user__username")
+        .union(marked.order_by().values("id", "reader_username"), all=True)
+    )
+
+
+EXPORT_QUERIES = {
+    "posts": get_posts,
+    "subscriptions": get_subscriptions,
+    "reads": get_reads,
+}
+
+# Output names of the exported columns
+EXPORT_NAMES = {
+    "author__username": "author",
+    "subscriber__username": "subscriber",
+    "user__username": "user",
+    "post_id": "post",
+}
+
+
+def encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(type(value))
+
+
+def export_lines(types=EXPORT_TYPES, author=None, since=None, chunk_size=None):
+    """
+    NDJSON lines of the exported rows, read through server-side cursors
+    so memory stays constant whatever the size of the tables.
+    Posts come in the order of `time_update`: the last one exported is
+    the watermark `since` of the next incremental export. Subscriptions
+    and reads have no time and are always exported in full.
+    """
+    for name in types:
+        rows = EXPORT_QUERIES[name](author=author, since=since)
+        for row in rows.iterator(chunk_size=chunk_size or EXPORT_CHUNK_SIZE):
+            line = {"type": name}
+            for column, value in row.items():
+                line[EXPORT_NAMES.get(column, column)] = value
+            yield json.dumps(line, ensure_ascii=False, default=encode) + "\n"
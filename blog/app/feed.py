@@ -0,0 +1,303 @@
+import heapq
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, Sum
+
+from .models import AuthorStats, FeedEntry, Post, Subscribe
+
+FEED_BATCH_SIZE = getattr(settings, "FEED_BATCH_SIZE", 1000)
+# Authors with this many subscribers switch to fan-out on read for good
+FEED_FAN_OUT_LIMIT = getattr(settings, "FEED_FAN_OUT_LIMIT", 10000)
+FEED_RECENT_POSTS = getattr(settings, "FEED_RECENT_POSTS", 200)
+
+RECENT_POSTS_KEY = "feed-recent:%s"
+
+
+def get_fan_out_on_read_authors(author_ids):
+    return set(
+        AuthorStats.objects.filter(
+            user_id__in=author_ids, fan_out_on_read=True
+        ).values_list("user_id", flat=True)
+    )
+
+
+def fan_out_posts(posts):
+    """Delivers posts created in bulk to the feeds, one query for all authors"""
+    by_author = defaultdict(list)
+    for post in posts:
+        by_author[post.author_id].append(post)
+    forget_recent_posts(by_author)
+    for author in get_fan_out_on_read_authors(by_author):
+        del by_author[author]
+    subscriptions = Subscribe.objects.filter(author_id__in=by_author).values_list(
+        "author_id", "subscriber_id"
+    )
+    entries = (
+        FeedEntry(
+            subscriber_id=subscriber, post_id=post.id, time_create=post.time_create
+        )
+        for author, subscriber in subscriptions.iterator(chunk_size=FEED_BATCH_SIZE)
+        for post in by_author[author]
+    )
+    _bulk_insert(entries)
+
+
+def backfill_subscriptions(pairs):
+    """
+    Copies the posts of the authors into the feeds of subscriptions
+    created in bulk, given as (author_id, subscriber_id) pairs
+    """
+    subscribers = defaultdict(list)
+    for author, subscriber in pairs:
+        subscribers[author].append(subscriber)
+    for author in get_fan_out_on_read_authors(subscribers):
+        del subscribers[author]
+    posts = Post.objects.filter(author_id__in=subscribers).values_list(
+        "author_id", "id", "time_create"
+    )
+    entries = (
+        FeedEntry(subscriber_id=subscriber, post_id=post_id, time_create=time_create)
+        for author, post_id, time_create in posts.iterator(chunk_size=FEED_BATCH_SIZE)
+        for subscriber in subscribers[author]
+    )
+    _bulk_insert(entries)
+
+
+def trim_subscriptions(subscriber_id, author_ids):
+    """Removes the posts of the authors from the feed of the former subscriber"""
+    FeedEntry.objects.filter(
+        subscriber_id=subscriber_id, post__author_id__in=author_ids
+    ).delete()
+
+
+def rebuild_feed(subscriber_ids=None):
+    """
+    Recreates the feed entries from the subscriptions.
+    Returns the number of subscriptions processed.
+    """
+    subscriptions = Subscribe.objects.all()
+    entries = FeedEntry.objects.all()
+    if subscriber_ids is not None:
+        subscriptions = subscriptions.filter(subscriber_id__in=subscriber_ids)
+        entries = entries.filter(subscriber_id__in=subscriber_ids)
+    entries.delete()
+    count = 0
+    pairs = []
+    for pair in subscriptions.values_list("author_id", "subscriber_id").iterator(
+        chunk_size=FEED_BATCH_SIZE
+    ):
+        pairs.append(pair)
+        if len(pairs) >= FEED_BATCH_SIZE:
+            backfill_subscriptions(pairs)
+            count += len(pairs)
+            pairs = []
+    if pairs:
+        backfill_subscriptions(pairs)
+    return count + len(pairs)
+
+
+def forget_recent_posts(author_ids):
+    """
+    Once the transaction commits, before that a concurrent read would
+    cache the posts again without the change
+    """
+    keys = [RECENT_POSTS_KEY % author for author in author_ids]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def get_recent_posts(author_ids):
+    """
+    Keys (time_create, id) of the latest FEED_RECENT_POSTS posts of
+    each author, newest first, kept in the cache until the author
+    creates or deletes a post
+    """
+    keys = {author: RECENT_POSTS_KEY % author for author in author_ids}
+    cached = cache.get_many(keys.values())
+    recent = {}
+    for author, key in keys.items():
+        if key not in cached:
+            cached[key] = list(
+                Post.objects.filter(author_id=author)
+                .order_by("-time_create", "-id")
+                .values_list("time_create", "id")[:FEED_RECENT_POSTS]
+            )
+            cache.set(key, cached[key])
+        recent[author] = cached[key]
+    return recent
+
+
+def _before(position, time_field, id_field):
+    """Rows after the position in the newest first order"""
+    time_create, post_id = position
+    return Q(**{"%s__lte" % time_field: time_create}) & (
+        Q(**{"%s__lt" % time_field: time_create})
+        | Q(**{time_field: time_create, "%s__lt" % id_field: post_id})
+    )
+
+
+def _stream(queryset, time_field, id_field, position, chunk_size):
+    """Keys of the queryset after the position, fetched in chunks"""
+    queryset = queryset.order_by("-%s" % time_field, "-%s" % id_field).values_list(
+        time_field, id_field
+    )
+    while True:
+        rows = queryset
+        if position is not None:
+            rows = rows.filter(_before(position, time_field, id_field))
+        rows = list(rows[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        position = rows[-1]
+
+
+def _author_stream(author, recent, position, chunk_size):
+    """The cached recent posts of the author, then older ones in chunks"""
+    for key in recent:
+        if position is None or key < position:
+            yield key
+    if len(recent) == FEED_RECENT_POSTS:
+        if position is None or recent[-1] < position:
+            position = recent[-1]
+        yield from _stream(
+            Post.objects.filter(author_id=author),
+            "time_create",
+            "id",
+            position,
+            chunk_size,
+        )
+
+
+class MergedFeed:
+    """
+    Feed of a subscriber following authors with fan-out on read.
+    Their recent posts are merged with the materialized feed entries
+    by a k-way merge on (time_create, id), which stops as soon as the
+    requested slice is filled. The work per page follows the page size,
+    not the number of subscriptions or posts.
+    It stands in for the feed queryset: it slices into `.values()` rows
+    with `feed_time` and `feed_post`, counts, and resumes after a
+    cursor position.
+    """
+
+    ordered = True
+
+    def __init__(
+        self, subscriber, authors, columns=(), position=None, annotations=None
+    ):
+        self.subscriber = subscriber
+        self.authors = authors
+        self.columns = columns
+        self.position = position
+        self.annotations = annotations or {}
+
+    def _clone(self, **kwargs):
+        options = {
+            "columns": self.columns,
+            "position": self.position,
+            "annotations": self.annotations,
+            **kwargs,
+        }
+        return MergedFeed(self.subscriber, self.authors, **options)
+
+    def annotate(self, **annotations):
+        """Expressions computed for the rows of the page only"""
+        return self._clone(annotations={**self.annotations, **annotations})
+
+    def values(self, *columns):
+        """feed_time and feed_post come from the merged keys"""
+        return self._clone(
+            columns=[
+                column for column in columns if column not in ("feed_time", "feed_post")
+            ]
+        )
+
+    def order_by(self, *fields):
+        """The order is always the newest first"""
+        return self
+
+    def resume(self, position):
+        return self._clone(position=tuple(position))
+
+    def count(self):
+        """The feed entries plus the counters of the authors, without a scan"""
+        entries = (
+            FeedEntry.objects.filter(subscriber=self.subscriber)
+            .exclude(post__author_id__in=self.authors)
+            .count()
+        )
+        posts = AuthorStats.objects.filter(user_id__in=self.authors).aggregate(
+            count=Sum("post_count")
+        )["count"]
+        return entries + (posts or 0)
+
+    def keys(self, limit):
+        chunk_size = min(limit, FEED_BATCH_SIZE)
+        recent = get_recent_posts(self.authors)
+        streams = [
+            _stream(
+                FeedEntry.objects.filter(subscriber=self.subscriber),
+                "time_create",
+                "post_id",
+                self.position,
+                chunk_size,
+            )
+        ] + [
+            _author_stream(author, recent[author], self.position, chunk_size)
+            for author in self.authors
+        ]
+        keys = []
+        for key in heapq.merge(*streams, reverse=True):
+            # Entries delivered before the author switched are in both
+            if not keys or keys[-1] != key:
+                keys.append(key)
+                if len(keys) == limit:
+                    break
+        return keys
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice) or index.stop is None or index.step:
+            raise TypeError("MergedFeed only supports bounded slices")
+        keys = self.keys(index.stop)[index.start or 0 :]
+        rows = {
+            row["id"]: row
+            for row in Post.objects.filter(id__in=[key[1] for key in keys])
+            .annotate(**self.annotations)
+            .values(*self.columns)
+        }
+        page = []
+        for time_create, post_id in keys:
+            if post_id in rows:
+                page.append(
+                    dict(rows[post_id], feed_time=time_create, feed_post=post_id)
+                )
+        return page
+
+
+def get_feed(subscriber):
+    """
+    Merged feed of the subscriber, None without authors with fan-out
+    on read in the subscriptions
+    """
+    authors = list(
+        Subscribe.objects.filter(
+            subscriber=subscriber, author__stats__fan_out_on_read=True
+        ).values_list("author_id", flat=True)
+    )
+    if not authors:
+        return None
+    return MergedFeed(subscriber, authors)
+
+
+def _bulk_insert(entries):
+    batch = []
+    for entry in entries:
+        batch.append(entry)
+        if len(batch) >= FEED_BATCH_SIZE:
+            FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    if batch:
+        FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
@@ -0,0 +1,286 @@
+import csv
+import io
+import json
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+
+from . import tasks, unread
+from .cache import bump_generation
+from .feed import forget_recent_posts
+from .models import Post, Subscribe
+from .reads import set_read_status
+from .search import is_supported
+from .serializers import (
+    PostImportSerializer,
+    ReadImportSerializer,
+    SubscribeImportSerializer,
+    UserImportSerializer,
+)
+from .stats import reconcile_author_stats
+
+IMPORT_BATCH_SIZE = getattr(settings, "IMPORT_BATCH_SIZE", 1000)
+
+# In the order of their dependencies
+IMPORT_SERIALIZERS = {
+    "users": UserImportSerializer,
+    "posts": PostImportSerializer,
+    "subscriptions": SubscribeImportSerializer,
+    "reads": ReadImportSerializer,
+}
+IMPORT_TYPES = tuple(IMPORT_SERIALIZERS)
+
+
+def insert_ignoring_conflicts(model, columns, rows):
+    """
+    Inserts the rows, those breaking a unique constraint are skipped.
+    Postgres gets them through COPY into a temporary table dropped with
+    the transaction. Returns the number of rows inserted.
+    """
+    if connection.vendor != "postgresql":
+        rows = set(map(tuple, rows))
+        existing = model.objects.filter(
+            **{"%s__in" % columns[0]: {row[0] for row in rows}}
+        ).values_list(*columns)
+        rows -= set(existing)
+        model.objects.bulk_create(
+            [model(**dict(zip(columns, row))) for row in rows],
+            batch_size=IMPORT_BATCH_SIZE,
+            ignore_conflicts=True,
+        )
+        return len(rows)
+    table = connection.ops.quote_name(model._meta.db_table)
+    names = ", ".join(connection.ops.quote_name(column) for column in columns)
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE TEMPORARY TABLE import_rows ON COMMIT DROP AS "
+            "SELECT %s FROM %s WITH NO DATA" % (names, table)
+        )
+        cursor.copy_expert(
+            "COPY import_rows (%s) FROM STDIN WITH (FORMAT csv)" % names, buffer
+        )
+        cursor.execute(
+            "INSERT INTO %s (%s) SELECT %s FROM import_rows ON CONFLICT DO NOTHING"
+            % (table, names, names)
+        )
+        inserted = cursor.rowcount
+        # Another call in the same transaction creates it again
+        cursor.execute("DROP TABLE import_rows")
+    return inserted
+
+
+def get_user_ids(usernames):
+    return dict(
+        User.objects.filter(username__in=set(usernames)).values_list("username", "id")
+    )
+
+
+class Importer:
+    """
+    Imports users, posts, subscriptions and read events in batches.
+    Rows are validated with the serializer rules, references and
+    uniqueness are resolved with one query per batch, and feeds,
+    author counters and cached pages are refreshed once per batch
+    (feeds and search vectors by background tasks).
+    Invalid rows are skipped and reported with their line, subscriptions
+    and read events that exist already are skipped silently.
+    Post ids of the imported data are mapped to the created posts,
+    other post ids of read events refer to existing posts.
+    Imports are append-only: a post imported twice is created twice.
+    """
+
+    def __init__(self, batch_size=IMPORT_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.pending = {name: [] for name in IMPORT_TYPES}
+        self.imported = dict.fromkeys(IMPORT_TYPES, 0)
+        self.errors = []
+        self.post_ids = {}
+
+    def import_ndjson(self, lines):
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+                name = data.pop("type")
+            except (ValueError, TypeError, KeyError, AttributeError):
+                self.add_error(
+                    number, None, "Invalid line, expected a JSON object with a type"
+                )
+                continue
+            self.add(number, name, data)
+        return self.finish()
+
+    def import_csv(self, lines, name):
+        reader = csv.DictReader(lines)
+        for data in reader:
+            self.add(reader.line_num, name, data)
+        return self.finish()
+
+    def add(self, number, name, data):
+        if name not in IMPORT_SERIALIZERS:
+            self.add_error(
+                number,
+                name,
+                "Unknown type, expected one of %s" % ", ".join(IMPORT_TYPES),
+            )
+            return
+        serializer = IMPORT_SERIALIZERS[name](data=data)
+        if not serializer.is_valid():
+            self.add_error(number, name, serializer.errors)
+            return
+        try:
+            source_id = int(data.get("id"))
+        except (TypeError, ValueError):
+            source_id = None
+        self.pending[name].append((number, serializer.validated_data, source_id))
+        if sum(len(rows) for rows in self.pending.values()) >= self.batch_size:
+            self.flush()
+
+    def add_error(self, number, name, errors):
+        self.errors.append({"line": number, "type": name, "errors": errors})
+
+    def flush(self):
+        with transaction.atomic():
+            for name in IMPORT_TYPES:
+                rows = self.pending[name]
+                if rows:
+                    getattr(self, "import_%s" % name)(rows)
+                    self.pending[name] = []
+
+    def finish(self):
+        self.flush()
+        self.errors.sort(key=lambda error: error["line"])
+        return {"imported": self.imported, "errors": self.errors}
+
+    def import_users(self, rows):
+        existing = set(get_user_ids(data["username"] for _, data, _ in rows))
+        password = make_password(None)
+        users = []
+        for number, data, _ in rows:
+            if data["username"] in existing:
+                self.add_error(
+                    number,
+                    "users",
+                    {"username": ["A user with that username already exists."]},
+                )
+                continue
+            existing.add(data["username"])
+            users.append(User(password=password, **data))
+        User.objects.bulk_create(users, batch_size=self.batch_size)
+        reconcile_author_stats(
+            list(get_user_ids(user.username for user in users).values())
+        )
+        self.imported["users"] += len(users)
+        bump_generation("user")
+
+    def import_posts(self, rows):
+        authors = get_user_ids(data["author"] for _, data, _ in rows)
+        posts = []
+        times = []
+        source_ids = []
+        for number, data, source_id in rows:
+            if data["author"] not in authors:
+                self.add_error(number, "posts", {"author": ["Unknown author."]})
+                continue
+            posts.append(
+                Post(
+                    title=data["title"],
+                    content=data["content"],
+                    author_id=authors[data["author"]],
+                )
+            )
+            times.append(
+                {
+                    field: data[field]
+                    for field in ("time_create", "time_update")
+                    if field in data
+                }
+            )
+            source_ids.append(source_id)
+        Post.objects.bulk_create(posts, batch_size=self.batch_size)
+        # The insert sets the auto times to now, the source times are
+        # written afterwards by an update that does not run pre_save
+        dated = []
+        for post, post_times in zip(posts, times):
+            if post_times:
+                for field, value in post_times.items():
+                    setattr(post, field, value)
+                dated.append(post)
+        Post.objects.bulk_update(
+            dated, ["time_create", "time_update"], batch_size=self.batch_size
+        )
+        for post, source_id in zip(posts, source_ids):
+            if source_id is not None:
+                self.post_ids[source_id] = post.id
+        post_ids = [post.id for post in posts]
+        authors = list({post.author_id for post in posts})
+        forget_recent_posts(authors)
+        tasks.enqueue("fan_out_posts", post_ids=post_ids)
+        if is_supported():
+            tasks.enqueue("index_posts", post_ids=post_ids)
+        unread.posts_created(posts)
+        reconcile_author_stats(authors)
+        self.imported["posts"] += len(posts)
+        bump_generation("post")
+
+    def import_subscriptions(self, rows):
+        users = get_user_ids(
+            username
+            for _, data, _ in rows
+            for username in (data["author"], data["subscriber"])
+        )
+        pairs = []
+        for number, data, _ in rows:
+            unknown = {
+                field: ["Unknown user."]
+                for field in ("author", "subscriber")
+                if data[field] not in users
+            }
+            if unknown:
+                self.add_error(number, "subscriptions", unknown)
+                continue
+            pairs.append((users[data["author"]], users[data["subscriber"]]))
+        inserted = insert_ignoring_conflicts(
+            Subscribe, ("author_id", "subscriber_id"), pairs
+        )
+        tasks.enqueue("backfill_subscriptions", pairs=pairs)
+        unread.rebuild_unread_counters(
+            {subscriber for _, subscriber in pairs}, {author for author, _ in pairs}
+        )
+        reconcile_author_stats(list({author for author, _ in pairs}))
+        self.imported["subscriptions"] += inserted
+        bump_generation("subscribe")
+
+    def import_reads(self, rows):
+        users = get_user_ids(data["user"] for _, data, _ in rows)
+        post_ids = {
+            data["post"]: self.post_ids.get(data["post"], data["post"])
+            for _, data, _ in rows
+        }
+        existing = set(
+            Post.objects.filter(id__in=post_ids.values()).values_list("id", flat=True)
+        )
+        reads = []
+        for number, data, _ in rows:
+            errors = {}
+            if data["user"] not in users:
+                errors["user"] = ["Unknown user."]
+            if post_ids[data["post"]] not in existing:
+                errors["post"] = ["Unknown post."]
+            if errors:
+                self.add_error(number, "reads", errors)
+                continue
+            reads.append((post_ids[data["post"]], users[data["user"]]))
+        posts_by_user = defaultdict(list)
+        for post_id, user_id in reads:
+            posts_by_user[user_id].append(post_id)
+        for user_id, user_post_ids in posts_by_user.items():
+            set_read_status(User(id=user_id), user_post_ids, True)
+        self.imported["reads"] += len(reads)
@@ -0,0 +1,185 @@
+import heapq
+import itertools
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+SLOWEST_KEPT = getattr(settings, "INSTRUMENTATION_SLOWEST_KEPT", 20)
+SQL_KEPT = getattr(settings, "INSTRUMENTATION_SQL_KEPT", 50)
+
+_current = ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    """Measures of the request in progress"""
+
+    __slots__ = (
+        "start",
+        "queries",
+        "db_time",
+        "cache_hits",
+        "cache_misses",
+        "sql",
+        "render_start",
+        "render_time",
+        "serialize_time",
+    )
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.sql = []
+        self.render_start = None
+        self.render_time = 0.0
+        self.serialize_time = 0.0
+
+
+def start_request():
+    stats = RequestStats()
+    return stats, _current.set(stats)
+
+
+def end_request(token):
+    _current.reset(token)
+
+
+def get_current():
+    return _current.get()
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper, a no-op outside an instrumented request"""
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.db_time += time.perf_counter() - start
+        stats.queries += 1
+        if len(stats.sql) < SQL_KEPT:
+            stats.sql.append(sql)
+
+
+def install_query_recorder(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def record_serialization():
+    """Times the block as serialization, its queries count as db time"""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    start = time.perf_counter()
+    db_time = stats.db_time
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start - (stats.db_time - db_time)
+        stats.serialize_time += max(elapsed, 0)
+
+
+def record_cache(hit):
+    stats = _current.get()
+    if stats is not None:
+        if hit:
+            stats.cache_hits += 1
+        else:
+            stats.cache_misses += 1
+
+
+class Registry:
+    """In-process aggregates of the instrumented requests"""
+
+    fields = (
+        "requests",
+        "duration_ms",
+        "db_ms",
+        "queries",
+        "cache_hits",
+        "cache_misses",
+        "render_ms",
+        "serialize_ms",
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.totals = defaultdict(lambda: dict.fromkeys(self.fields, 0))
+            self.counters = defaultdict(int)
+            self.slowest = []
+            self.sequence = itertools.count()
+
+    def add(self, route, method, status, stats, duration):
+        with self.lock:
+            totals = self.totals[(route, method, status)]
+            totals["requests"] += 1
+            totals["duration_ms"] += duration * 1000
+            totals["db_ms"] += stats.db_time * 1000
+            totals["queries"] += stats.queries
+            totals["cache_hits"] += stats.cache_hits
+            totals["cache_misses"] += stats.cache_misses
+            totals["render_ms"] += stats.render_time * 1000
+            totals["serialize_ms"] += stats.serialize_time * 1000
+            entry = (duration, next(self.sequence), route, method, status, stats)
+            if len(self.slowest) < SLOWEST_KEPT:
+                heapq.heappush(self.slowest, entry)
+            elif duration > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, entry)
+
+    def increment(self, name, value=1):
+        """Process-wide counter such as database connections"""
+        with self.lock:
+            self.counters[name] += value
+
+    def get_slowest(self):
+        with self.lock:
+            slowest = sorted(self.slowest, reverse=True)
+        return [
+            {
+                "route": route,
+                "method": method,
+                "status": status,
+                "duration_ms": round(duration * 1000, 3),
+                "db_ms": round(stats.db_time * 1000, 3),
+                "queries": stats.queries,
+                "sql": stats.sql,
+            }
+            for duration, _, route, method, status, stats in slowest
+        ]
+
+    def render_prometheus(self):
+        with self.lock:
+            totals = {key: dict(value) for key, value in self.totals.items()}
+            counters = dict(self.counters)
+        lines = []
+        for field in self.fields:
+            name = "blog_%s_total" % field
+            lines.append("# TYPE %s counter" % name)
+            for (route, method, status), values in sorted(totals.items()):
+                lines.append(
+                    '%s{route="%s",method="%s",status="%s"} %s'
+                    % (name, route, method, status, round(values[field], 3))
+                )
+        for counter, value in sorted(counters.items()):
+            name = "blog_%s_total" % counter
+            lines.append("# TYPE %s counter" % name)
+            lines.append("%s %s" % (name, value))
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
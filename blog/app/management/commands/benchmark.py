@@ -0,0 +1,107 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import (
+    override_settings,
+    setup_test_environment,
+    teardown_test_environment,
+)
+
+from app import benchmark
+
+LOCAL_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+
+
+class Command(BaseCommand):
+    help = (
+        "Seeds a test database and measures latency, queries per request "
+        "and throughput of every API route, the CPU time of serializing "
+        "a page and the overhead of rate limiting, results are written as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--posts", type=int, default=1000)
+        parser.add_argument(
+            "--follows", type=int, default=20, help="Authors followed per user"
+        )
+        parser.add_argument(
+            "--alpha", type=float, default=1.2, help="Power-law exponent of follows"
+        )
+        parser.add_argument("--read-ratio", type=float, default=0.3)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--requests", type=int, default=50)
+        parser.add_argument("--warmup", type=int, default=5)
+        parser.add_argument(
+            "--cold", action="store_true", help="Clear the cache before each request"
+        )
+        parser.add_argument(
+            "--redis",
+            action="store_true",
+            help="Use the configured cache instead of a local in-memory one",
+        )
+        parser.add_argument("--route", action="append", dest="routes")
+        parser.add_argument(
+            "--page-size",
+            type=int,
+            default=100,
+            help="Rows per page of the serialization measure",
+        )
+        parser.add_argument("--output", help="File for the JSON results")
+        parser.add_argument("--compare", help="JSON results of a baseline run")
+        parser.add_argument("--tolerance", type=float, default=0.2)
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options["compare"]:
+            with open(options["compare"]) as file:
+                baseline = json.load(file)["routes"]
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            with override_settings(
+                **({} if options["redis"] else {"CACHES": LOCAL_CACHES})
+            ):
+                data = benchmark.seed(
+                    users=options["users"],
+                    posts=options["posts"],
+                    follows=options["follows"],
+                    alpha=options["alpha"],
+                    read_ratio=options["read_ratio"],
+                    seed=options["seed"],
+                )
+                routes = benchmark.run(
+                    requests=options["requests"],
+                    warmup=options["warmup"],
+                    cold=options["cold"],
+                    routes=options["routes"],
+                )
+                serialization = benchmark.serialization(
+                    page_size=options["page_size"], repeat=options["requests"]
+                )
+                rate_limiting = benchmark.rate_limiting()
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        results = {
+            "database": connection.vendor,
+            "cold_cache": options["cold"],
+            "data": data,
+            "routes": routes,
+            "serialization": serialization,
+            "rate_limiting": rate_limiting,
+        }
+        output = json.dumps(results, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as file:
+                file.write(output + "\n")
+        else:
+            self.stdout.write(output)
+        if baseline is not None:
+            regressions = benchmark.compare(routes, baseline, options["tolerance"])
+            for regression in regressions:
+                sys.stderr.write(regression + "\n")
+            if regressions:
+                raise CommandError("%s regressions" % len(regressions))
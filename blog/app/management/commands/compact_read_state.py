@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from app.reads import compact_read_state
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves the read_up_to marks of the subscriptions over the posts "
+        "read in a row and drops the read exceptions they cover"
+    )
+
+    def handle(self, *args, **options):
+        dropped = compact_read_state()
+        self.stdout.write(self.style.SUCCESS("%s read exceptions dropped" % dropped))
@@ -0,0 +1,114 @@
+import re
+from types import SimpleNamespace
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from app.models import Post, Subscribe
+from app.reads import get_read_posts
+from app.service import KeysetPagination, get_row_value
+from app.views import PostAPIViews, PostSubscribeListViews, UserListViews
+
+# Plan lines that mean a full scan or a sort on a hot path
+BAD_PLAN_PATTERNS = {
+    "postgresql": [re.compile(r"Seq Scan"), re.compile(r"\bSort\b")],
+    "sqlite": [
+        re.compile(r"\bSCAN (?!.*USING (COVERING )?INDEX)"),
+        re.compile(r"USE TEMP B-TREE"),
+    ],
+}
+
+
+def get_view_queryset(view_class, user):
+    request = SimpleNamespace(user=user, auth=True)
+    return view_class(request=request, format_kwarg=None).get_queryset()
+
+
+def get_next_page(queryset, ordering, row):
+    pagination = KeysetPagination()
+    pagination.fields = ordering
+    position = [get_row_value(row, field.lstrip("-")) for field in ordering]
+    return queryset.filter(pagination.get_position_filter(position))
+
+
+def get_hot_paths(user):
+    """The queries behind the views, as a page of each is read"""
+    posts = get_view_queryset(PostAPIViews, user).order_by(*KeysetPagination.ordering)
+    feed = get_view_queryset(PostSubscribeListViews, user)
+    authors = get_view_queryset(UserListViews, user)
+    paths = [
+        ("posts except own", posts[:10]),
+        (
+            "posts by author",
+            Post.objects.filter(author=user).order_by("-time_create", "-id")[:10],
+        ),
+        ("feed page", feed[:10]),
+        ("subscriptions", Subscribe.objects.filter(subscriber=user)),
+        ("authors by posts", authors.order_by("-count_post")[:10]),
+        ("authors with posts", authors.filter(count_post=1)[:10]),
+        (
+            "read status",
+            get_read_posts(user, feed.values_list("id", flat=True)[:10]),
+        ),
+    ]
+    if posts:
+        next_posts = get_next_page(posts, KeysetPagination.ordering, posts[0])
+        paths.append(("posts next page", next_posts[:10]))
+    if feed:
+        next_feed = get_next_page(feed, PostSubscribeListViews.cursor_ordering, feed[0])
+        paths.append(("feed next page", next_feed[:10]))
+    return paths
+
+
+class Command(BaseCommand):
+    help = (
+        "Runs EXPLAIN for the queries of the hot paths "
+        "and fails when a sequential scan or a sort appears"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--username",
+            help="User whose feed is explained (a subscriber by default)",
+        )
+
+    def handle(self, *args, **options):
+        patterns = BAD_PLAN_PATTERNS.get(connection.vendor)
+        if patterns is None:
+            raise CommandError(
+                "EXPLAIN checks are not defined for %s" % connection.vendor
+            )
+        user = self.get_user(options["username"])
+        failures = []
+        with transaction.atomic():
+            if connection.vendor == "postgresql":
+                # Small seeded tables would be scanned whatever the indexes
+                with connection.cursor() as cursor:
+                    cursor.execute("SET LOCAL enable_seqscan = off")
+            for name, queryset in get_hot_paths(user):
+                plan = queryset.explain()
+                bad = [
+                    line
+                    for line in plan.splitlines()
+                    if any(pattern.search(line) for pattern in patterns)
+                ]
+                status = self.style.ERROR("FAIL") if bad else self.style.SUCCESS("OK")
+                self.stdout.write("%s %s" % (status, name))
+                if bad or options["verbosity"] > 1:
+                    self.stdout.write(plan)
+                if bad:
+                    failures.append(name)
+        if failures:
+            raise CommandError("Full scan or sort on: %s" % ", ".join(failures))
+
+    def get_user(self, username):
+        users = User.objects.all()
+        if username:
+            users = users.filter(username=username)
+        else:
+            users = users.filter(subscriber__isnull=False)
+        user = users.first()
+        if user is None:
+            raise CommandError("No user to explain the queries for, seed data first")
+        return user
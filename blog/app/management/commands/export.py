@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from app.export import EXPORT_CHUNK_SIZE, EXPORT_TYPES, export_lines
+
+
+class Command(BaseCommand):
+    help = "Streams posts, subscriptions and read events as NDJSON"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--type",
+            action="append",
+            dest="types",
+            choices=EXPORT_TYPES,
+            help="Exported rows, repeat for several (all by default)",
+        )
+        parser.add_argument("--author", help="Username of the author")
+        parser.add_argument(
+            "--since",
+            help="Only posts updated after this ISO 8601 time (the watermark)",
+        )
+        parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+        parser.add_argument("--output", help="File for the NDJSON (stdout by default)")
+
+    def handle(self, *args, **options):
+        since = None
+        if options["since"]:
+            since = parse_datetime(options["since"])
+            if since is None:
+                raise CommandError("Invalid --since %s" % options["since"])
+            if timezone.is_naive(since):
+                since = timezone.make_aware(since)
+        lines = export_lines(
+            [
+                name
+                for name in EXPORT_TYPES
+                if name in (options["types"] or EXPORT_TYPES)
+            ],
+            author=options["author"],
+            since=since,
+            chunk_size=options["chunk_size"],
+        )
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                file.writelines(lines)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending="")
@@ -0,0 +1,51 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.importer import IMPORT_BATCH_SIZE, IMPORT_TYPES, Importer
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports users, posts, subscriptions and read events in batches "
+        "from NDJSON (the export format) or CSV files"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="NDJSON or CSV file")
+        parser.add_argument(
+            "--format",
+            choices=("ndjson", "csv"),
+            help="Format of the file (guessed from its extension by default)",
+        )
+        parser.add_argument("--type", choices=IMPORT_TYPES, help="Rows of a CSV file")
+        parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or (
+            "csv" if options["path"].endswith(".csv") else "ndjson"
+        )
+        if file_format == "csv" and not options["type"]:
+            raise CommandError("--type is required for CSV files")
+        importer = Importer(batch_size=options["batch_size"])
+        with open(options["path"], encoding="utf-8", newline="") as file:
+            if file_format == "csv":
+                report = importer.import_csv(file, options["type"])
+            else:
+                report = importer.import_ndjson(file)
+        for error in report["errors"]:
+            self.stderr.write(
+                "Line %s (%s): %s"
+                % (error["line"], error["type"], json.dumps(error["errors"]))
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Imported %s"
+                % ", ".join(
+                    "%s %s" % (count, name)
+                    for name, count in report["imported"].items()
+                )
+            )
+        )
+        if report["errors"]:
+            raise CommandError("%s invalid rows" % len(report["errors"]))
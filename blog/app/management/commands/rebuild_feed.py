@@ -0,0 +1,31 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app.cache import bump_generation
+from app.feed import rebuild_feed
+
+
+class Command(BaseCommand):
+    help = "Rebuilds the materialized subscription feeds"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "usernames",
+            nargs="*",
+            help="Subscribers whose feeds are rebuilt (all by default)",
+        )
+
+    def handle(self, *args, **options):
+        subscriber_ids = None
+        if options["usernames"]:
+            users = User.objects.filter(username__in=options["usernames"])
+            subscriber_ids = list(users.values_list("id", flat=True))
+            if len(subscriber_ids) != len(set(options["usernames"])):
+                raise CommandError("Unknown subscriber in %s" % options["usernames"])
+        with transaction.atomic():
+            count = rebuild_feed(subscriber_ids)
+        bump_generation("subscribe")
+        self.stdout.write(
+            self.style.SUCCESS("Feeds rebuilt from %s subscriptions" % count)
+        )
@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app.unread import rebuild_unread_counters
+
+
+class Command(BaseCommand):
+    help = "Recounts the unread posts of the subscriptions"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "usernames",
+            nargs="*",
+            help="Subscribers whose counters are rebuilt (all by default)",
+        )
+
+    def handle(self, *args, **options):
+        subscriber_ids = None
+        if options["usernames"]:
+            users = User.objects.filter(username__in=options["usernames"])
+            subscriber_ids = list(users.values_list("id", flat=True))
+            if len(subscriber_ids) != len(set(options["usernames"])):
+                raise CommandError("Unknown subscriber in %s" % options["usernames"])
+        with transaction.atomic():
+            count = rebuild_unread_counters(subscriber_ids)
+        self.stdout.write(
+            self.style.SUCCESS("Unread counters rebuilt for %s subscriptions" % count)
+        )
@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from app.cache import bump_generation
+from app.stats import reconcile_author_stats
+
+
+class Command(BaseCommand):
+    help = "Recounts the post and subscriber counters of the authors"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            created, drifted = reconcile_author_stats()
+        bump_generation("user")
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Counters created for %s authors, repaired for %s authors"
+                % (created, drifted)
+            )
+        )
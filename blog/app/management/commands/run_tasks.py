@@ -0,0 +1,65 @@
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from app.tasks import purge_jobs, run_jobs
+
+
+class Command(BaseCommand):
+    help = "Runs the background jobs queued by the database task backend"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, default=1, help="Worker threads")
+        parser.add_argument(
+            "--batch-size", type=int, default=100, help="Jobs claimed at once"
+        )
+        parser.add_argument(
+            "--sleep", type=float, default=1.0, help="Seconds to wait when idle"
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when no job is due"
+        )
+
+    def handle(self, *args, **options):
+        self.totals = [0, 0]
+        self.lock = threading.Lock()
+        try:
+            if options["concurrency"] == 1:
+                self.work(options)
+            else:
+                workers = [
+                    threading.Thread(target=self.thread, args=(options,), daemon=True)
+                    for _ in range(options["concurrency"])
+                ]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    while worker.is_alive():
+                        worker.join(0.5)
+        except KeyboardInterrupt:
+            pass
+        done, failed = self.totals
+        self.stdout.write(
+            self.style.SUCCESS("%s jobs done, %s failed" % (done, failed))
+        )
+
+    def thread(self, options):
+        try:
+            self.work(options)
+        finally:
+            connections.close_all()
+
+    def work(self, options):
+        while True:
+            done, failed = run_jobs(options["batch_size"])
+            with self.lock:
+                self.totals[0] += done
+                self.totals[1] += failed
+            if done or failed:
+                continue
+            if options["once"]:
+                return
+            purge_jobs()
+            time.sleep(options["sleep"])
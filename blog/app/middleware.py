@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+from rest_framework.permissions import SAFE_METHODS
+
+from .instrumentation import end_request, get_current, registry, start_request
+from .routers import pin_to_primary
+
+SAMPLE_RATE = getattr(settings, "INSTRUMENTATION_SAMPLE_RATE", 1.0)
+SLOW_REQUEST_MS = getattr(settings, "SLOW_REQUEST_MS", 500)
+
+logger = logging.getLogger("app.slow_requests")
+
+
+class InstrumentationMiddleware(MiddlewareMixin):
+    """
+    Records database queries and time, cache hits and misses,
+    serialization and render time of a sample of requests. They are sent back in the
+    Server-Timing header and added to the in-process registry,
+    the SQL of slow requests is logged.
+    """
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        if random.random() >= SAMPLE_RATE:
+            return self.get_response(request)
+        stats, token = start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(request, response, stats)
+
+    async def __acall__(self, request):
+        if random.random() >= SAMPLE_RATE:
+            return await self.get_response(request)
+        stats, token = start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(request, response, stats)
+
+    def process_template_response(self, request, response):
+        """The response is rendered right after this hook"""
+        stats = get_current()
+        if stats is not None:
+            stats.render_start = time.perf_counter()
+            response.add_post_render_callback(self.rendered)
+        return response
+
+    def rendered(self, response):
+        stats = get_current()
+        if stats is not None and stats.render_start is not None:
+            stats.render_time = time.perf_counter() - stats.render_start
+
+    def finish(self, request, response, stats):
+        duration = time.perf_counter() - stats.start
+        app_time = max(
+            duration - stats.db_time - stats.serialize_time - stats.render_time, 0
+        )
+        response["Server-Timing"] = ", ".join(
+            [
+                'db;dur=%.2f;desc="%s queries"' % (stats.db_time * 1000, stats.queries),
+                'cache;desc="%s hits, %s misses"'
+                % (stats.cache_hits, stats.cache_misses),
+                "app;dur=%.2f" % (app_time * 1000),
+                "serialize;dur=%.2f" % (stats.serialize_time * 1000),
+                "render;dur=%.2f" % (stats.render_time * 1000),
+                "total;dur=%.2f" % (duration * 1000),
+            ]
+        )
+        match = request.resolver_match
+        route = match.route if match else "unmatched"
+        registry.add(route, request.method, response.status_code, stats, duration)
+        if duration * 1000 >= SLOW_REQUEST_MS:
+            logger.warning(
+                "Slow request %s %s: %.1f ms, %s queries in %.1f ms\n%s",
+                request.method,
+                request.get_full_path(),
+                duration * 1000,
+                stats.queries,
+                stats.db_time * 1000,
+                "\n".join(stats.sql),
+            )
+        return response
+
+
+class ReplicaPinMiddleware(MiddlewareMixin):
+    """Clients that write read from the primary for a while"""
+
+    def process_response(self, request, response):
+        if request.method not in SAFE_METHODS:
+            pin_to_primary(request)
+        return response
@@ -0,0 +1,106 @@
+# Generated by Django 4.0.5 on 2026-10-18 18:42
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_feed(apps, schema_editor):
+    """Materializes the feeds of the existing subscriptions"""
+    Subscribe = apps.get_model("app", "Subscribe")
+    Post = apps.get_model("app", "Post")
+    FeedEntry = apps.get_model("app", "FeedEntry")
+    for subscribe in Subscribe.objects.iterator():
+        posts = Post.objects.filter(author_id=subscribe.author_id)
+        FeedEntry.objects.bulk_create(
+            [
+                FeedEntry(
+                    subscriber_id=subscribe.subscriber_id,
+                    post_id=post_id,
+                    time_create=time_create,
+                )
+                for post_id, time_create in posts.values_list("id", "time_create")
+            ],
+            batch_size=1000,
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("app", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name="post",
+            options={"ordering": ["-time_create"]},
+        ),
+        migrations.AlterField(
+            model_name="post",
+            name="author",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="post",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="post",
+            name="read_users",
+            field=models.ManyToManyField(
+                blank=True, related_name="read", to=settings.AUTH_USER_MODEL
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="subscribe",
+            unique_together={("author", "subscriber")},
+        ),
+        migrations.CreateModel(
+            name="FeedEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("time_create", models.DateTimeField()),
+                (
+                    "post",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="feed_entries",
+                        to="app.post",
+                    ),
+                ),
+                (
+                    "subscriber",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="feed_entries",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-time_create"],
+            },
+        ),
+        migrations.AddIndex(
+            model_name="feedentry",
+            index=models.Index(
+                fields=["subscriber", "-time_create"], name="app_feed_subscriber_idx"
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="feedentry",
+            unique_together={("subscriber", "post")},
+        ),
+        migrations.RunPython(fill_feed, migrations.RunPython.noop),
+    ]
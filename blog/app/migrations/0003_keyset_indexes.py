@@ -0,0 +1,30 @@
+# Generated by Django 4.0.5 on 2026-10-18 18:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0002_feedentry"),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name="feedentry",
+            name="app_feed_subscriber_idx",
+        ),
+        migrations.AddIndex(
+            model_name="feedentry",
+            index=models.Index(
+                fields=["subscriber", "-time_create", "-post"],
+                name="app_feed_subscriber_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["-time_create", "-id"], name="app_post_time_id_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.0.5 on 2026-10-18 18:47
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_stats(apps, schema_editor):
+    """Counts the posts and subscribers of the existing authors"""
+    User = apps.get_model("auth", "User")
+    AuthorStats = apps.get_model("app", "AuthorStats")
+    users = User.objects.annotate(
+        posts=Count("post", distinct=True),
+        subscribers=Count("author_post", distinct=True),
+    )
+    AuthorStats.objects.bulk_create(
+        [
+            AuthorStats(
+                user_id=user.id,
+                post_count=user.posts,
+                subscriber_count=user.subscribers,
+            )
+            for user in users.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("auth", "0012_alter_user_first_name_max_length"),
+        ("app", "0003_keyset_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AuthorStats",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="stats",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("post_count", models.IntegerField(db_index=True, default=0)),
+                ("subscriber_count", models.IntegerField(db_index=True, default=0)),
+            ],
+        ),
+        migrations.RunPython(fill_stats, migrations.RunPython.noop),
+    ]
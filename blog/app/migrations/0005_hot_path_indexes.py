@@ -0,0 +1,32 @@
+# Generated by Django 4.0.5 on 2026-10-18 18:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0004_authorstats"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["author", "-time_create", "-id"],
+                name="app_post_author_time_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="subscribe",
+            index=models.Index(
+                fields=["subscriber", "author"], name="app_subscribe_subscriber_idx"
+            ),
+        ),
+        # The implicit table of Post.read_users is only indexed on (post, user)
+        migrations.RunSQL(
+            "CREATE INDEX app_post_read_users_user_idx "
+            "ON app_post_read_users (user_id, post_id)",
+            "DROP INDEX app_post_read_users_user_idx",
+        ),
+    ]
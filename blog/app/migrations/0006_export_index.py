@@ -0,0 +1,19 @@
+# Generated by Django 4.0.5 on 2026-10-18 19:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0005_hot_path_indexes"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                fields=["time_update", "id"], name="app_post_update_id_idx"
+            ),
+        ),
+    ]
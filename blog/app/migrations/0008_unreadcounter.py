@@ -0,0 +1,86 @@
+# Generated by Django 4.0.5 on 2026-10-18 19:12
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_unread_counters(apps, schema_editor):
+    """Counts the unread posts of the existing subscriptions"""
+    Post = apps.get_model("app", "Post")
+    Subscribe = apps.get_model("app", "Subscribe")
+    UnreadCounter = apps.get_model("app", "UnreadCounter")
+    posts = Subquery(
+        Post.objects.filter(author=OuterRef("author"))
+        .order_by()
+        .values("author")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    reads = Subquery(
+        Post.read_users.through.objects.filter(
+            user=OuterRef("subscriber"), post__author=OuterRef("author")
+        )
+        .order_by()
+        .values("user")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    rows = Subscribe.objects.annotate(
+        unread=Coalesce(posts, 0) - Coalesce(reads, 0)
+    ).values_list("subscriber_id", "author_id", "unread")
+    UnreadCounter.objects.bulk_create(
+        [
+            UnreadCounter(subscriber_id=subscriber_id, author_id=author_id, count=count)
+            for subscriber_id, author_id, count in rows.iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("app", "0007_post_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UnreadCounter",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("count", models.IntegerField(default=0)),
+                (
+                    "author",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="unread_subscribers",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                (
+                    "subscriber",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="unread_counters",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("subscriber", "author")},
+            },
+        ),
+        migrations.RunPython(fill_unread_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.0.5 on 2026-10-18 19:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0008_unreadcounter"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="authorstats",
+            name="fan_out_on_read",
+            field=models.BooleanField(default=False),
+        ),
+    ]
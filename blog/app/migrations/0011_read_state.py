@@ -0,0 +1,103 @@
+# Generated by Django 4.0.5 on 2026-10-18 19:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+READ_BATCH_SIZE = 1000
+
+
+def copy_reads(apps, schema_editor):
+    """Read events of the relation become read exceptions, without marks"""
+    Post = apps.get_model("app", "Post")
+    ReadException = apps.get_model("app", "ReadException")
+    reads = Post.read_users.through.objects.order_by("id").values_list(
+        "user_id", "post_id"
+    )
+    batch = []
+    for user_id, post_id in reads.iterator(chunk_size=READ_BATCH_SIZE):
+        batch.append(ReadException(user_id=user_id, post_id=post_id, is_read=True))
+        if len(batch) >= READ_BATCH_SIZE:
+            ReadException.objects.bulk_create(batch)
+            batch = []
+    ReadException.objects.bulk_create(batch)
+
+
+def restore_reads(apps, schema_editor):
+    """Read events of the read exceptions and of the marks"""
+    Post = apps.get_model("app", "Post")
+    ReadException = apps.get_model("app", "ReadException")
+    Subscribe = apps.get_model("app", "Subscribe")
+    PostReadUsers = Post.read_users.through
+    pairs = set(
+        ReadException.objects.filter(is_read=True).values_list("user_id", "post_id")
+    )
+    unread = set(
+        ReadException.objects.filter(is_read=False).values_list("user_id", "post_id")
+    )
+    for subscription in Subscribe.objects.filter(read_up_to__isnull=False):
+        for post_id in Post.objects.filter(
+            author_id=subscription.author_id,
+            time_create__lte=subscription.read_up_to,
+        ).values_list("id", flat=True):
+            if (subscription.subscriber_id, post_id) not in unread:
+                pairs.add((subscription.subscriber_id, post_id))
+    PostReadUsers.objects.bulk_create(
+        [PostReadUsers(user_id=user_id, post_id=post_id) for user_id, post_id in pairs],
+        batch_size=READ_BATCH_SIZE,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ("app", "0010_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="subscribe",
+            name="read_up_to",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="ReadException",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("is_read", models.BooleanField()),
+                (
+                    "post",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="read_exceptions",
+                        to="app.post",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="read_exceptions",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={
+                "unique_together": {("user", "post")},
+            },
+        ),
+        migrations.RunPython(copy_reads, restore_reads),
+        migrations.RemoveField(
+            model_name="post",
+            name="read_users",
+        ),
+    ]
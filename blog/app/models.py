@@ -1,5 +1,8 @@
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
 from django.db import models
+from django.utils import timezone
 
 
 class Post(models.Model):
@@ -10,13 +13,23 @@ class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name="post")
     time_create = models.DateTimeField(auto_now_add=True)
     time_update = models.DateTimeField(auto_now=True)
-    read_users = models.ManyToManyField(User, related_name="read", blank=True)
+    # Title and content for full-text search, only filled on Postgres
+    search_vector = SearchVectorField(null=True, editable=False)
 
     def __str__(self):
         return self.title
 
     class Meta:
         ordering = ["-time_create"]
+        indexes = [
+            models.Index(fields=["-time_create", "-id"], name="app_post_time_id_idx"),
+            models.Index(
+                fields=["author", "-time_create", "-id"],
+                name="app_post_author_time_idx",
+            ),
+            models.Index(fields=["time_update", "id"], name="app_post_update_id_idx"),
+            GinIndex(fields=["search_vector"], name="app_post_search_idx"),
+        ]
 
 
 class Subscribe(models.Model):
@@ -28,9 +41,124 @@ class Subscribe(models.Model):
     subscriber = models.ForeignKey(
         User, on_delete=models.CASCADE, related_name="subscriber"
     )
+    # Posts of the author created up to this time are read by the
+    # subscriber, except the ones with an unread ReadException
+    read_up_to = models.DateTimeField(null=True, blank=True)
 
     class Meta:
         unique_together = ["author", "subscriber"]
+        indexes = [
+            models.Index(
+                fields=["subscriber", "author"], name="app_subscribe_subscriber_idx"
+            ),
+        ]
 
     def __str__(self):
         return f"author = {self.author} subscriber = {self.subscriber}"
+
+
+class FeedEntry(models.Model):
+    """Post delivered to the feed of the subscriber"""
+
+    subscriber = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="feed_entries"
+    )
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name="feed_entries"
+    )
+    time_create = models.DateTimeField()
+
+    class Meta:
+        ordering = ["-time_create"]
+        unique_together = ["subscriber", "post"]
+        indexes = [
+            models.Index(
+                fields=["subscriber", "-time_create", "-post"],
+                name="app_feed_subscriber_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"subscriber = {self.subscriber} post = {self.post}"
+
+
+class ReadException(models.Model):
+    """
+    Read status of a post that differs from the read_up_to mark of the
+    subscription: read after the mark, or unread up to it
+    """
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="read_exceptions"
+    )
+    post = models.ForeignKey(
+        Post, on_delete=models.CASCADE, related_name="read_exceptions"
+    )
+    is_read = models.BooleanField()
+
+    class Meta:
+        unique_together = ["user", "post"]
+
+    def __str__(self):
+        return f"user = {self.user} post = {self.post} is_read = {self.is_read}"
+
+
+class AuthorStats(models.Model):
+    """Counters of the author kept up to date on writes"""
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="stats"
+    )
+    post_count = models.IntegerField(default=0, db_index=True)
+    subscriber_count = models.IntegerField(default=0, db_index=True)
+    # Posts of popular authors are merged into feeds when they are read
+    fan_out_on_read = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"author = {self.user} posts = {self.post_count}"
+
+
+class UnreadCounter(models.Model):
+    """Unread posts of an author in the feed of a subscriber"""
+
+    subscriber = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="unread_counters"
+    )
+    author = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="unread_subscribers"
+    )
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ["subscriber", "author"]
+
+    def __str__(self):
+        return f"subscriber = {self.subscriber} author = {self.author} unread = {self.count}"
+
+
+class Job(models.Model):
+    """Background task queued by the database backend of app.tasks"""
+
+    QUEUED = "queued"
+    DONE = "done"
+    FAILED = "failed"
+    STATUSES = [(QUEUED, "Queued"), (DONE, "Done"), (FAILED, "Failed")]
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict)
+    # Jobs with the same key are only queued once
+    key = models.CharField(max_length=255, null=True, blank=True, unique=True)
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.IntegerField(default=0)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    time_create = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_at"], name="app_job_queue_idx"),
+        ]
+
+    def __str__(self):
+        return f"job = {self.name} status = {self.status}"
@@ -0,0 +1,183 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import Exists, Max, OuterRef, Q
+from django.utils import timezone
+
+from . import unread
+from .cache import bump_generation
+from .models import Post, ReadException, Subscribe
+
+READ_BATCH_SIZE = 1000
+
+
+def get_marked_subscriptions(user):
+    """Subscriptions of the user whose read_up_to mark covers the outer post"""
+    return Subscribe.objects.filter(
+        subscriber=user,
+        author=OuterRef("author"),
+        read_up_to__gte=OuterRef("time_create"),
+    )
+
+
+def read_condition(user):
+    """
+    Condition on posts read by the user: read by an exception, or
+    covered by the mark of the subscription without an unread
+    exception. `user` can be an OuterRef.
+    """
+    exceptions = ReadException.objects.filter(user=user, post=OuterRef("pk"))
+    return Exists(exceptions.filter(is_read=True)) | (
+        Exists(get_marked_subscriptions(user))
+        & ~Exists(exceptions.filter(is_read=False))
+    )
+
+
+def get_read_posts(user, post_ids):
+    return Post.objects.filter(read_condition(user), id__in=post_ids).order_by()
+
+
+def get_read_post_ids(user, post_ids):
+    """Ids of the given posts read by the user, resolved in one query"""
+    return set(get_read_posts(user, post_ids).values_list("id", flat=True))
+
+
+def is_read(user, post):
+    """Read status of a single post"""
+    return get_read_posts(user, [post.id]).exists()
+
+
+def write_exceptions(user, post_ids, is_read):
+    """
+    Gives the posts the read status: exceptions are dropped where the
+    marks already say so and written elsewhere
+    """
+    marked = dict(
+        Post.objects.filter(id__in=post_ids)
+        .annotate(marked=Exists(get_marked_subscriptions(user)))
+        .order_by()
+        .values_list("id", "marked")
+    )
+    # Exceptions of both statuses go, a stale opposite one would block the insert
+    ReadException.objects.filter(user=user, post_id__in=post_ids).delete()
+    ReadException.objects.bulk_create(
+        [
+            ReadException(user_id=user.id, post_id=post_id, is_read=is_read)
+            for post_id in post_ids
+            if post_id in marked and marked[post_id] != is_read
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def lock_read_state(user):
+    """
+    Serializes the writes of the read state of the user until the end of
+    the transaction, so the changes they count are the ones they write
+    """
+    list(User.objects.select_for_update().filter(id=user.id).values_list("id"))
+
+
+def set_read_status(user, post_ids, is_read):
+    """
+    Marks the posts as read or unread for the user with set-based writes,
+    the unread counters follow the posts whose status changed.
+    Returns the number of posts whose status was written.
+    """
+    post_ids = list(post_ids)
+    changed = []
+    with transaction.atomic():
+        lock_read_state(user)
+        for start in range(0, len(post_ids), READ_BATCH_SIZE):
+            batch = post_ids[start : start + READ_BATCH_SIZE]
+            read = get_read_post_ids(user, batch)
+            batch_changed = [
+                post_id for post_id in batch if (post_id in read) != is_read
+            ]
+            write_exceptions(user, batch_changed, is_read)
+            changed.extend(batch_changed)
+        unread.read_status_changed([(user.id, post_id) for post_id in changed], is_read)
+    bump_generation("read:%s" % user.id)
+    return len(post_ids) if is_read else len(changed)
+
+
+def mark_read_before(user, before):
+    """
+    Marks the posts of the subscriptions created up to `before` as read
+    by moving the marks, whatever the number of posts. The mark is the
+    newest post covered, so later posts stay unread.
+    """
+    authors = Subscribe.objects.filter(subscriber=user).values("author")
+    mark = Post.objects.filter(
+        author__in=authors, time_create__lte=min(before, timezone.now())
+    ).aggregate(mark=Max("time_create"))["mark"]
+    if mark is None:
+        return
+    with transaction.atomic():
+        lock_read_state(user)
+        Subscribe.objects.filter(subscriber=user).filter(
+            Q(read_up_to__isnull=True) | Q(read_up_to__lt=mark)
+        ).update(read_up_to=mark)
+        ReadException.objects.filter(
+            user=user, post__time_create__lte=mark, post__author__in=authors
+        ).delete()
+        unread.rebuild_unread_counters([user.id])
+    bump_generation("read:%s" % user.id)
+
+
+def subscriptions_deleted(subscriber_id, author_ids):
+    """The read state of the posts of the authors goes with the marks"""
+    ReadException.objects.filter(
+        user_id=subscriber_id, post__author_id__in=author_ids
+    ).delete()
+
+
+def compact_read_state(subscriber_ids=None):
+    """
+    Moves the marks over the posts read in a row after them and drops
+    the exceptions they cover. Returns the number of exceptions dropped.
+    """
+    subscriptions = Subscribe.objects.filter(
+        Exists(
+            ReadException.objects.filter(
+                user=OuterRef("subscriber"),
+                post__author=OuterRef("author"),
+                is_read=True,
+            )
+        )
+    )
+    if subscriber_ids is not None:
+        subscriptions = subscriptions.filter(subscriber_id__in=subscriber_ids)
+    dropped = 0
+    for subscription in subscriptions.iterator():
+        with transaction.atomic():
+            dropped += compact_subscription(subscription)
+    return dropped
+
+
+def compact_subscription(subscription):
+    posts = Post.objects.filter(author_id=subscription.author_id).order_by()
+    if subscription.read_up_to is not None:
+        posts = posts.filter(time_create__gt=subscription.read_up_to)
+    read = Exists(
+        ReadException.objects.filter(
+            user_id=subscription.subscriber_id, post=OuterRef("pk"), is_read=True
+        )
+    )
+    first_unread = (
+        posts.exclude(read)
+        .order_by("time_create")
+        .values_list("time_create", flat=True)
+        .first()
+    )
+    read_posts = posts.filter(read)
+    if first_unread is not None:
+        read_posts = read_posts.filter(time_create__lt=first_unread)
+    mark = read_posts.aggregate(mark=Max("time_create"))["mark"]
+    if mark is None:
+        return 0
+    Subscribe.objects.filter(id=subscription.id).update(read_up_to=mark)
+    return ReadException.objects.filter(
+        user_id=subscription.subscriber_id,
+        post__in=posts.filter(time_create__lte=mark).values("id"),
+        is_read=True,
+    ).delete()[0]
@@ -0,0 +1,96 @@
+import hashlib
+import random
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.permissions import SAFE_METHODS
+
+from .cache import get_last_modified
+
+READ_REPLICAS = getattr(settings, "READ_REPLICAS", [])
+REPLICA_PIN_SECONDS = getattr(settings, "REPLICA_PIN_SECONDS", 5)
+REPLICA_PIN_KEY = "replica-pin:%s"
+
+reading_replica = ContextVar("reading_replica", default=False)
+
+
+def choose_replica():
+    return random.choice(READ_REPLICAS)
+
+
+class ReplicaRouter:
+    """
+    Reads of the views marked with ReplicaReadMixin go to a random
+    replica, everything else to the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        if READ_REPLICAS and reading_replica.get():
+            return choose_replica()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return "default"
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """Replicas are copies of the primary"""
+        return db == "default"
+
+
+def get_client_key(request):
+    """Hash of the credentials of the request, None for anonymous ones"""
+    credentials = request.headers.get("Authorization") or request.COOKIES.get(
+        settings.SESSION_COOKIE_NAME
+    )
+    if not credentials:
+        return None
+    return hashlib.sha1(credentials.encode()).hexdigest()
+
+
+def pin_to_primary(request):
+    """The next reads of the client see its own writes"""
+    client = get_client_key(request)
+    if READ_REPLICAS and client is not None:
+        cache.set(REPLICA_PIN_KEY % client, True, REPLICA_PIN_SECONDS)
+
+
+def is_pinned(request):
+    client = get_client_key(request)
+    return client is not None and cache.get(REPLICA_PIN_KEY % client) is not None
+
+
+class ReplicaReadMixin:
+    """
+    Safe requests read from the replicas, unless the client wrote
+    within the last REPLICA_PIN_SECONDS. Cached pages are built on the
+    primary for as long after a change, a page built from a lagging
+    replica would be kept until the next change.
+    """
+
+    def use_replica(self, request):
+        if not READ_REPLICAS or request.method not in SAFE_METHODS:
+            return False
+        if is_pinned(request._request):
+            return False
+        if hasattr(self, "get_cache_generations"):
+            changed = get_last_modified(self.get_cache_generations())
+            if changed is not None and time.time() - changed < REPLICA_PIN_SECONDS:
+                return False
+        return True
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if self.use_replica(request):
+            self.replica_token = reading_replica.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "replica_token", None)
+        if token is not None:
+            reading_replica.reset(token)
+            self.replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
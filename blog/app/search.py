@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+from django.db import connection
+from django.db.models import F, FloatField, IntegerField, Q, Value
+from django.db.models.functions import Cast
+
+from .models import Post
+
+SEARCH_CONFIG = getattr(settings, "SEARCH_CONFIG", "english")
+# Ranks are compared as integers of this many steps per unit
+SEARCH_RANK_SCALE = getattr(settings, "SEARCH_RANK_SCALE", 10**6)
+
+
+def is_supported():
+    """The stored search vectors only exist on Postgres"""
+    return connection.vendor == "postgresql"
+
+
+def get_search_vector():
+    return SearchVector("title", weight="A", config=SEARCH_CONFIG) + SearchVector(
+        "content", weight="B", config=SEARCH_CONFIG
+    )
+
+
+def update_search_vectors(post_ids=None):
+    """Recomputes the stored vectors of the posts, all by default"""
+    if not is_supported():
+        return 0
+    posts = Post.objects.all()
+    if post_ids is not None:
+        posts = posts.filter(id__in=post_ids)
+    return posts.update(search_vector=get_search_vector())
+
+
+def search_posts(queryset, text):
+    """
+    Posts matching the search text, annotated with their `rank`.
+    Postgres matches the GIN-indexed vectors with a web search query,
+    other databases fall back to a case-insensitive match of every word
+    in the title or the content, all with the same rank.
+    The rank is rounded to an integer, so the value in a cursor compares
+    equal to the one computed again for the next page.
+    """
+    if is_supported():
+        query = SearchQuery(text, config=SEARCH_CONFIG, search_type="websearch")
+        rank = SearchRank(F("search_vector"), query) * Value(
+            SEARCH_RANK_SCALE, FloatField()
+        )
+        return queryset.filter(search_vector=query).annotate(
+            rank=Cast(rank, IntegerField())
+        )
+    condition = Q()
+    for word in text.split():
+        condition &= Q(title__icontains=word) | Q(content__icontains=word)
+    return queryset.filter(condition).annotate(
+        rank=Value(SEARCH_RANK_SCALE, IntegerField())
+    )
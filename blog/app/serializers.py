@@ -1,7 +1,13 @@
 from django.contrib.auth.models import User
+from django.contrib.auth.validators import UnicodeUsernameValidator
 from rest_framework import serializers
+from rest_framework.settings import api_settings
 
+from .export import EXPORT_TYPES
 from .models import Post, Subscribe
+from .reads import is_read, set_read_status
+from .subscriptions import ALREADY_SUBSCRIBED, NOT_FOUND, subscribe
+from .values import ValuesSerializer
 
 
 class PostSerializer(serializers.ModelSerializer):
@@ -11,7 +17,35 @@ class PostSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Post
-        exclude = ["read_users"]
+        exclude = ["search_vector"]
+
+
+class PostImportSerializer(PostSerializer):
+    """
+    Rules of PostSerializer for imported posts, the author is a username
+    and the times of the source are kept
+    """
+
+    author = serializers.CharField(max_length=150)
+    time_create = serializers.DateTimeField(required=False)
+    time_update = serializers.DateTimeField(required=False)
+
+
+class PostValuesSerializer(ValuesSerializer):
+    """Output of PostSerializer for the list of posts"""
+
+    columns = ("id", "title", "content", "time_create", "time_update")
+    field_columns = {column: column for column in columns}
+
+    def to_representation(self, row):
+        """Columns left out by `?fields=` are None, `?preview=` gives the excerpt"""
+        return {
+            "id": row["id"],
+            "title": row.get("title"),
+            "content": row.get("content", row.get("content_preview")),
+            "time_create": self.format_datetime(row.get("time_create")),
+            "time_update": self.format_datetime(row.get("time_update")),
+        }
 
 
 class PostSubscribeSerializer(serializers.ModelSerializer):
@@ -23,15 +57,22 @@ class PostSubscribeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Post
-        exclude = ["read_users"]
+        exclude = ["search_vector"]
 
     def to_representation(self, instance):
-        """is_read field added"""
+        """
+        is_read field added.
+        List views put the read post ids of the page into the context.
+        """
         representation = super().to_representation(instance)
         if self.context.get("request", None):
-            representation["is_read"] = (
-                self.context["request"].user in instance.read_users.all()
-            )
+            read_post_ids = self.context.get("read_post_ids")
+            if read_post_ids is None:
+                representation["is_read"] = is_read(
+                    self.context["request"].user, instance
+                )
+            else:
+                representation["is_read"] = instance.id in read_post_ids
         return representation
 
     def to_internal_value(self, data):
@@ -44,13 +85,73 @@ class PostSubscribeSerializer(serializers.ModelSerializer):
 
     def update(self, instance, validated_data):
         post = instance
-        if validated_data.get("is_read") == "true":
-            post.read_users.add(self.context["request"].user)
-        else:
-            post.read_users.remove(self.context["request"].user)
+        set_read_status(
+            self.context["request"].user,
+            [post.id],
+            validated_data.get("is_read") == "true",
+        )
         return post
 
 
+class PostSubscribeValuesSerializer(ValuesSerializer):
+    """Output of PostSubscribeSerializer for the feed"""
+
+    columns = (
+        "id",
+        "author__username",
+        "title",
+        "content",
+        "time_create",
+        "time_update",
+    )
+
+    field_columns = {
+        **PostValuesSerializer.field_columns,
+        "author": "author__username",
+        "is_read": None,
+    }
+
+    def to_representation(self, row):
+        representation = {
+            "id": row["id"],
+            "author": row.get("author__username"),
+            "title": row.get("title"),
+            "content": row.get("content", row.get("content_preview")),
+            "time_create": self.format_datetime(row.get("time_create")),
+            "time_update": self.format_datetime(row.get("time_update")),
+        }
+        read_post_ids = self.context.get("read_post_ids")
+        if self.context.get("request", None) and read_post_ids is not None:
+            representation["is_read"] = row["id"] in read_post_ids
+        return representation
+
+
+class ReadStatusSerializer(serializers.Serializer):
+    """Serializes a bulk change of the read status"""
+
+    posts = serializers.ListField(
+        child=serializers.IntegerField(), required=False, allow_empty=False
+    )
+    before = serializers.DateTimeField(required=False)
+    is_read = serializers.BooleanField(default=True)
+
+    def validate(self, data):
+        if ("posts" in data) == ("before" in data):
+            raise serializers.ValidationError("Either posts or before is required")
+        return data
+
+
+class ExportSerializer(serializers.Serializer):
+    """Query parameters of an export"""
+
+    type = serializers.MultipleChoiceField(choices=EXPORT_TYPES, required=False)
+    author = serializers.CharField(required=False)
+    since = serializers.DateTimeField(required=False)
+
+    def validate_type(self, value):
+        return [name for name in EXPORT_TYPES if name in value]
+
+
 class AuthorSerializer(serializers.Serializer):
     """Serializes user"""
 
@@ -61,16 +162,27 @@ class AuthorSerializer(serializers.Serializer):
     def validate(self, data):
         if data["username"] == data["subscriber"].username:
             raise serializers.ValidationError("You cannot subscribe to yourself")
-        elif Subscribe.objects.filter(
-            author__username=data["username"], subscriber=data["subscriber"]
-        ).exists():
-            raise serializers.ValidationError("Subscription already exists")
         return data
 
     def create(self, validated_data):
-        user = User.objects.get(username=validated_data.pop("username"))
-        Subscribe.objects.create(author=user, **validated_data)
-        return user
+        username = validated_data["username"]
+        result = subscribe(validated_data["subscriber"], [username])[username]
+        if result == NOT_FOUND:
+            raise serializers.ValidationError({"author": ["Author does not exist"]})
+        if result == ALREADY_SUBSCRIBED:
+            raise serializers.ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: ["Subscription already exists"]}
+            )
+        return User(username=username)
+
+
+class AuthorValuesSerializer(ValuesSerializer):
+    """Output of AuthorSerializer for the list of authors"""
+
+    columns = ("username", "count_post")
+
+    def to_representation(self, row):
+        return {"author": row["username"], "count_post": row["count_post"]}
 
 
 class SubscribeSerializer(serializers.ModelSerializer):
@@ -81,4 +193,49 @@ class SubscribeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Subscribe
-        fields = "__all__"
+        exclude = ["read_up_to"]
+
+
+class BulkSubscribeSerializer(serializers.Serializer):
+    """Usernames of the authors to subscribe to or to unsubscribe from"""
+
+    authors = serializers.ListField(
+        child=serializers.CharField(max_length=150), allow_empty=False, max_length=1000
+    )
+
+
+class SubscribeValuesSerializer(ValuesSerializer):
+    """Output of SubscribeSerializer for the list of subscriptions"""
+
+    columns = ("id", "author__username")
+
+    def to_representation(self, row):
+        return {"id": row["id"], "author": row["author__username"]}
+
+
+class UserImportSerializer(serializers.ModelSerializer):
+    """Imported user, unique usernames are checked once per batch"""
+
+    class Meta:
+        model = User
+        fields = ["username", "email"]
+        extra_kwargs = {"username": {"validators": [UnicodeUsernameValidator()]}}
+
+
+class SubscribeImportSerializer(serializers.Serializer):
+    """Imported subscription, users are given by username"""
+
+    author = serializers.CharField(max_length=150)
+    subscriber = serializers.CharField(max_length=150)
+
+    def validate(self, data):
+        if data["author"] == data["subscriber"]:
+            raise serializers.ValidationError("You cannot subscribe to yourself")
+        return data
+
+
+class ReadImportSerializer(serializers.Serializer):
+    """Imported read event of a post by a user"""
+
+    post = serializers.IntegerField()
+    user = serializers.CharField(max_length=150)
@@ -1,12 +1,267 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
 from django_filters import rest_framework as filters
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    BasePagination,
+    LimitOffsetPagination,
+    PageNumberPagination,
+)
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
+from .feed import MergedFeed
 from .models import Post
+from .reads import read_condition
+from .search import search_posts
+
 
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination on the (time_create, id) key.
+    A page is a range scan after the last row of the previous page,
+    so pages stay stable while new posts arrive and no count is made.
+    The view can set `cursor_ordering` to paginate on annotations.
+    """
 
-class PostSubscribePagination(PageNumberPagination):
     page_size = 10
+    cursor_query_param = "cursor"
+    ordering = ("-time_create", "-id")
+    # Types of the values of the ordering fields in a cursor
+    field_types = {
+        "time_create": datetime,
+        "feed_time": datetime,
+        "id": int,
+        "feed_post": int,
+        "rank": int,
+    }
+    invalid_cursor_message = "Invalid cursor"
+
+    def __init__(self, page_size=None):
+        if page_size:
+            self.page_size = page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.fields = getattr(view, "cursor_ordering", self.ordering)
+        queryset = queryset.order_by(*self.fields)
+        position = self.decode_cursor(request)
+        if position:
+            try:
+                queryset = self.filter_position(queryset, position)
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+        rows = list(queryset[: self.page_size + 1])
+        self.next_position = None
+        if len(rows) > self.page_size:
+            rows = rows[: self.page_size]
+            self.next_position = [
+                get_row_value(rows[-1], field.lstrip("-")) for field in self.fields
+            ]
+        return rows
+
+    def filter_position(self, queryset, position):
+        """Rows after the position, merged feeds resume by themselves"""
+        if isinstance(queryset, MergedFeed):
+            return queryset.resume(position)
+        return queryset.filter(self.get_position_filter(position))
+
+    def get_position_filter(self, position):
+        """Rows that follow the position in the ordering"""
+        condition = equal = Q()
+        for field, value in zip(self.fields, position):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition |= equal & Q(**{"%s__%s" % (name, lookup): value})
+            equal &= Q(**{name: value})
+        # The bound on the first field keeps the index range scan
+        first = self.fields[0].lstrip("-")
+        lookup = "lte" if self.fields[0].startswith("-") else "gte"
+        return Q(**{"%s__%s" % (first, lookup): position[0]}) & condition
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            position = json.loads(urlsafe_b64decode(encoded.encode("ascii")))
+            if not isinstance(position, list) or len(position) != len(self.fields):
+                raise ValueError(encoded)
+            return [
+                self.decode_value(field.lstrip("-"), value)
+                for field, value in zip(self.fields, position)
+            ]
+        except (TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def decode_value(self, field, value):
+        """The value of the field in a cursor, ValueError when of another type"""
+        field_type = self.field_types.get(field)
+        if field_type is datetime:
+            value = parse_datetime(value) if isinstance(value, str) else None
+            if value is None:
+                raise ValueError(field)
+        elif field_type is int and type(value) is not int:
+            raise ValueError(field)
+        return value
+
+    def encode_cursor(self, position):
+        position = [
+            value.isoformat() if hasattr(value, "isoformat") else value
+            for value in position
+        ]
+        return urlsafe_b64encode(json.dumps(position).encode("ascii")).decode("ascii")
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.next_position)
+        )
+
+    def get_paginated_response(self, data):
+        return Response(
+            OrderedDict([("next", self.get_next_link()), ("results", data)])
+        )
+
+
+class CursorModeMixin:
+    """
+    Opt-in keyset mode: `?cursor=` starts it,
+    the `next` links carry the cursor further.
+    """
+
+    cursor_query_param = KeysetPagination.cursor_query_param
+    keyset = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.cursor_query_param in request.query_params:
+            self.keyset = KeysetPagination(self.get_cursor_page_size(request))
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+def skip_count(request, count_query_param="count"):
+    """`?count=false` asks for a page without the total count"""
+    return request.query_params.get(count_query_param, "").lower() in ("false", "0")
+
+
+class LimitOffsetCountPagination(LimitOffsetPagination):
+    """Limit/offset pagination, the total count is skipped with `?count=false`"""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not skip_count(request):
+            return super().paginate_queryset(queryset, request, view)
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+        self.offset = self.get_offset(request)
+        self.request = request
+        self.count = None
+        rows = list(queryset[self.offset : self.offset + self.limit + 1])
+        self.has_next = len(rows) > self.limit
+        return rows[: self.limit]
+
+    def get_next_link(self):
+        if self.count is None and not self.has_next:
+            return None
+        if self.count is None:
+            url = self.request.build_absolute_uri()
+            url = replace_query_param(url, self.limit_query_param, self.limit)
+            return replace_query_param(
+                url, self.offset_query_param, self.offset + self.limit
+            )
+        return super().get_next_link()
+
+    def get_paginated_response(self, data):
+        if self.count is not None:
+            return super().get_paginated_response(data)
+        return Response(
+            OrderedDict(
+                [
+                    ("next", self.get_next_link()),
+                    ("previous", self.get_previous_link()),
+                    ("results", data),
+                ]
+            )
+        )
+
+
+class PostPagination(CursorModeMixin, LimitOffsetCountPagination):
+    """Pagination of posts: limit/offset or keyset"""
+
+    def get_cursor_page_size(self, request):
+        return self.get_limit(request)
+
+
+class PostSubscribePagination(CursorModeMixin, PageNumberPagination):
+    page_size = 10
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param in request.query_params or not skip_count(request):
+            self.page_number = None
+            return super().paginate_queryset(queryset, request, view)
+        self.keyset = None
+        self.request = request
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+        if self.page_number < 1:
+            raise NotFound(self.invalid_page_message)
+        offset = (self.page_number - 1) * self.page_size
+        rows = list(queryset[offset : offset + self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        return rows[: self.page_size]
+
+    def get_paginated_response(self, data):
+        if self.keyset or self.page_number is None:
+            return super().get_paginated_response(data)
+        url = self.request.build_absolute_uri()
+        next_link = previous_link = None
+        if self.has_next:
+            next_link = replace_query_param(
+                url, self.page_query_param, self.page_number + 1
+            )
+        if self.page_number == 2:
+            previous_link = remove_query_param(url, self.page_query_param)
+        elif self.page_number > 2:
+            previous_link = replace_query_param(
+                url, self.page_query_param, self.page_number - 1
+            )
+        return Response(
+            OrderedDict(
+                [
+                    ("next", next_link),
+                    ("previous", previous_link),
+                    ("results", data),
+                ]
+            )
+        )
+
+    def get_cursor_page_size(self, request):
+        return self.get_page_size(request)
+
+
+def get_row_value(row, name):
+    """Value of a model instance or of a `.values()` row"""
+    if isinstance(row, dict):
+        return row[name]
+    return getattr(row, name)
 
 
 class AuthorFilter(filters.FilterSet):
@@ -26,17 +281,31 @@ class AuthorFilter(filters.FilterSet):
         fields = ("count_post",)
 
 
-class PostIsReadFilter(filters.FilterSet):
+class PostSearchFilter(filters.FilterSet):
+    """Full-text search in the title and the content"""
+
+    search = filters.CharFilter(method="get_search")
+
+    def get_search(self, queryset, field_name, value):
+        return search_posts(queryset, value)
+
+    class Meta:
+        model = Post
+        fields = ("search",)
+
+
+class PostIsReadFilter(PostSearchFilter):
     """Filter by status read or not"""
 
     is_read = filters.BooleanFilter(field_name="is_read", method="get_read_status")
 
     def get_read_status(self, queryset, field_name, value):
+        condition = read_condition(self.request.user)
         if value:
-            return queryset.filter(read_users=self.request.user)
+            return queryset.filter(condition)
         else:
-            return queryset.exclude(read_users=self.request.user)
+            return queryset.exclude(condition)
 
     class Meta:
         model = Post
-        fields = ("is_read",)
+        fields = ("is_read", "search")
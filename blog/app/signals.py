@@ -0,0 +1,160 @@
+from django.contrib.auth.models import User
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from . import feed, reads, tasks, unread
+from .authentication import forget_token, forget_user_tokens
+from .cache import bump_generation
+from .connections import check_connections
+from .instrumentation import install_query_recorder, registry
+from .models import AuthorStats, Post, Subscribe
+from .search import is_supported
+from .stats import change_counter
+
+
+@receiver(post_save, sender=Post)
+def post_created(sender, instance, created, **kwargs):
+    """Fan-out of the new post to the feeds of subscribers"""
+    if created:
+        feed.forget_recent_posts([instance.author_id])
+        tasks.enqueue(
+            "fan_out_posts", key="fan-out:%s" % instance.id, post_ids=[instance.id]
+        )
+
+
+@receiver(post_save, sender=Post)
+def post_indexed(sender, instance, update_fields=None, **kwargs):
+    """The search vector follows the title and the content"""
+    if is_supported() and (
+        update_fields is None or {"title", "content"} & set(update_fields)
+    ):
+        tasks.enqueue("index_posts", post_ids=[instance.id])
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    """The recent posts of the author are read again"""
+    feed.forget_recent_posts([instance.author_id])
+
+
+@receiver(post_save, sender=Subscribe)
+def subscribe_created(sender, instance, created, **kwargs):
+    """Backfill of the feed with the posts of the new author"""
+    if created:
+        tasks.enqueue(
+            "backfill_subscriptions",
+            key="backfill:%s" % instance.id,
+            pairs=[[instance.author_id, instance.subscriber_id]],
+        )
+
+
+@receiver(post_delete, sender=Subscribe)
+def subscribe_deleted(sender, instance, **kwargs):
+    """Trim of the feed after unsubscribing"""
+    feed.trim_subscriptions(instance.subscriber_id, [instance.author_id])
+
+
+@receiver(post_save, sender=Post)
+def post_unread(sender, instance, created, **kwargs):
+    if created:
+        unread.posts_created([instance])
+
+
+@receiver(pre_delete, sender=Post)
+def post_unread_deleted(sender, instance, **kwargs):
+    unread.post_deleted(instance)
+
+
+@receiver(post_save, sender=Subscribe)
+def subscribe_unread(sender, instance, created, **kwargs):
+    if created:
+        unread.subscription_created(instance)
+
+
+@receiver(post_delete, sender=Subscribe)
+def subscribe_unread_deleted(sender, instance, **kwargs):
+    unread.subscriptions_deleted(instance.subscriber_id, [instance.author_id])
+
+
+@receiver(post_delete, sender=Subscribe)
+def subscribe_reads_deleted(sender, instance, **kwargs):
+    reads.subscriptions_deleted(instance.subscriber_id, [instance.author_id])
+
+
+@receiver(post_save, sender=User)
+def user_created(sender, instance, created, **kwargs):
+    if created:
+        AuthorStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def post_counted(sender, instance, created, **kwargs):
+    if created:
+        change_counter(instance.author_id, "post_count", 1)
+
+
+@receiver(post_delete, sender=Post)
+def post_uncounted(sender, instance, **kwargs):
+    change_counter(instance.author_id, "post_count", -1)
+
+
+@receiver(post_save, sender=Subscribe)
+def subscriber_counted(sender, instance, created, **kwargs):
+    if created:
+        change_counter(instance.author_id, "subscriber_count", 1)
+
+
+@receiver(post_delete, sender=Subscribe)
+def subscriber_uncounted(sender, instance, **kwargs):
+    change_counter(instance.author_id, "subscriber_count", -1)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, **kwargs):
+    bump_generation("post")
+
+
+@receiver(post_save, sender=Subscribe)
+@receiver(post_delete, sender=Subscribe)
+def subscribe_changed(sender, **kwargs):
+    bump_generation("subscribe")
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def user_changed(sender, update_fields=None, **kwargs):
+    """A login only updates last_login, which is not shown"""
+    if update_fields is None or set(update_fields) != {"last_login"}:
+        bump_generation("user")
+
+
+@receiver(connection_created)
+def connection_opened(sender, connection, **kwargs):
+    """Every new connection reports its queries to the request stats"""
+    install_query_recorder(connection)
+    if not getattr(connection, "pooled", False):
+        registry.increment("db_connections_opened")
+
+
+@receiver(request_started)
+def connections_checked(sender, **kwargs):
+    """Persistent connections are checked before the request uses them"""
+    check_connections()
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    forget_token(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_tokens_changed(sender, instance, **kwargs):
+    """
+    Cached users of the tokens are refreshed, inactive users stop
+    authenticating at once and a new password is seen by every token
+    """
+    forget_user_tokens(instance)
@@ -0,0 +1,78 @@
+from django.contrib.auth.models import User
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .feed import FEED_FAN_OUT_LIMIT
+from .models import AuthorStats, Post, Subscribe
+
+
+def change_counter(user_id, field, delta):
+    """
+    Atomic increment of the counter of the author, an author reaching
+    FEED_FAN_OUT_LIMIT subscribers switches to fan-out on read.
+    A missing row is only recounted on increments: decrements come
+    from deletes, also the cascade of the user that owned the row.
+    """
+    changes = {field: F(field) + delta}
+    if field == "subscriber_count" and delta > 0:
+        changes["fan_out_on_read"] = Case(
+            When(subscriber_count__gte=FEED_FAN_OUT_LIMIT - delta, then=Value(True)),
+            default=F("fan_out_on_read"),
+        )
+    updated = AuthorStats.objects.filter(user_id=user_id).update(**changes)
+    if not updated and delta > 0:
+        reconcile_author_stats([user_id])
+
+
+def reconcile_author_stats(user_ids=None):
+    """
+    Recounts the counters in bulk, missing rows are created.
+    Returns the numbers of created rows and of drifted rows.
+    """
+    users = User.objects.all()
+    stats = AuthorStats.objects.all()
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+        stats = stats.filter(user_id__in=user_ids)
+    missing = users.filter(stats__isnull=True).values_list("id", flat=True)
+    created = AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=user_id) for user_id in missing.iterator()],
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+    post_count = Coalesce(
+        Subquery(
+            Post.objects.filter(author=OuterRef("user"))
+            .order_by()
+            .values("author")
+            .annotate(count=Count("id"))
+            .values("count")
+        ),
+        0,
+    )
+    subscriber_count = Coalesce(
+        Subquery(
+            Subscribe.objects.filter(author=OuterRef("user"))
+            .order_by()
+            .values("author")
+            .annotate(count=Count("id"))
+            .values("count")
+        ),
+        0,
+    )
+    drifted = (
+        stats.annotate(
+            actual_post_count=post_count, actual_subscriber_count=subscriber_count
+        )
+        .filter(
+            ~Q(post_count=F("actual_post_count"))
+            | ~Q(subscriber_count=F("actual_subscriber_count"))
+        )
+        .count()
+    )
+    if drifted:
+        stats.update(post_count=post_count, subscriber_count=subscriber_count)
+    stats.filter(
+        subscriber_count__gte=FEED_FAN_OUT_LIMIT, fan_out_on_read=False
+    ).update(fan_out_on_read=True)
+    return len(created), drifted
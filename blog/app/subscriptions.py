@@ -0,0 +1,99 @@
+from django.contrib.auth.models import User
+from django.db import transaction
+
+from . import feed, reads, tasks, unread
+from .cache import bump_generation
+from .models import Subscribe
+from .stats import reconcile_author_stats
+
+SUBSCRIBED = "subscribed"
+ALREADY_SUBSCRIBED = "already_subscribed"
+UNSUBSCRIBED = "unsubscribed"
+NOT_SUBSCRIBED = "not_subscribed"
+NOT_FOUND = "not_found"
+SELF = "self"
+
+
+def get_author_ids(usernames):
+    return dict(
+        User.objects.filter(username__in=usernames).values_list("username", "id")
+    )
+
+
+def subscribe(subscriber, usernames):
+    """
+    Subscribes to the authors in bulk, the usernames are resolved in one
+    query and the unique constraint settles concurrent requests.
+    The hooks of the model signals run once for the whole batch; they
+    recount, so a subscription inserted concurrently is counted once.
+    Returns the result of each username.
+    """
+    usernames = list(dict.fromkeys(usernames))
+    authors = get_author_ids(usernames)
+    existing = set(
+        Subscribe.objects.filter(
+            subscriber=subscriber, author_id__in=authors.values()
+        ).values_list("author_id", flat=True)
+    )
+    results = {}
+    new = []
+    for username in usernames:
+        author_id = authors.get(username)
+        if author_id is None:
+            results[username] = NOT_FOUND
+        elif author_id == subscriber.id:
+            results[username] = SELF
+        elif author_id in existing:
+            results[username] = ALREADY_SUBSCRIBED
+        else:
+            results[username] = SUBSCRIBED
+            new.append(author_id)
+    if new:
+        with transaction.atomic():
+            Subscribe.objects.bulk_create(
+                [
+                    Subscribe(author_id=author_id, subscriber_id=subscriber.id)
+                    for author_id in new
+                ],
+                ignore_conflicts=True,
+            )
+            tasks.enqueue(
+                "backfill_subscriptions",
+                pairs=[[author_id, subscriber.id] for author_id in new],
+            )
+            reconcile_author_stats(new)
+            unread.rebuild_unread_counters([subscriber.id], new)
+        bump_generation("subscribe")
+    return results
+
+
+def unsubscribe(subscriber, usernames):
+    """
+    Removes the subscriptions to the authors in bulk.
+    Returns the result of each username.
+    """
+    usernames = list(dict.fromkeys(usernames))
+    authors = get_author_ids(usernames)
+    subscriptions = Subscribe.objects.filter(
+        subscriber=subscriber, author_id__in=authors.values()
+    )
+    existing = set(subscriptions.values_list("author_id", flat=True))
+    results = {}
+    for username in usernames:
+        if username not in authors:
+            results[username] = NOT_FOUND
+        elif authors[username] in existing:
+            results[username] = UNSUBSCRIBED
+        else:
+            results[username] = NOT_SUBSCRIBED
+    if existing:
+        with transaction.atomic():
+            # Nothing refers to subscriptions, the hooks of the delete
+            # signals run below once for the whole batch
+            subscriptions._raw_delete(subscriptions.db)
+            feed.trim_subscriptions(subscriber.id, existing)
+            unread.subscriptions_deleted(subscriber.id, existing)
+            reads.subscriptions_deleted(subscriber.id, existing)
+            reconcile_author_stats(existing)
+        bump_generation("subscribe")
+    return results
@@ -0,0 +1,218 @@
+import logging
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import feed
+from .cache import bump_generation
+from .models import Job, Post, Subscribe
+from .search import update_search_vectors
+
+# immediate runs the tasks inline, thread in a pool of the process,
+# database queues them as jobs for the run_tasks command
+TASK_BACKEND = getattr(settings, "TASK_BACKEND", "immediate")
+TASK_THREADS = getattr(settings, "TASK_THREADS", 4)
+TASK_MAX_ATTEMPTS = getattr(settings, "TASK_MAX_ATTEMPTS", 5)
+TASK_RETRY_DELAY = getattr(settings, "TASK_RETRY_DELAY", 10)
+TASK_LOCK_TIMEOUT = getattr(settings, "TASK_LOCK_TIMEOUT", 300)
+TASK_RETENTION = getattr(settings, "TASK_RETENTION", 86400)
+
+logger = logging.getLogger("app.tasks")
+
+registry = {}
+
+
+def task(function):
+    """Registers the function as a task taking the payload as arguments"""
+    registry[function.__name__] = function
+    return function
+
+
+def run_task(name, payload):
+    with transaction.atomic():
+        registry[name](**payload)
+
+
+def get_retry_delay(attempts):
+    """Exponential backoff in seconds"""
+    return TASK_RETRY_DELAY * 2 ** (attempts - 1)
+
+
+class ImmediateBackend:
+    """Runs the task in the caller, the way the hooks ran before"""
+
+    def enqueue(self, name, payload, key):
+        run_task(name, payload)
+
+
+class ThreadBackend:
+    """
+    Runs the tasks in a thread pool of the process once the transaction
+    of the caller commits. Failed tasks are submitted again by a timer
+    after the retry delay, so waiting retries hold no thread of the pool.
+    Keys are only deduplicated while the task is pending.
+    """
+
+    def __init__(self, threads=TASK_THREADS):
+        self.threads = threads
+        self.executor = None
+        self.pending = set()
+        self.lock = threading.Lock()
+
+    def enqueue(self, name, payload, key):
+        transaction.on_commit(lambda: self.submit(name, payload, key))
+
+    def submit(self, name, payload, key):
+        with self.lock:
+            if key is not None:
+                if key in self.pending:
+                    return None
+                self.pending.add(key)
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(
+                    self.threads, thread_name_prefix="task"
+                )
+        return self.executor.submit(self.run, name, payload, key)
+
+    def run(self, name, payload, key, attempt=1):
+        close_old_connections()
+        try:
+            run_task(name, payload)
+        except Exception:
+            logger.exception("Task %s failed, attempt %s", name, attempt)
+            if attempt < TASK_MAX_ATTEMPTS:
+                self.retry(name, payload, key, attempt)
+                return
+        finally:
+            close_old_connections()
+        with self.lock:
+            self.pending.discard(key)
+
+    def retry(self, name, payload, key, attempt):
+        """Submits the next attempt once the delay of the failed one is over"""
+        timer = threading.Timer(
+            get_retry_delay(attempt),
+            self.executor.submit,
+            (self.run, name, payload, key, attempt + 1),
+        )
+        timer.daemon = True
+        timer.start()
+
+
+class DatabaseBackend:
+    """
+    Queues the tasks as Job rows in the transaction of the caller,
+    so a task exists if and only if the write that queued it does.
+    Jobs with the key of a queued or finished job are skipped.
+    """
+
+    def enqueue(self, name, payload, key):
+        Job.objects.bulk_create(
+            [Job(name=name, payload=payload, key=key)], ignore_conflicts=True
+        )
+
+
+backends = {
+    "immediate": ImmediateBackend(),
+    "thread": ThreadBackend(),
+    "database": DatabaseBackend(),
+}
+
+
+def enqueue(name, key=None, **payload):
+    """Queues the task with the JSON payload on the configured backend"""
+    backends[TASK_BACKEND].enqueue(name, payload, key)
+
+
+def claim_jobs(limit):
+    """
+    Locks up to `limit` due jobs for this worker. A job is claimed by
+    a conditional update, so concurrent workers never run it twice,
+    and a worker that died releases it after TASK_LOCK_TIMEOUT.
+    """
+    now = timezone.now()
+    free = Q(locked_until__isnull=True) | Q(locked_until__lt=now)
+    candidates = list(
+        Job.objects.filter(free, status=Job.QUEUED, run_at__lte=now)
+        .order_by("run_at", "id")
+        .values_list("id", flat=True)[:limit]
+    )
+    claimed = []
+    for job_id in candidates:
+        updated = Job.objects.filter(free, id=job_id, status=Job.QUEUED).update(
+            locked_until=now + timedelta(seconds=TASK_LOCK_TIMEOUT),
+            attempts=F("attempts") + 1,
+        )
+        if updated:
+            claimed.append(job_id)
+    return list(Job.objects.filter(id__in=claimed).order_by("run_at", "id"))
+
+
+def run_job(job):
+    try:
+        run_task(job.name, job.payload)
+    except Exception:
+        logger.exception("Job %s (%s) failed", job.id, job.name)
+        failed = job.attempts >= TASK_MAX_ATTEMPTS
+        Job.objects.filter(id=job.id).update(
+            status=Job.FAILED if failed else Job.QUEUED,
+            run_at=timezone.now() + timedelta(seconds=get_retry_delay(job.attempts)),
+            locked_until=None,
+            error=traceback.format_exc(),
+        )
+        return False
+    Job.objects.filter(id=job.id).update(status=Job.DONE, locked_until=None)
+    return True
+
+
+def run_jobs(limit=100):
+    """
+    Runs a batch of due jobs.
+    Returns the numbers of jobs done and failed.
+    """
+    done = failed = 0
+    for job in claim_jobs(limit):
+        if run_job(job):
+            done += 1
+        else:
+            failed += 1
+    return done, failed
+
+
+def purge_jobs(retention=TASK_RETENTION):
+    """Deletes the done jobs queued more than `retention` seconds ago"""
+    before = timezone.now() - timedelta(seconds=retention)
+    return Job.objects.filter(status=Job.DONE, run_at__lt=before).delete()[0]
+
+
+@task
+def fan_out_posts(post_ids):
+    """Delivers new posts to the feeds, in one batch"""
+    feed.fan_out_posts(list(Post.objects.filter(id__in=post_ids)))
+    bump_generation("post")
+
+
+@task
+def index_posts(post_ids):
+    update_search_vectors(post_ids)
+
+
+@task
+def backfill_subscriptions(pairs):
+    """Feeds of new (author_id, subscriber_id) subscriptions still in place"""
+    existing = set(
+        Subscribe.objects.filter(
+            author_id__in={author for author, _ in pairs},
+            subscriber_id__in={subscriber for _, subscriber in pairs},
+        ).values_list("author_id", "subscriber_id")
+    )
+    feed.backfill_subscriptions(
+        [pair for pair in map(tuple, pairs) if pair in existing]
+    )
+    bump_generation("subscribe")
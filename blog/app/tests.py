@@ -1,11 +1,41 @@
+import json
+import tempfile
+import threading
+import time
+from unittest import mock
+from base64 import urlsafe_b64encode
+from datetime import datetime
 from email.policy import HTTP
-from django.contrib.auth.models import User
+from io import StringIO
+from types import SimpleNamespace
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections
+from django.db.backends.sqlite3 import base as sqlite_base
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from rest_framework.test import APITestCase
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APITestCase, APITransactionTestCase
 
-from .models import Post, Subscribe
+from . import async_views, benchmark, conditional, feed, routers, tasks, throttling
+from .async_views import async_list_view
+from .authentication import TOKEN_USER_KEY, get_token_user, local_tokens
+from .backends.postgresql_pool import base as pool_base
+from .cache import GENERATION_TIME_KEY, bump_generation, get_or_build
+from .connections import HealthCheckMixin, check_connections
+from .export import export_lines
+from .instrumentation import registry
+from .models import AuthorStats, FeedEntry, Job, Post, ReadException, Subscribe, UnreadCounter
+from .reads import compact_read_state, get_read_post_ids, is_read, mark_read_before, set_read_status
+from .serializers import PostSerializer, PostSubscribeSerializer, SubscribeSerializer
+from .views import PostAPIViews, PostSubscribeListViews
 
 
 class PostTests(APITestCase):
@@ -75,3 +105,1239 @@ class PostTests(APITestCase):
         self.assertEqual(len(response.data["results"]), 1) 
 
 
+
+class FeedTests(APITestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        self.old_post = Post.objects.create(title="Old", content="Old", author=self.author)
+
+    def test_subscribe_backfills_feed(self):
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        self.assertTrue(
+            FeedEntry.objects.filter(subscriber=self.reader, post=self.old_post).exists()
+        )
+
+    def test_new_post_fans_out(self):
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        new_post = Post.objects.create(title="New", content="New", author=self.author)
+        self.client.force_authenticate(self.reader)
+        response = self.client.get(reverse("post_subscribe"))
+        self.assertEqual(
+            [post["id"] for post in response.data["results"]],
+            [new_post.id, self.old_post.id],
+        )
+
+    def test_unsubscribe_trims_feed(self):
+        subscribe = Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        subscribe.delete()
+        self.assertFalse(FeedEntry.objects.filter(subscriber=self.reader).exists())
+
+    def test_rebuild_feed_command(self):
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        FeedEntry.objects.all().delete()
+        cache.clear()
+        self.client.force_authenticate(self.reader)
+        self.assertEqual(self.client.get(reverse("post_subscribe")).data["results"], [])
+        call_command("rebuild_feed", "reader", stdout=StringIO())
+        self.assertEqual(FeedEntry.objects.filter(subscriber=self.reader).count(), 1)
+        # Cached feed pages are built again
+        response = self.client.get(reverse("post_subscribe"))
+        self.assertEqual([post["id"] for post in response.data["results"]], [self.old_post.id])
+
+class PaginationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        self.posts = [
+            Post.objects.create(title="Post%s" % i, content="Post", author=self.author)
+            for i in range(5)
+        ]
+
+    def test_post_cursor_pages_are_stable(self):
+        response = self.client.get(reverse("post"), {"cursor": "", "limit": 2})
+        self.assertNotIn("count", response.data)
+        first_page = [post["id"] for post in response.data["results"]]
+        Post.objects.create(title="New", content="New", author=self.author)
+        response = self.client.get(response.data["next"])
+        second_page = [post["id"] for post in response.data["results"]]
+        self.assertEqual(first_page, [self.posts[4].id, self.posts[3].id])
+        self.assertEqual(second_page, [self.posts[2].id, self.posts[1].id])
+
+    def test_feed_cursor_walks_all_posts(self):
+        self.client.force_authenticate(self.reader)
+        url = reverse("post_subscribe") + "?cursor="
+        ids = []
+        while url:
+            response = self.client.get(url)
+            ids += [post["id"] for post in response.data["results"]]
+            url = response.data["next"]
+        self.assertEqual(ids, [post.id for post in reversed(self.posts)])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse("post"), {"cursor": "bad"})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_cursor_of_wrong_types(self):
+        self.client.force_authenticate(self.reader)
+        urls = [reverse("post"), reverse("post_subscribe"), reverse("post_search") + "?q=Post&"]
+        now = timezone.now().isoformat()
+        for position in (["abc", 1], [1, 1], [now, "1"], [now, 1.5], ["2022-13-45T00:00:00", 1]):
+            cursor = urlsafe_b64encode(json.dumps(position).encode()).decode()
+            # The rank of search results is an integer
+            for url in urls[:2] if position == [1, 1] else urls:
+                separator = "" if url.endswith("&") else "?"
+                response = self.client.get("%s%scursor=%s" % (url, separator, cursor))
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND, (url, position))
+
+    def test_skip_count(self):
+        response = self.client.get(reverse("authors"), {"count": "false", "limit": 1})
+        self.assertNotIn("count", response.data)
+        self.assertIsNotNone(response.data["next"])
+        self.client.force_authenticate(self.reader)
+        response = self.client.get(reverse("post_subscribe"), {"count": "false"})
+        self.assertNotIn("count", response.data)
+        self.assertEqual(len(response.data["results"]), 5)
+
+class ReadStatusTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        self.read_post = Post.objects.create(title="Read", content="Read", author=self.author)
+        self.new_post = Post.objects.create(title="New", content="New", author=self.author)
+        set_read_status(self.reader, [self.read_post.id], True)
+        self.client.force_authenticate(self.reader)
+
+    def test_feed_read_status(self):
+        response = self.client.get(reverse("post_subscribe"))
+        is_read = {post["id"]: post["is_read"] for post in response.data["results"]}
+        self.assertEqual(is_read, {self.read_post.id: True, self.new_post.id: False})
+
+    def test_feed_queries_do_not_depend_on_readers(self):
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(reverse("post_subscribe"))
+        readers = [
+            User.objects.create_user(username="user%s" % i) for i in range(20)
+        ]
+        for reader in readers:
+            set_read_status(reader, [self.read_post.id, self.new_post.id], True)
+        cache.clear()
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(reverse("post_subscribe"))
+        self.assertEqual(len(before), len(after))
+
+    def test_detail_read_status(self):
+        response = self.client.patch(
+            reverse("post_subscribe_detail", args=[self.new_post.id]),
+            {"is_read": "true"},
+        )
+        self.assertTrue(response.data["is_read"])
+        self.assertTrue(is_read(self.reader, self.new_post))
+
+class CacheTests(APITestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        self.post = Post.objects.create(title="Post", content="Post", author=self.author)
+
+    def test_cached_page_needs_no_queries(self):
+        self.client.get(reverse("post"))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse("post"))
+        self.assertEqual(response.data["count"], 1)
+
+    def test_post_create_and_delete_invalidate(self):
+        self.client.get(reverse("post"))
+        self.client.get(reverse("authors"))
+        Post.objects.create(title="New", content="New", author=self.author)
+        self.assertEqual(self.client.get(reverse("post")).data["count"], 2)
+        authors = self.client.get(reverse("authors"), {"o": "-count_post"}).data
+        self.assertEqual(authors["results"][0]["count_post"], 2)
+        self.post.delete()
+        self.assertEqual(self.client.get(reverse("post")).data["count"], 1)
+
+    def test_feed_invalidated_by_read_status_and_subscribe(self):
+        self.client.force_authenticate(self.reader)
+        self.client.get(reverse("post_subscribe"))
+        set_read_status(self.reader, [self.post.id], True)
+        response = self.client.get(reverse("post_subscribe"))
+        self.assertTrue(response.data["results"][0]["is_read"])
+        Subscribe.objects.all().delete()
+        response = self.client.get(reverse("post_subscribe"))
+        self.assertEqual(response.data["count"], 0)
+
+    def test_waits_for_locked_build(self):
+        cache.add("locked:lock", 1)
+        self.addCleanup(cache.delete, "locked:lock")
+        cache.set("locked", "built elsewhere")
+        self.assertEqual(get_or_build("locked", lambda: "built here"), "built elsewhere")
+        cache.delete("locked")
+        self.assertEqual(get_or_build("locked", lambda: "built here"), "built here")
+
+class AuthorStatsTests(APITestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+
+    def test_counters_follow_writes(self):
+        post = Post.objects.create(title="Post", content="Post", author=self.author)
+        subscribe = Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        stats = AuthorStats.objects.get(user=self.author)
+        self.assertEqual((stats.post_count, stats.subscriber_count), (1, 1))
+        post.delete()
+        subscribe.delete()
+        stats.refresh_from_db()
+        self.assertEqual((stats.post_count, stats.subscriber_count), (0, 0))
+
+    def test_authors_filtered_by_counter(self):
+        Post.objects.create(title="Post", content="Post", author=self.author)
+        response = self.client.get(reverse("authors"), {"count_post": 1})
+        self.assertEqual(
+            [author["author"] for author in response.data["results"]], ["author"]
+        )
+
+    def test_delete_author_with_posts_and_subscribers(self):
+        Post.objects.create(title="Post", content="Post", author=self.author)
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        Subscribe.objects.create(author=self.reader, subscriber=self.author)
+        self.author.delete()
+        self.assertFalse(AuthorStats.objects.filter(user_id=self.author.id).exists())
+        stats = AuthorStats.objects.get(user=self.reader)
+        self.assertEqual(stats.subscriber_count, 0)
+
+    def test_author_without_counters(self):
+        AuthorStats.objects.filter(user=self.author).delete()
+        response = self.client.get(reverse("authors"))
+        self.assertNotIn("author", [author["author"] for author in response.data["results"]])
+        call_command("reconcile_author_stats", stdout=StringIO())
+        response = self.client.get(reverse("authors"), {"o": "-count_post"})
+        counts = {author["author"]: author["count_post"] for author in response.data["results"]}
+        self.assertEqual(counts["author"], 0)
+
+    def test_reconcile_repairs_drift(self):
+        Post.objects.create(title="Post", content="Post", author=self.author)
+        AuthorStats.objects.filter(user=self.author).update(post_count=7)
+        AuthorStats.objects.filter(user=self.reader).delete()
+        out = StringIO()
+        call_command("reconcile_author_stats", stdout=out)
+        self.assertIn("created for 1 authors, repaired for 1 authors", out.getvalue())
+        self.assertEqual(AuthorStats.objects.get(user=self.author).post_count, 1)
+
+class ConditionalRequestTests(APITestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        self.post = Post.objects.create(title="Post", content="Post", author=self.author)
+
+    def test_not_modified(self):
+        response = self.client.get(reverse("post"))
+        etag = response["ETag"]
+        response = self.client.get(reverse("post"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        Post.objects.create(title="New", content="New", author=self.author)
+        response = self.client.get(reverse("post"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_not_modified_since(self):
+        # Changed within the current second, only the ETag validates
+        self.assertNotIn("Last-Modified", self.client.get(reverse("authors")))
+        later = time.time() + 2
+        with mock.patch.object(conditional.time, "time", return_value=later):
+            last_modified = self.client.get(reverse("authors"))["Last-Modified"]
+            response = self.client.get(reverse("authors"), HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(reverse("authors"), HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_feed_etag_follows_read_status(self):
+        self.client.force_authenticate(self.reader)
+        etag = self.client.get(reverse("post_subscribe"))["ETag"]
+        set_read_status(self.reader, [self.post.id], True)
+        response = self.client.get(reverse("post_subscribe"), HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_if_match_update(self):
+        self.client.force_authenticate(self.reader)
+        url = reverse("post_subscribe_detail", args=[self.post.id])
+        etag = self.client.get(url)["ETag"]
+        response = self.client.patch(url, {"is_read": "true"}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        response = self.client.patch(url, {"is_read": "false"}, HTTP_IF_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+        self.assertTrue(is_read(self.reader, self.post))
+
+class BulkReadStatusTests(APITestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.stranger = User.objects.create_user(username="stranger", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        self.posts = [
+            Post.objects.create(title="Post%s" % i, content="Post", author=self.author)
+            for i in range(3)
+        ]
+        self.other_post = Post.objects.create(
+            title="Other", content="Other", author=self.stranger
+        )
+        self.client.force_authenticate(self.reader)
+
+    def read_ids(self):
+        return get_read_post_ids(self.reader, Post.objects.values_list("id", flat=True))
+
+    def test_mark_listed_posts(self):
+        response = self.client.post(
+            reverse("post_subscribe_read"),
+            {"posts": [self.posts[0].id, self.posts[1].id, self.other_post.id]},
+            format="json",
+        )
+        self.assertEqual(response.data, {"is_read": True, "posts": 2})
+        self.assertEqual(self.read_ids(), {self.posts[0].id, self.posts[1].id})
+        self.client.post(
+            reverse("post_subscribe_read"),
+            {"posts": [self.posts[0].id], "is_read": False},
+            format="json",
+        )
+        self.assertEqual(self.read_ids(), {self.posts[1].id})
+
+    def test_mark_all_before(self):
+        before = self.posts[1].time_create.isoformat()
+        self.client.post(reverse("post_subscribe_read"), {"before": before})
+        self.assertEqual(self.read_ids(), {self.posts[0].id, self.posts[1].id})
+        # Only the mark of the subscription was written
+        self.assertFalse(ReadException.objects.exists())
+        response = self.client.get(reverse("post_subscribe"), {"is_read": "false"})
+        self.assertEqual([post["id"] for post in response.data["results"]], [self.posts[2].id])
+
+    def test_posts_or_before_required(self):
+        response = self.client.post(reverse("post_subscribe_read"), {}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class QueryPlanTests(APITestCase):
+    def test_hot_paths_use_indexes(self):
+        author = User.objects.create_user(username="author", password="pas123pas")
+        reader = User.objects.create_user(username="reader", password="qwert1234")
+        Subscribe.objects.create(author=author, subscriber=reader)
+        for i in range(3):
+            Post.objects.create(title="Post%s" % i, content="Post", author=author)
+        Post.objects.create(title="Own", content="Own", author=reader)
+        call_command("explain_hot_paths", stdout=StringIO())
+
+class BenchmarkTests(APITestCase):
+    def test_seed_and_measure(self):
+        cache.clear()
+        data = benchmark.seed(users=10, posts=50, follows=3)
+        self.assertEqual(data["posts"], 50)
+        self.assertTrue(FeedEntry.objects.exists())
+        results = benchmark.run(
+            requests=2, warmup=1, routes=["post_list", "post_subscribe_list"]
+        )
+        self.assertEqual(set(results), {"post_list", "post_subscribe_list"})
+        self.assertEqual(results["post_subscribe_list"]["status"], [200])
+        self.assertEqual(results["post_subscribe_list"]["queries"], 0)
+        results = benchmark.run(requests=2, warmup=1)
+        self.assertIn("post_subscribe_unread", results)
+        self.assertEqual({name: result["status"][0] // 100 for name, result in results.items()}, dict.fromkeys(results, 2))
+        self.assertEqual(max(len(result["status"]) for result in results.values()), 1)
+        pages = benchmark.serialization(page_size=20, repeat=1)
+        self.assertTrue(all(page["identical"] for page in pages.values()))
+        limits = benchmark.rate_limiting(repeat=10, keys=2)
+        self.assertEqual(limits["cache"]["store"], "LocalStore")
+
+class InstrumentationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.admin = User.objects.create_superuser(username="admin", password="pas123pas")
+        self.admin_token = Token.objects.create(user=self.admin)
+
+    def test_server_timing(self):
+        response = self.client.get(reverse("post"))
+        timing = response["Server-Timing"]
+        self.assertIn("db;dur=", timing)
+        self.assertIn('cache;desc="0 hits, 1 misses"', timing)
+        self.assertIn("serialize;dur=", timing)
+        response = self.client.get(reverse("post"))
+        self.assertIn('db;dur=0.00;desc="0 queries"', response["Server-Timing"])
+        # Cached pages are not serialized again
+        self.assertIn("serialize;dur=0.00", response["Server-Timing"])
+
+    def test_metrics_for_admin_only(self):
+        self.client.get(reverse("post"))
+        response = self.client.get(reverse("metrics"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.admin_token.key)
+        response = self.client.get(reverse("metrics"))
+        self.assertIn(
+            'blog_requests_total{route="api/post/",method="GET",status="200"} 1',
+            response.content.decode(),
+        )
+        self.assertIn('blog_serialize_ms_total{route="api/post/",method="GET",status="200"}', response.content.decode())
+        response = self.client.get(reverse("metrics_slow"))
+        self.assertIn("api/post/", [entry["route"] for entry in response.data])
+
+
+class AsyncReadViewTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        self.token = Token.objects.create(user=self.reader)
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        for i in range(3):
+            Post.objects.create(title="Post%s" % i, content="Post", author=self.author)
+        self.factory = RequestFactory()
+
+    def get(self, view, url, **headers):
+        return async_to_sync(view)(self.factory.get(url, **headers))
+
+    def test_cached_feed_served_without_queries(self):
+        headers = {"HTTP_AUTHORIZATION": "Token " + self.token.key}
+        url = reverse("post_subscribe")
+        sync_response = self.client.get(url, **headers)
+        view = async_list_view(PostSubscribeListViews)
+        self.get(view, url, **headers)
+        with self.assertNumQueries(0):
+            response = self.get(view, url, **headers)
+        self.assertEqual(response.content, sync_response.content)
+        self.assertEqual(response["ETag"], sync_response["ETag"])
+        with self.assertNumQueries(0):
+            response = self.get(view, url, HTTP_IF_NONE_MATCH=response["ETag"], **headers)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_miss_and_errors_use_sync_view(self):
+        view = async_list_view(PostAPIViews)
+        response = self.get(view, reverse("post"))
+        self.assertEqual(len(response.data["results"]), 3)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.get(view, reverse("post")).content, response.content)
+        feed = async_list_view(PostSubscribeListViews)
+        response = self.get(feed, reverse("post_subscribe"))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        headers = {"HTTP_AUTHORIZATION": "Token " + self.token.key}
+        self.assertEqual(self.get(feed, reverse("post_subscribe"), **headers).status_code, 200)
+        self.token.delete()
+        response = self.get(feed, reverse("post_subscribe"), **headers)
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+class CachedTokenAuthenticationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        local_tokens.clear()
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        self.token = Token.objects.create(user=self.reader)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+
+    def test_no_auth_query_once_cached(self):
+        self.client.get(reverse("post_subscribe_unread"))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("post_subscribe_unread"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse([query for query in context.captured_queries if "authtoken_token" in query["sql"]])
+        local_tokens.clear()
+        with self.assertNumQueries(len(context)):
+            self.client.get(reverse("post_subscribe_unread"))
+
+    def test_logout_and_deactivation_invalidate(self):
+        self.client.get(reverse("post_subscribe_unread"))
+        self.reader.is_active = False
+        self.reader.save()
+        self.assertEqual(self.client.get(reverse("post_subscribe_unread")).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.reader.is_active = True
+        self.reader.save()
+        self.assertEqual(self.client.get(reverse("post_subscribe_unread")).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.client.post("/api/auth/token/logout/").status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(reverse("post_subscribe_unread")).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_password_change_refreshes_user(self):
+        self.client.get(reverse("post_subscribe_unread"))
+        response = self.client.post("/api/auth/users/set_password/", {"new_password": "n3w-pass-word", "current_password": "qwert1234"})
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertTrue(get_token_user(self.token.key).check_password("n3w-pass-word"))
+
+    def test_cache_keeps_user_id(self):
+        self.client.get(reverse("post_subscribe_unread"))
+        self.assertEqual(cache.get(TOKEN_USER_KEY % self.token.key), self.reader.id)
+        user = get_token_user(self.token.key)
+        User.objects.filter(id=self.reader.id).update(is_staff=True, email="new@example.com")
+        user.set_password("n3w-pass-word")
+        user.save()
+        self.reader.refresh_from_db()
+        self.assertEqual((self.reader.is_staff, self.reader.email), (True, "new@example.com"))
+        self.assertTrue(self.reader.check_password("n3w-pass-word"))
+
+class ValuesSerializerTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        Post.objects.create(title="Пост", content="Line\u2028break \"quoted\"", author=self.author)
+        Post.objects.create(title="Post2", content="Post2", author=self.author)
+        set_read_status(self.reader, [Post.objects.first().id], True)
+
+    def test_same_bytes_as_model_serializers(self):
+        response = self.client.get(reverse("post"))
+        data = PostSerializer(Post.objects.all(), many=True).data
+        self.assertIn(JSONRenderer().render(data)[1:-1], response.content)
+        self.client.force_authenticate(self.reader)
+        response = self.client.get(reverse("post_subscribe"))
+        request = RequestFactory().get("/")
+        request.user = self.reader
+        data = PostSubscribeSerializer(Post.objects.all(), many=True, context={"request": request}).data
+        self.assertIn(JSONRenderer().render(data)[1:-1], response.content)
+        response = self.client.get(reverse("subscribe"))
+        data = SubscribeSerializer(Subscribe.objects.all(), many=True).data
+        self.assertEqual(JSONRenderer().render(data), response.content)
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username="admin", password="pas123pas")
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        self.posts = [
+            Post.objects.create(title="Post%s" % i, content="Post", author=self.author)
+            for i in range(3)
+        ]
+        Post.objects.create(title="Own", content="Own", author=self.reader)
+        set_read_status(self.reader, [self.posts[0].id], True)
+
+    def export(self, **params):
+        self.client.force_authenticate(self.admin)
+        response = self.client.get(reverse("export"), params)
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        return [json.loads(line) for line in b"".join(response.streaming_content).splitlines()]
+
+    def test_export_all(self):
+        lines = self.export()
+        self.assertEqual([line["type"] for line in lines], ["posts"] * 4 + ["subscriptions", "reads"])
+        self.assertEqual(lines[-1], {"type": "reads", "post": self.posts[0].id, "user": "reader"})
+
+    def test_incremental_export_by_author(self):
+        since = Post.objects.get(id=self.posts[0].id).time_update.isoformat()
+        lines = self.export(type="posts", author="author", since=since)
+        self.assertEqual([line["id"] for line in lines], [self.posts[1].id, self.posts[2].id])
+        self.assertEqual(lines[-1]["time_update"], self.posts[2].time_update.isoformat())
+
+    def test_export_command(self):
+        out = StringIO()
+        call_command("export", "--type", "subscriptions", stdout=out)
+        self.assertEqual(
+            json.loads(out.getvalue()),
+            {"type": "subscriptions", "id": Subscribe.objects.get().id, "author": "author", "subscriber": "reader"},
+        )
+
+    def test_export_for_admin_only(self):
+        self.client.force_authenticate(self.reader)
+        response = self.client.get(reverse("export"))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+class ImportTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.admin = User.objects.create_superuser(username="admin", password="pas123pas")
+        self.client.force_authenticate(self.admin)
+
+    def post_import(self, lines, content_type="application/x-ndjson", **params):
+        url = reverse("import")
+        if params:
+            url += "?" + "&".join("%s=%s" % item for item in params.items())
+        return self.client.generic("POST", url, "\n".join(lines), content_type)
+
+    def test_import_ndjson(self):
+        lines = [
+            json.dumps({"type": "users", "username": "author"}),
+            json.dumps({"type": "users", "username": "reader"}),
+            json.dumps({"type": "users", "username": "reader"}),
+            json.dumps({"type": "posts", "id": 501, "author": "author", "title": "Post1", "content": "Post"}),
+            json.dumps({"type": "posts", "author": "nobody", "title": "Post2", "content": "Post"}),
+            json.dumps({"type": "posts", "author": "author", "content": "Post"}),
+            json.dumps({"type": "subscriptions", "author": "author", "subscriber": "reader"}),
+            json.dumps({"type": "subscriptions", "author": "reader", "subscriber": "reader"}),
+            json.dumps({"type": "subscriptions", "author": "author", "subscriber": "reader"}),
+            json.dumps({"type": "reads", "post": 501, "user": "reader"}),
+            "not json",
+        ]
+        response = self.post_import(lines)
+        self.assertEqual(
+            response.data["imported"],
+            {"users": 2, "posts": 1, "subscriptions": 1, "reads": 1},
+        )
+        self.assertEqual([error["line"] for error in response.data["errors"]], [3, 5, 6, 8, 11])
+        post = Post.objects.get(title="Post1")
+        reader = User.objects.get(username="reader")
+        self.assertTrue(FeedEntry.objects.filter(subscriber=reader, post=post).exists())
+        self.assertTrue(is_read(reader, post))
+        stats = AuthorStats.objects.get(user__username="author")
+        self.assertEqual((stats.post_count, stats.subscriber_count), (1, 1))
+
+    def test_import_csv_in_batches(self):
+        User.objects.create_user(username="author", password="pas123pas")
+        lines = ["author,title,content"] + ["author,Post%s,Post" % i for i in range(5)]
+        with CaptureQueriesContext(connection) as context:
+            response = self.post_import(lines, "text/csv", type="posts")
+        self.assertEqual(response.data, {"imported": {"users": 0, "posts": 5, "subscriptions": 0, "reads": 0}, "errors": []})
+        self.assertLess(len(context.captured_queries), 20)
+        response = self.post_import(lines, "text/csv")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(list(response.data), ["type"])
+
+    def test_import_command_reads_export(self):
+        User.objects.create_user(username="author", password="pas123pas")
+        Post.objects.create(title="Post1", content="Post", author=User.objects.get(username="author"))
+        Post.objects.update(time_create=timezone.make_aware(datetime(2020, 1, 1)), time_update=timezone.make_aware(datetime(2020, 1, 2)))
+        out = StringIO()
+        call_command("export", "--type", "posts", stdout=out)
+        exported = Post.objects.values("title", "content", "author", "time_create", "time_update").get()
+        Post.objects.all().delete()
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson") as file:
+            file.write(out.getvalue())
+            file.flush()
+            call_command("import_data", file.name, stdout=StringIO())
+        imported = Post.objects.values("title", "content", "author", "time_create", "time_update").get()
+        self.assertEqual(imported, exported)
+
+class SearchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        self.posts = [
+            Post.objects.create(title="Django tips %s" % i, content="About caching", author=self.author)
+            for i in range(12)
+        ]
+        Post.objects.create(title="Other", content="Nothing to see", author=self.author)
+
+    def test_search_endpoint_pages(self):
+        response = self.client.get(reverse("post_search"), {"q": "django caching"})
+        self.assertEqual(len(response.data["results"]), 10)
+        self.assertNotIn("search_vector", response.data["results"][0])
+        response = self.client.get(response.data["next"])
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertIsNone(response.data["next"])
+
+    def test_search_requires_query(self):
+        response = self.client.get(reverse("post_search"))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_search_filter_on_lists(self):
+        response = self.client.get(reverse("post"), {"search": "nothing"})
+        self.assertEqual([post["title"] for post in response.data["results"]], ["Other"])
+        self.client.force_authenticate(self.reader)
+        response = self.client.get(reverse("post_subscribe"), {"search": "tips 11"})
+        self.assertEqual([post["title"] for post in response.data["results"]], ["Django tips 11"])
+
+class UnreadCounterTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.other = User.objects.create_user(username="other", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        self.posts = [
+            Post.objects.create(title="Post%s" % i, content="Post", author=self.author)
+            for i in range(3)
+        ]
+        set_read_status(self.reader, [self.posts[0].id], True)
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        Subscribe.objects.create(author=self.other, subscriber=self.reader)
+        Post.objects.create(title="Other", content="Other", author=self.other)
+        self.client.force_authenticate(self.reader)
+
+    def summary(self):
+        response = self.client.get(reverse("post_subscribe_unread"))
+        return response.data["total"], {item["author"]: item["unread"] for item in response.data["authors"]}
+
+    def test_counts_follow_writes(self):
+        self.assertEqual(self.summary(), (3, {"author": 2, "other": 1}))
+        self.client.patch(reverse("post_subscribe_detail", args=[self.posts[1].id]), {"is_read": "true"})
+        self.assertEqual(self.summary(), (2, {"author": 1, "other": 1}))
+        self.client.post(reverse("post_subscribe_read"), {"posts": [self.posts[0].id, self.posts[1].id], "is_read": False}, format="json")
+        self.assertEqual(self.summary(), (4, {"author": 3, "other": 1}))
+        set_read_status(self.reader, [post.id for post in self.posts], True)
+        self.assertEqual(self.summary(), (1, {"author": 0, "other": 1}))
+        set_read_status(self.reader, [self.posts[2].id], False)
+        self.posts[1].delete()
+        self.assertEqual(self.summary(), (2, {"author": 1, "other": 1}))
+        Subscribe.objects.filter(author=self.other).delete()
+        self.assertEqual(self.summary(), (1, {"author": 1}))
+
+    def test_rebuild_matches_incremental_counts(self):
+        self.client.post(reverse("post_subscribe_read"), {"posts": [self.posts[1].id]}, format="json")
+        counts = set(UnreadCounter.objects.values_list("subscriber", "author", "count"))
+        call_command("rebuild_unread_counters", stdout=StringIO())
+        self.assertEqual(set(UnreadCounter.objects.values_list("subscriber", "author", "count")), counts)
+
+    def test_summary_queries_do_not_depend_on_posts(self):
+        with CaptureQueriesContext(connection) as before:
+            self.summary()
+        for i in range(10):
+            Post.objects.create(title="More%s" % i, content="Post", author=self.author)
+        with CaptureQueriesContext(connection) as after:
+            self.summary()
+        self.assertEqual(len(before), len(after))
+
+class BulkSubscribeTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        self.authors = [
+            User.objects.create_user(username="author%s" % i, password="pas123pas")
+            for i in range(5)
+        ]
+        for author in self.authors:
+            Post.objects.create(title="Post", content="Post", author=author)
+        Subscribe.objects.create(author=self.authors[0], subscriber=self.reader)
+        self.client.force_authenticate(self.reader)
+
+    def test_subscribe_many(self):
+        usernames = [author.username for author in self.authors] + ["nobody", "reader"]
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post(reverse("subscribe"), {"authors": usernames}, format="json")
+        queries = len(context)
+        results = {item["author"]: item["status"] for item in response.data}
+        self.assertEqual(results["author0"], "already_subscribed")
+        self.assertEqual(results["author4"], "subscribed")
+        self.assertEqual((results["nobody"], results["reader"]), ("not_found", "self"))
+        self.assertEqual(Subscribe.objects.filter(subscriber=self.reader).count(), 5)
+        self.assertEqual(FeedEntry.objects.filter(subscriber=self.reader).count(), 5)
+        self.assertEqual(AuthorStats.objects.get(user=self.authors[4]).subscriber_count, 1)
+        self.assertEqual(self.client.get(reverse("post_subscribe_unread")).data["total"], 5)
+        with CaptureQueriesContext(connection) as more:
+            self.client.post(reverse("subscribe"), {"authors": ["author0", "author1"]}, format="json")
+        self.assertLessEqual(len(more), queries)
+
+    def test_unsubscribe_many(self):
+        self.client.post(reverse("subscribe"), {"authors": ["author1", "author2"]}, format="json")
+        set_read_status(self.reader, Post.objects.filter(author__username__in=["author1", "author2"]).values_list("id", flat=True), True)
+        response = self.client.delete(reverse("subscribe"), {"authors": ["author0", "author1", "author3"]}, format="json")
+        results = {item["author"]: item["status"] for item in response.data}
+        self.assertEqual(results, {"author0": "unsubscribed", "author1": "unsubscribed", "author3": "not_subscribed"})
+        self.assertEqual(list(Subscribe.objects.values_list("author__username", flat=True)), ["author2"])
+        self.assertEqual(FeedEntry.objects.filter(subscriber=self.reader).count(), 1)
+        self.assertEqual(AuthorStats.objects.get(user=self.authors[0]).subscriber_count, 0)
+        self.assertEqual(self.client.get(reverse("post_subscribe_unread")).data["total"], 0)
+        self.assertEqual(list(ReadException.objects.values_list("post__author__username", flat=True)), ["author2"])
+
+    def test_subscribe_through_authors(self):
+        response = self.client.post(reverse("authors"), {"author": "author1"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(reverse("authors"), {"author": "author1"})
+        self.assertEqual(response.data, {"non_field_errors": ["Subscription already exists"]})
+        response = self.client.post(reverse("authors"), {"author": "nobody"})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@mock.patch.object(routers, "READ_REPLICAS", ["replica1"])
+class ReplicaRoutingTests(APITransactionTestCase):
+    databases = {"default", "replica1"}
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        self.token = Token.objects.create(user=self.reader)
+        self.client.credentials(HTTP_AUTHORIZATION="Token " + self.token.key)
+        cache.clear()
+
+    def get_routed(self, url):
+        """Whether the view ran queries on the replica"""
+        with CaptureQueriesContext(connections["replica1"]) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(context.captured_queries) > 0
+
+    def test_reads_go_to_replicas(self):
+        for name in ("post", "authors", "post_subscribe", "subscribe"):
+            self.assertTrue(self.get_routed(reverse(name)), name)
+        self.assertFalse(self.get_routed(reverse("post_subscribe_unread")))
+        self.assertIsNone(routers.ReplicaRouter().db_for_read(Post))
+
+    def test_writers_read_their_writes(self):
+        self.client.post(reverse("subscribe"), {"authors": ["author"]}, format="json")
+        self.assertFalse(self.get_routed(reverse("subscribe")))
+        self.client.credentials()
+        cache.delete(GENERATION_TIME_KEY % "post")
+        cache.delete(GENERATION_TIME_KEY % "user")
+        self.assertTrue(self.get_routed(reverse("authors")))
+
+    def test_pages_built_on_primary_after_changes(self):
+        Post.objects.create(title="Post", content="Post", author=self.author)
+        self.client.credentials()
+        self.assertFalse(self.get_routed(reverse("post")))
+        cache.set(GENERATION_TIME_KEY % "post", time.time() - routers.REPLICA_PIN_SECONDS)
+        self.assertTrue(self.get_routed(reverse("post") + "?limit=1"))
+        # The page is read from the replica, which mirrors the test database
+        with CaptureQueriesContext(connections["replica1"]) as context:
+            response = self.client.get(reverse("post") + "?limit=2")
+        self.assertEqual([post["title"] for post in response.data["results"]], ["Post"])
+        self.assertTrue(any('"app_post"' in query["sql"] for query in context.captured_queries))
+
+
+class ConnectionTests(APITestCase):
+    def get_wrapper(self):
+        wrapper_class = type("DatabaseWrapper", (HealthCheckMixin, sqlite_base.DatabaseWrapper), {})
+        settings_dict = dict(connections["default"].settings_dict, CONN_HEALTH_CHECKS=True)
+        wrapper = wrapper_class(settings_dict, "default")
+        self.addCleanup(wrapper.close)
+        wrapper.ensure_connection()
+        return wrapper
+
+    def test_reused_connections_checked_on_first_use(self):
+        wrapper = self.get_wrapper()
+        wrapper.health_check_done = False
+        reused = registry.counters["db_connections_reused"]
+        with mock.patch.object(wrapper, "is_usable", return_value=True) as is_usable:
+            wrapper.ensure_connection()
+            wrapper.ensure_connection()
+        is_usable.assert_called_once_with()
+        self.assertEqual(registry.counters["db_connections_reused"], reused + 1)
+        self.assertIn("blog_db_connections_reused_total", registry.render_prometheus())
+
+    def test_broken_connections_closed(self):
+        wrapper = self.get_wrapper()
+        wrapper.health_check_done = False
+        broken = registry.counters["db_connections_broken"]
+        with mock.patch.object(wrapper, "is_usable", return_value=False):
+            wrapper.ensure_connection()
+        self.assertEqual(registry.counters["db_connections_broken"], broken + 1)
+        self.assertTrue(wrapper.is_usable())
+
+    def test_request_start_defers_checks(self):
+        connection.ensure_connection()
+        with mock.patch.object(connection, "is_usable") as is_usable:
+            check_connections()
+        is_usable.assert_not_called()
+        self.assertFalse(connection.health_check_done)
+
+
+class FakeConnection:
+    closed = False
+    uses = 0
+    isolation_level = None
+
+
+class FakePool:
+    def __init__(self, minconn, maxconn, **kwargs):
+        self.free = []
+        self.created = []
+
+    def getconn(self):
+        if not self.free:
+            self.created.append(FakeConnection())
+            return self.created[-1]
+        return self.free.pop()
+
+    def putconn(self, connection, close=False):
+        if not close:
+            self.free.append(connection)
+
+
+class ConnectionPoolTests(APITestCase):
+    def setUp(self):
+        patches = [
+            mock.patch.object(pool_base.pool, "ThreadedConnectionPool", FakePool),
+            mock.patch.object(pool_base.psycopg2.extras, "register_default_jsonb"),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        settings_dict = dict(
+            connections["default"].settings_dict,
+            CONN_HEALTH_CHECKS=False,
+            OPTIONS={"isolation_level": None},
+            POOL_SIZE=1,
+            POOL_TIMEOUT=0.1,
+        )
+        self.wrappers = [pool_base.DatabaseWrapper(settings_dict, "pooltest") for _ in range(2)]
+        self.addCleanup(pool_base.pools.pop, "pooltest", None)
+
+    def test_reuse_and_exhaustion(self):
+        first, second = self.wrappers
+        first.connection = first.get_new_connection({})
+        timeouts = registry.counters["db_pool_timeouts"]
+        with self.assertRaises(OperationalError):
+            second.get_new_connection({})
+        self.assertEqual(registry.counters["db_pool_timeouts"], timeouts + 1)
+        reused = registry.counters["db_connections_reused"]
+        first.close()
+        connection = second.get_new_connection({})
+        self.assertEqual(pool_base.pools["pooltest"].connections.created, [connection])
+        self.assertEqual(connection.uses, 2)
+        self.assertEqual(registry.counters["db_connections_reused"], reused + 1)
+
+    def test_waits_for_a_free_connection(self):
+        first, second = self.wrappers
+        first.connection = first.get_new_connection({})
+        timer = threading.Timer(0.02, first._close)
+        timer.start()
+        self.addCleanup(timer.join)
+        connection = second.get_new_connection({})
+        self.assertEqual(pool_base.pools["pooltest"].connections.created, [connection])
+        self.assertEqual(connection.uses, 2)
+
+
+class FanOutOnReadTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        self.authors = [
+            User.objects.create_user(username="author%s" % i, password="pas123pas")
+            for i in range(4)
+        ]
+        for author in self.authors:
+            Subscribe.objects.create(author=author, subscriber=self.reader)
+        # Delivered to the feed before the author became popular
+        Post.objects.create(title="Early", content="Early", author=self.authors[0])
+        AuthorStats.objects.filter(user__in=self.authors[:3]).update(fan_out_on_read=True)
+        for i in range(12):
+            Post.objects.create(title="Post%s" % i, content="Post", author=self.authors[i % 4])
+        self.client.force_authenticate(self.reader)
+        self.expected = list(Post.objects.order_by("-time_create", "-id").values_list("id", flat=True))
+
+    def get_ids(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [post["id"] for post in response.data["results"]], response.data
+
+    def test_popular_posts_merged_into_pages(self):
+        self.assertEqual(FeedEntry.objects.filter(subscriber=self.reader).count(), 4)
+        ids, data = self.get_ids(reverse("post_subscribe"))
+        self.assertEqual(data["count"], 13)
+        second, _ = self.get_ids(reverse("post_subscribe") + "?page=2&count=false")
+        self.assertEqual(ids + second, self.expected)
+        ids, data = self.get_ids(reverse("post_subscribe") + "?cursor=")
+        while data["next"]:
+            more, data = self.get_ids(data["next"])
+            ids += more
+        self.assertEqual(ids, self.expected)
+
+    def test_read_status_of_popular_posts(self):
+        post = Post.objects.get(title="Post0")
+        self.assertFalse(FeedEntry.objects.filter(post=post).exists())
+        url = reverse("post_subscribe_detail", args=[post.id])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        response = self.client.patch(url, {"is_read": "true"})
+        self.assertEqual((response.status_code, response.data["is_read"]), (200, True))
+        response = self.client.post(reverse("post_subscribe_read"), {"posts": [post.id], "is_read": False}, format="json")
+        self.assertEqual(response.data, {"is_read": False, "posts": 1})
+        self.assertFalse(is_read(self.reader, post))
+        response = self.client.post(reverse("post_subscribe_read"), {"before": timezone.now().isoformat(), "is_read": True}, format="json")
+        self.assertEqual(response.data, {"is_read": True, "posts": 13})
+        self.assertEqual(self.client.get(reverse("post_subscribe_unread")).data["total"], 0)
+        other = User.objects.create_user(username="other", password="pas123pas")
+        post = Post.objects.create(title="Other", content="Other", author=other)
+        url = reverse("post_subscribe_detail", args=[post.id])
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_filtered_feed_includes_popular_posts(self):
+        set_read_status(self.reader, [Post.objects.get(title="Post0").id], True)
+        ids, data = self.get_ids(reverse("post_subscribe") + "?is_read=false")
+        self.assertEqual(data["count"], 12)
+        self.assertNotIn(Post.objects.get(title="Post0").id, ids)
+
+    def test_recent_posts_follow_writes(self):
+        self.get_ids(reverse("post_subscribe"))
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            post = Post.objects.create(title="New", content="New", author=self.authors[1])
+            self.assertTrue(cache.get(feed.RECENT_POSTS_KEY % self.authors[1].id))
+        self.assertTrue(callbacks)
+        self.assertEqual(self.get_ids(reverse("post_subscribe"))[0][0], post.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            post.delete()
+        self.assertEqual(self.get_ids(reverse("post_subscribe"))[0], self.expected[:10])
+
+    def test_deep_pages_past_recent_posts(self):
+        with mock.patch.object(feed, "FEED_RECENT_POSTS", 2):
+            ids, data = self.get_ids(reverse("post_subscribe") + "?cursor=")
+            while data["next"]:
+                more, data = self.get_ids(data["next"])
+                ids += more
+        self.assertEqual(ids, self.expected)
+
+    def test_queries_do_not_grow_with_subscriptions(self):
+        url = reverse("post_subscribe") + "?cursor="
+        self.client.get(url)
+        bump_generation("read:%s" % self.reader.id)
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url)
+        queries = len(context)
+        self.assertTrue(queries)
+        for i in range(5):
+            author = User.objects.create_user(username="popular%s" % i, password="pas123pas")
+            AuthorStats.objects.filter(user=author).update(fan_out_on_read=True)
+            Subscribe.objects.create(author=author, subscriber=self.reader)
+            Post.objects.create(title="Popular", content="Popular", author=author)
+        self.client.get(url)
+        bump_generation("read:%s" % self.reader.id)
+        with self.assertNumQueries(queries):
+            self.client.get(url)
+
+    def test_popular_authors_switch(self):
+        with mock.patch("app.stats.FEED_FAN_OUT_LIMIT", 2):
+            author = self.authors[3]
+            Subscribe.objects.create(author=author, subscriber=self.authors[0])
+        self.assertTrue(AuthorStats.objects.get(user=author).fan_out_on_read)
+
+
+@mock.patch.object(tasks, "TASK_BACKEND", "database")
+class TaskTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+
+    def test_hooks_queue_jobs_for_the_worker(self):
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        self.client.force_authenticate(self.author)
+        response = self.client.post(reverse("post"), {"title": "Post", "content": "Post"})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(FeedEntry.objects.exists())
+        self.assertEqual(
+            sorted(Job.objects.values_list("name", flat=True)),
+            ["backfill_subscriptions", "fan_out_posts"],
+        )
+        tasks.enqueue("fan_out_posts", key="fan-out:%s" % response.data["id"], post_ids=[response.data["id"]])
+        self.assertEqual(Job.objects.count(), 2)
+        out = StringIO()
+        call_command("run_tasks", "--once", stdout=out)
+        self.assertIn("2 jobs done, 0 failed", out.getvalue())
+        self.assertEqual(FeedEntry.objects.filter(subscriber=self.reader).count(), 1)
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 2)
+
+    @mock.patch.object(tasks, "TASK_MAX_ATTEMPTS", 2)
+    def test_failed_jobs_retried(self):
+        calls = []
+
+        def flaky(value):
+            calls.append(value)
+            raise ValueError(value)
+
+        with mock.patch.dict(tasks.registry, {"flaky": flaky}), self.assertLogs("app.tasks"):
+            tasks.enqueue("flaky", value=1)
+            self.assertEqual(tasks.run_jobs(), (0, 1))
+            self.assertEqual(tasks.run_jobs(), (0, 0))
+            Job.objects.update(run_at=timezone.now())
+            self.assertEqual(tasks.run_jobs(), (0, 1))
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts, calls), (Job.FAILED, 2, [1, 1]))
+        self.assertIn("ValueError", job.error)
+
+    def test_thread_backend_runs_after_commit(self):
+        done = threading.Event()
+        backend = tasks.ThreadBackend(threads=1)
+        with mock.patch.dict(tasks.registry, {"signal": lambda: done.set()}):
+            with self.captureOnCommitCallbacks(execute=True):
+                backend.enqueue("signal", {}, "once")
+                self.assertFalse(done.is_set())
+            self.assertTrue(done.wait(5))
+        backend.executor.shutdown()
+
+    def test_thread_backend_retries_without_holding_the_pool(self):
+        calls = []
+        done = threading.Event()
+
+        def flaky():
+            calls.append(threading.current_thread().name)
+            if len(calls) == 1:
+                raise ValueError("first attempt")
+            done.set()
+
+        backend = tasks.ThreadBackend(threads=1)
+        with mock.patch.dict(tasks.registry, {"flaky": flaky, "other": lambda: calls.append("other")}):
+            with mock.patch.object(tasks, "TASK_RETRY_DELAY", 0.2), self.assertLogs("app.tasks", "ERROR"):
+                backend.submit("flaky", {}, "flaky")
+                # The pool thread is free while the retry waits
+                backend.submit("other", {}, None).result(timeout=5)
+                self.assertEqual(backend.submit("flaky", {}, "flaky"), None)
+                self.assertTrue(done.wait(5))
+        backend.executor.shutdown()
+        self.assertEqual((len(calls), calls[1]), (3, "other"))
+        self.assertEqual(backend.pending, set())
+
+
+class ThrottleTests(APITestCase):
+    def setUp(self):
+        throttling.local_store.clear()
+        self.reader = User.objects.create_user(username="reader", password="pass")
+        self.authors = [
+            User.objects.create_user(username="author%s" % i, password="pass")
+            for i in range(3)
+        ]
+        self.client.force_authenticate(self.reader)
+        rates = {"subscribe": "2/min"}
+        patcher = mock.patch.object(
+            throttling.SlidingWindowThrottle, "THROTTLE_RATES", rates
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(throttling.local_store.clear)
+
+    def test_route_budget(self):
+        url = reverse("authors")
+        for author in self.authors[:2]:
+            response = self.client.post(url, {"author": author.username})
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.post(url, {"author": self.authors[2].username})
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertGreater(int(response["Retry-After"]), 0)
+        # Scopes without a rate are not throttled
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        with throttling.unthrottled():
+            response = self.client.post(url, {"author": self.authors[2].username})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_async_cached_pages(self):
+        Post.objects.create(title="Post", content="Post", author=self.authors[0])
+        view = async_list_view(PostAPIViews)
+        with mock.patch.dict(throttling.SlidingWindowThrottle.THROTTLE_RATES, {"anon": "2/min"}):
+            responses = [async_to_sync(view)(RequestFactory().get(reverse("post"))) for _ in range(3)]
+        self.assertEqual([response.status_code for response in responses], [200, 200, 429])
+        self.assertGreater(int(responses[2]["Retry-After"]), 0)
+
+    def test_async_redis_counters(self):
+        results = [[1, 1, 0], [0, 2, 0], ConnectionError("down")]
+        calls = []
+
+        class Client:
+            def register_script(self, script):
+                async def run(keys, args):
+                    calls.append(keys)
+                    result = results[len(calls) - 1]
+                    if isinstance(result, Exception):
+                        raise result
+                    return result
+
+                return run
+
+        request = RequestFactory().get(reverse("post"))
+        view = PostAPIViews(request=SimpleNamespace(user=AnonymousUser(), method="GET", META=request.META))
+        with mock.patch.object(async_views, "RedisCache", type(caches["default"])), mock.patch.object(
+            async_views.async_cache, "get_client", return_value=Client()
+        ), mock.patch.dict(throttling.SlidingWindowThrottle.THROTTLE_RATES, {"anon": "2/min"}):
+            with self.assertLogs("app.throttling", "WARNING"):
+                allowed = [async_to_sync(async_views.ais_allowed)(view) for _ in range(3)]
+        # The script counts the requests, failures fall back to local counters
+        self.assertEqual(allowed, [True, False, True])
+        self.assertEqual(len(calls), 3)
+        self.assertTrue(calls[0][0].startswith(cache.make_key("throttle_anon_")))
+
+    def test_sliding_window(self):
+        store = throttling.LocalStore()
+        # Half way through the window 1000 of a minute
+        with mock.patch.object(throttling.time, "time", return_value=60030):
+            # 20 requests of the previous window still weigh 10
+            store.counters["key"] = (999, 20, 0)
+            self.assertTrue(store.hit("key", 12, 60)[0])
+            self.assertTrue(store.hit("key", 12, 60)[0])
+            allowed, wait = store.hit("key", 12, 60)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 3)
+
+
+class SparseFieldsTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        self.post = Post.objects.create(title="Long", content="x" * 5000, author=self.author)
+        self.client.force_authenticate(self.reader)
+
+    def test_fields(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse("post") + "?fields=id,title")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["results"], [{"id": self.post.id, "title": "Long"}])
+        self.assertFalse(any('"content"' in query["sql"] for query in context.captured_queries))
+        response = self.client.get(reverse("post_subscribe") + "?fields=id,author,is_read")
+        self.assertEqual(
+            response.data["results"], [{"id": self.post.id, "author": "author", "is_read": False}]
+        )
+        response = self.client.get(reverse("post") + "?fields=id,password")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_preview(self):
+        response = self.client.get(reverse("post") + "?preview=100&fields=content")
+        self.assertEqual(response.data["results"], [{"content": "x" * 100}])
+        response = self.client.get(reverse("post_subscribe") + "?preview=10&cursor=")
+        self.assertEqual(response.data["results"][0]["content"], "x" * 10)
+        self.assertEqual(response.data["results"][0]["title"], "Long")
+        response = self.client.get(reverse("post_subscribe") + "?preview=0")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_preview_of_merged_feed(self):
+        AuthorStats.objects.filter(user=self.author).update(fan_out_on_read=True)
+        Post.objects.create(title="New", content="y" * 5000, author=self.author)
+        response = self.client.get(reverse("post_subscribe") + "?preview=3")
+        self.assertEqual([post["content"] for post in response.data["results"]], ["yyy", "xxx"])
+
+
+class ReadStateTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username="author", password="pas123pas")
+        self.reader = User.objects.create_user(username="reader", password="qwert1234")
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        self.posts = [
+            Post.objects.create(title="Post%s" % i, content="Post", author=self.author)
+            for i in range(4)
+        ]
+        self.ids = [post.id for post in self.posts]
+
+    def test_exceptions_follow_the_mark(self):
+        set_read_status(self.reader, self.ids[:3], True)
+        self.assertEqual(ReadException.objects.count(), 3)
+        self.assertEqual(compact_read_state(), 3)
+        subscription = Subscribe.objects.get()
+        self.assertEqual(subscription.read_up_to, self.posts[2].time_create)
+        self.assertEqual(get_read_post_ids(self.reader, self.ids), set(self.ids[:3]))
+        set_read_status(self.reader, [self.ids[1]], False)
+        self.assertEqual(
+            list(ReadException.objects.values_list("post_id", "is_read")), [(self.ids[1], False)]
+        )
+        self.assertEqual(get_read_post_ids(self.reader, self.ids), {self.ids[0], self.ids[2]})
+        set_read_status(self.reader, [self.ids[1]], True)
+        self.assertFalse(ReadException.objects.exists())
+        counts = set(UnreadCounter.objects.values_list("subscriber", "author", "count"))
+        self.assertEqual(counts, {(self.reader.id, self.author.id, 1)})
+        call_command("rebuild_unread_counters", stdout=StringIO())
+        self.assertEqual(set(UnreadCounter.objects.values_list("subscriber", "author", "count")), counts)
+
+    def test_feed_filter_and_export(self):
+        set_read_status(self.reader, self.ids[:2], True)
+        compact_read_state()
+        set_read_status(self.reader, [self.ids[0]], False)
+        set_read_status(self.reader, [self.ids[3]], True)
+        self.client.force_authenticate(self.reader)
+        response = self.client.get(reverse("post_subscribe"), {"is_read": "false"})
+        self.assertEqual({post["id"] for post in response.data["results"]}, {self.ids[0], self.ids[2]})
+        lines = [json.loads(line) for line in export_lines(["reads"])]
+        self.assertEqual({line["post"] for line in lines}, {self.ids[1], self.ids[3]})
+        self.assertEqual({line["user"] for line in lines}, {"reader"})
+
+    def test_mark_stops_at_covered_posts(self):
+        self.client.force_authenticate(self.reader)
+        self.client.post(reverse("post_subscribe_read"), {"before": "2099-01-01T00:00:00Z"})
+        self.assertEqual(Subscribe.objects.get().read_up_to, self.posts[3].time_create)
+        post = Post.objects.create(title="New", content="New", author=self.author)
+        response = self.client.get(reverse("post_subscribe"), {"is_read": "false"})
+        self.assertEqual([item["id"] for item in response.data["results"]], [post.id])
+        self.assertEqual(UnreadCounter.objects.get().count, 1)
+
+    def test_stale_exception_after_resubscribe(self):
+        mark_read_before(self.reader, timezone.now())
+        set_read_status(self.reader, [self.ids[0]], False)
+        Subscribe.objects.get().delete()
+        self.assertFalse(ReadException.objects.exists())
+        Subscribe.objects.create(author=self.author, subscriber=self.reader)
+        self.assertEqual(set_read_status(self.reader, [self.ids[0]], True), 1)
+        self.assertTrue(is_read(self.reader, self.posts[0]))
+        self.assertEqual(UnreadCounter.objects.get().count, 3)
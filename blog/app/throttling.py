@@ -0,0 +1,216 @@
+import logging
+import math
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.core.cache import caches
+from rest_framework.throttling import ScopedRateThrottle
+
+logger = logging.getLogger("app.throttling")
+
+throttling_enabled = ContextVar("throttling_enabled", default=True)
+
+# Sliding window counter: the count of the previous fixed window is
+# weighted by the share of it still inside the sliding window
+SLIDING_WINDOW_SCRIPT = """
+local current = tonumber(redis.call("GET", KEYS[1]) or "0")
+local previous = tonumber(redis.call("GET", KEYS[2]) or "0")
+if previous * (1 - tonumber(ARGV[3])) + current >= tonumber(ARGV[1]) then
+    return {0, current, previous}
+end
+current = redis.call("INCR", KEYS[1])
+if current == 1 then
+    redis.call("EXPIRE", KEYS[1], ARGV[2] * 2)
+end
+return {1, current, previous}
+"""
+
+
+def get_window(duration, now):
+    """Index of the fixed window and the elapsed share of it"""
+    position = now / duration
+    window = math.floor(position)
+    return window, position - window
+
+
+def get_wait(limit, duration, elapsed, current, previous):
+    """Seconds until the sliding window count falls below the limit"""
+    if current >= limit:
+        # Only the next window makes room, once this one weighs less
+        return (1 - elapsed) * duration + (1 - (limit - 1) / current) * duration
+    if previous:
+        needed = 1 - (limit - 1 - current) / previous
+        return max(needed - elapsed, 0) * duration
+    return 0
+
+
+class LocalStore:
+    """
+    Counters of the process, for caches without Redis or when Redis
+    fails. Each process then enforces the whole budget on its own.
+    """
+
+    def __init__(self, size=100000):
+        self.size = size
+        self.counters = {}
+        self.lock = threading.Lock()
+
+    def hit(self, key, limit, duration):
+        now = time.time()
+        window, elapsed = get_window(duration, now)
+        with self.lock:
+            start, current, previous = self.counters.get(key, (window, 0, 0))
+            if start != window:
+                previous = current if start == window - 1 else 0
+                current = 0
+            allowed = previous * (1 - elapsed) + current < limit
+            if allowed:
+                current += 1
+            if key not in self.counters and len(self.counters) >= self.size:
+                self.prune(window)
+            self.counters[key] = (window, current, previous)
+        wait = 0 if allowed else get_wait(limit, duration, elapsed, current, previous)
+        return allowed, wait
+
+    def prune(self, window):
+        """Drops the counters of windows that no longer count"""
+        for key in [
+            key for key, counts in self.counters.items() if counts[0] < window - 1
+        ]:
+            del self.counters[key]
+        if len(self.counters) >= self.size:
+            self.counters.clear()
+
+    def clear(self):
+        with self.lock:
+            self.counters.clear()
+
+
+class RedisStore:
+    """Counters shared by all processes, updated by one Lua script call"""
+
+    def __init__(self, client, backend):
+        self.script = client.register_script(SLIDING_WINDOW_SCRIPT)
+        self.backend = backend
+
+    def get_keys(self, key, window):
+        """Keys of the counters of the window and the previous one"""
+        key = self.backend.make_key(key)
+        return ["%s:%s" % (key, window), "%s:%s" % (key, window - 1)]
+
+    def hit(self, key, limit, duration):
+        window, elapsed = get_window(duration, time.time())
+        allowed, current, previous = self.script(
+            keys=self.get_keys(key, window), args=[limit, duration, elapsed]
+        )
+        wait = 0 if allowed else get_wait(limit, duration, elapsed, current, previous)
+        return bool(allowed), wait
+
+
+class AsyncRedisStore(RedisStore):
+    """The Redis counters updated with a redis.asyncio client"""
+
+    async def hit(self, key, limit, duration):
+        window, elapsed = get_window(duration, time.time())
+        allowed, current, previous = await self.script(
+            keys=self.get_keys(key, window), args=[limit, duration, elapsed]
+        )
+        wait = 0 if allowed else get_wait(limit, duration, elapsed, current, previous)
+        return bool(allowed), wait
+
+
+local_store = LocalStore()
+redis_stores = {}
+async_redis_stores = weakref.WeakKeyDictionary()
+
+
+def get_store():
+    """Redis when the default cache is django-redis, the local store otherwise"""
+    backend = caches["default"]
+    client = getattr(backend, "client", None)
+    if client is None or not hasattr(client, "get_client"):
+        return local_store
+    redis = client.get_client(write=True)
+    if redis not in redis_stores:
+        redis_stores[redis] = RedisStore(redis, backend)
+    return redis_stores[redis]
+
+
+def hit(key, limit, duration):
+    """Counts a request, returns whether it is allowed and the wait"""
+    store = get_store()
+    if store is local_store:
+        return local_store.hit(key, limit, duration)
+    try:
+        return store.hit(key, limit, duration)
+    except Exception:
+        logger.warning("Throttling falls back to local counters", exc_info=True)
+        return local_store.hit(key, limit, duration)
+
+
+async def ahit(client, key, limit, duration):
+    """hit() from the event loop with the redis.asyncio client"""
+    store = async_redis_stores.get(client)
+    if store is None:
+        store = async_redis_stores[client] = AsyncRedisStore(client, caches["default"])
+    try:
+        return await store.hit(key, limit, duration)
+    except Exception:
+        logger.warning("Throttling falls back to local counters", exc_info=True)
+        return local_store.hit(key, limit, duration)
+
+
+@contextmanager
+def unthrottled():
+    """Requests of the block are not throttled, for benchmarks"""
+    token = throttling_enabled.set(False)
+    try:
+        yield
+    finally:
+        throttling_enabled.reset(token)
+
+
+class SlidingWindowThrottle(ScopedRateThrottle):
+    """
+    Throttles with a sliding window counter per scope and user (the IP
+    address for anonymous requests). The scope is the one of the method
+    in `throttle_scopes` of the view, else its `throttle_scope`, else
+    `user` or `anon`. Rates are DEFAULT_THROTTLE_RATES, a scope without
+    a rate is not throttled.
+    """
+
+    def get_limit(self, request, view):
+        """Counter key, limit and duration of the request, None if unlimited"""
+        if not throttling_enabled.get():
+            return None
+        self.scope = getattr(view, "throttle_scopes", {}).get(
+            request.method
+        ) or getattr(view, self.scope_attr, None)
+        if not self.scope:
+            self.scope = "user" if request.user.is_authenticated else "anon"
+        self.rate = self.THROTTLE_RATES.get(self.scope)
+        if self.rate is None:
+            return None
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+        return self.get_cache_key(request, view), self.num_requests, self.duration
+
+    def allow_request(self, request, view):
+        limit = self.get_limit(request, view)
+        if limit is None:
+            return True
+        allowed, self.wait_time = hit(*limit)
+        return allowed
+
+    async def aallow_request(self, request, view, client):
+        """allow_request() counted with a redis.asyncio client"""
+        limit = self.get_limit(request, view)
+        if limit is None:
+            return True
+        allowed, self.wait_time = await ahit(client, *limit)
+        return allowed
+
+    def wait(self):
+        return self.wait_time
@@ -0,0 +1,124 @@
+from collections import Counter
+
+from django.conf import settings
+from django.db.models import Count, Exists, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from . import reads
+from .models import Post, Subscribe, UnreadCounter
+
+UNREAD_BATCH_SIZE = getattr(settings, "UNREAD_BATCH_SIZE", 1000)
+
+
+def posts_created(posts):
+    """
+    Every subscriber of the authors has the new posts unread, unless
+    a read mark covers them: these counters are recounted
+    """
+    for author_id, count in Counter(post.author_id for post in posts).items():
+        oldest = min(post.time_create for post in posts if post.author_id == author_id)
+        marked = Subscribe.objects.filter(
+            author_id=author_id, read_up_to__gte=oldest
+        ).values_list("subscriber_id", flat=True)
+        UnreadCounter.objects.filter(author_id=author_id).exclude(
+            subscriber_id__in=marked
+        ).update(count=F("count") + count)
+        marked = list(marked)
+        if marked:
+            rebuild_unread_counters(marked, author_ids=[author_id])
+
+
+def post_deleted(post):
+    """Called before the delete, while the read exceptions of the post exist"""
+    read = Post.objects.filter(
+        reads.read_condition(OuterRef(OuterRef("subscriber"))), id=post.id
+    )
+    UnreadCounter.objects.filter(author_id=post.author_id).exclude(Exists(read)).update(
+        count=F("count") - 1
+    )
+
+
+def read_status_changed(pairs, is_read):
+    """
+    Counts the (user_id, post_id) pairs whose read status changed,
+    one update per subscriber and author
+    """
+    pairs = list(pairs)
+    if not pairs:
+        return
+    authors = dict(
+        Post.objects.filter(id__in={post_id for _, post_id in pairs}).values_list(
+            "id", "author_id"
+        )
+    )
+    changes = Counter(
+        (user_id, authors[post_id]) for user_id, post_id in pairs if post_id in authors
+    )
+    for (user_id, author_id), count in changes.items():
+        UnreadCounter.objects.filter(subscriber_id=user_id, author_id=author_id).update(
+            count=F("count") + (-count if is_read else count)
+        )
+
+
+def subscription_created(subscribe):
+    rebuild_unread_counters([subscribe.subscriber_id], author_ids=[subscribe.author_id])
+
+
+def subscriptions_deleted(subscriber_id, author_ids):
+    UnreadCounter.objects.filter(
+        subscriber_id=subscriber_id, author_id__in=author_ids
+    ).delete()
+
+
+def rebuild_unread_counters(subscriber_ids=None, author_ids=None):
+    """
+    Recounts the counters from the subscriptions, the posts and the
+    read state. Returns the number of counters written.
+    """
+    subscriptions = Subscribe.objects.all()
+    counters = UnreadCounter.objects.all()
+    if subscriber_ids is not None:
+        subscriptions = subscriptions.filter(subscriber_id__in=subscriber_ids)
+        counters = counters.filter(subscriber_id__in=subscriber_ids)
+    if author_ids is not None:
+        subscriptions = subscriptions.filter(author_id__in=author_ids)
+        counters = counters.filter(author_id__in=author_ids)
+    posts = Subquery(
+        Post.objects.filter(author=OuterRef("author"))
+        .exclude(reads.read_condition(OuterRef(OuterRef("subscriber"))))
+        .order_by()
+        .values("author")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    rows = subscriptions.annotate(unread=Coalesce(posts, 0)).values_list(
+        "subscriber_id", "author_id", "unread"
+    )
+    counters.delete()
+    count = 0
+    batch = []
+    for subscriber_id, author_id, unread in rows.iterator(chunk_size=UNREAD_BATCH_SIZE):
+        batch.append(
+            UnreadCounter(
+                subscriber_id=subscriber_id, author_id=author_id, count=unread
+            )
+        )
+        if len(batch) >= UNREAD_BATCH_SIZE:
+            count += len(
+                UnreadCounter.objects.bulk_create(batch, ignore_conflicts=True)
+            )
+            batch = []
+    # A concurrent rebuild may have written the same counters meanwhile
+    count += len(UnreadCounter.objects.bulk_create(batch, ignore_conflicts=True))
+    return count
+
+
+def get_unread_summary(user):
+    """Total and per author unread counts, O(followed authors)"""
+    authors = [
+        {"author": username, "unread": count}
+        for username, count in UnreadCounter.objects.filter(subscriber=user)
+        .order_by("author__username")
+        .values_list("author__username", "count")
+    ]
+    return {"total": sum(author["unread"] for author in authors), "authors": authors}
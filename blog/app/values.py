@@ -0,0 +1,189 @@
+from django.conf import settings
+from django.db.models.functions import Substr
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.settings import ISO_8601, api_settings
+
+from .instrumentation import record_serialization
+
+
+class DateTimeFormatter:
+    """
+    Output of DRF's DateTimeField with the DATETIME_FORMAT setting,
+    the time zone is looked up once per page instead of once per value
+    """
+
+    def __init__(self):
+        self.format = api_settings.DATETIME_FORMAT
+        self.timezone = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def __call__(self, value):
+        if not value:
+            return None
+        if self.format is None or isinstance(value, str):
+            return value
+        if self.timezone is None:
+            if timezone.is_aware(value):
+                value = timezone.make_naive(value, timezone.utc)
+        elif timezone.is_aware(value):
+            value = value.astimezone(self.timezone)
+        else:
+            value = timezone.make_aware(value, self.timezone)
+        if self.format.lower() == ISO_8601:
+            value = value.isoformat()
+            if value.endswith("+00:00"):
+                value = value[:-6] + "Z"
+            return value
+        return value.strftime(self.format)
+
+
+class ValuesSerializer:
+    """
+    Read-only serializer of `.values()` rows for the list views.
+    Gives the output of the model serializer it mirrors without
+    building field objects: `columns` are fetched and
+    `to_representation` maps a row to a dict.
+    """
+
+    columns = ()
+    # Output fields that can be selected, with their column or None
+    field_columns = {}
+
+    def __init__(self, instance=None, many=False, context=None, fields=None):
+        self.instance = instance
+        self.many = many
+        self.context = context or {}
+        self.fields = fields
+        self.format_datetime = DateTimeFormatter()
+
+    def to_representation(self, row):
+        raise NotImplementedError
+
+    def select(self, representation):
+        return {
+            name: value for name, value in representation.items() if name in self.fields
+        }
+
+    @property
+    def data(self):
+        if not self.many:
+            representation = self.to_representation(self.instance)
+            return (
+                representation if self.fields is None else self.select(representation)
+            )
+        if self.fields is None:
+            return [self.to_representation(row) for row in self.instance]
+        return [self.select(self.to_representation(row)) for row in self.instance]
+
+
+class ValuesListMixin:
+    """
+    Lists rows fetched with `.values()` and serialized by
+    `values_serializer_class`, writes keep the model serializer.
+    Columns of the cursor ordering are fetched for the pagination.
+    """
+
+    values_serializer_class = None
+    values_mode = False
+
+    def get_serializer_class(self):
+        if self.values_mode:
+            return self.values_serializer_class
+        return super().get_serializer_class()
+
+    def get_values_columns(self):
+        columns = list(self.values_serializer_class.columns)
+        for field in getattr(self, "cursor_ordering", ()):
+            if field.lstrip("-") not in columns:
+                columns.append(field.lstrip("-"))
+        return columns
+
+    def get_values_queryset(self):
+        return self.filter_queryset(self.get_queryset())
+
+    def list(self, request, *args, **kwargs):
+        self.values_mode = True
+        queryset = self.get_values_queryset().values(*self.get_values_columns())
+        page = self.paginate_queryset(queryset)
+        with record_serialization():
+            data = self.get_serializer(page, many=True).data
+        return self.get_paginated_response(data)
+
+
+class SparseFieldsMixin:
+    """
+    `?fields=a,b` lists only these fields of the values serializer,
+    the columns of the others are not fetched. `?preview=N` lists the
+    first N characters of `preview_field`, cut by the database, as
+    `<preview_field>_preview`. To be placed before ValuesListMixin.
+    """
+
+    fields_query_param = "fields"
+    preview_query_param = "preview"
+    preview_field = "content"
+    # Columns of the pagination and of the read status
+    kept_columns = ("id", "time_create")
+
+    def get_fields(self):
+        """The selected output fields, None for all of them"""
+        value = self.request.query_params.get(self.fields_query_param)
+        if not value:
+            return None
+        fields = {name.strip() for name in value.split(",") if name.strip()}
+        unknown = fields - set(self.values_serializer_class.field_columns)
+        if unknown:
+            raise ValidationError(
+                {
+                    self.fields_query_param: [
+                        "Unknown fields: %s" % ", ".join(sorted(unknown))
+                    ]
+                }
+            )
+        return fields
+
+    def get_preview(self):
+        """Length of the excerpt, None for the whole field"""
+        value = self.request.query_params.get(self.preview_query_param)
+        if not value:
+            return None
+        try:
+            length = int(value)
+        except ValueError:
+            length = 0
+        if length < 1:
+            raise ValidationError(
+                {self.preview_query_param: ["A positive number is required."]}
+            )
+        return length
+
+    def get_preview_column(self):
+        return "%s_preview" % self.preview_field
+
+    def get_values_columns(self):
+        columns = super().get_values_columns()
+        fields = self.get_fields()
+        if fields is not None:
+            field_columns = self.values_serializer_class.field_columns
+            dropped = {
+                column
+                for name, column in field_columns.items()
+                if name not in fields and column not in self.kept_columns
+            }
+            columns = [column for column in columns if column not in dropped]
+        if self.get_preview() is not None and self.preview_field in columns:
+            columns[columns.index(self.preview_field)] = self.get_preview_column()
+        return columns
+
+    def get_values_queryset(self):
+        queryset = super().get_values_queryset()
+        length = self.get_preview()
+        if length is None:
+            return queryset
+        return queryset.annotate(
+            **{self.get_preview_column(): Substr(self.preview_field, 1, length)}
+        )
+
+    def get_serializer(self, *args, **kwargs):
+        if self.values_mode:
+            kwargs["fields"] = self.get_fields()
+        return super().get_serializer(*args, **kwargs)
@@ -1,34 +1,76 @@
-from django.conf import settings
 from django.contrib.auth.models import User
-from django.core.cache import cache
-from django.core.cache.backends.base import DEFAULT_TIMEOUT
-from django.db.models import Count
+from django.db.models import Exists, F, OuterRef, Q
+from django.http import HttpResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import generics, status
-from rest_framework.permissions import IsAuthenticated, IsAuthenticatedOrReadOnly
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import (
+    IsAdminUser,
+    IsAuthenticated,
+    IsAuthenticatedOrReadOnly,
+)
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .models import Post, Subscribe
+from .cache import CachedListMixin
+from .conditional import ConditionalListMixin, ConditionalUpdateMixin
+from .export import EXPORT_TYPES, export_lines
+from .feed import get_feed
+from .importer import IMPORT_TYPES, Importer
+from .instrumentation import registry
+from .models import FeedEntry, Post, Subscribe
+from .reads import get_read_post_ids, mark_read_before, set_read_status
+from .renderers import FastJSONRenderer
+from .routers import ReplicaReadMixin
+from .search import search_posts
 from .serializers import (
     AuthorSerializer,
+    AuthorValuesSerializer,
+    BulkSubscribeSerializer,
+    ExportSerializer,
     PostSerializer,
     PostSubscribeSerializer,
-    SubscribeSerializer,
+    PostSubscribeValuesSerializer,
+    PostValuesSerializer,
+    ReadStatusSerializer,
+    SubscribeValuesSerializer,
 )
-from .service import AuthorFilter, PostIsReadFilter, PostSubscribePagination
-
-CACHE_TTL = getattr(settings, "CACHE_TTL", DEFAULT_TIMEOUT)
+from .service import (
+    AuthorFilter,
+    KeysetPagination,
+    LimitOffsetCountPagination,
+    PostIsReadFilter,
+    PostPagination,
+    PostSearchFilter,
+    PostSubscribePagination,
+    get_row_value,
+)
+from .subscriptions import subscribe, unsubscribe
+from .unread import get_unread_summary
+from .values import SparseFieldsMixin, ValuesListMixin
 
 
-class PostAPIViews(generics.ListCreateAPIView):
+class PostAPIViews(
+    ReplicaReadMixin,
+    ConditionalListMixin,
+    CachedListMixin,
+    SparseFieldsMixin,
+    ValuesListMixin,
+    generics.ListCreateAPIView,
+):
     """
     Viewing posts and creating a post
     is only for authorized users
     """
 
     serializer_class = PostSerializer
+    values_serializer_class = PostValuesSerializer
+    renderer_classes = [FastJSONRenderer]
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = PostPagination
+    filterset_class = PostSearchFilter
+    cache_prefix = "posts"
+    cache_generations = ("post",)
 
     def get_queryset(self):
         """
@@ -36,21 +78,42 @@ class PostAPIViews(generics.ListCreateAPIView):
         except posts authored by the user
         """
         if self.request.auth:
-            cache_key = "post_users_%s" % self.request.user.id
-            post = cache.get(cache_key)
-            if not post:
-                post = Post.objects.exclude(author=self.request.user)
-                cache.set(cache_key, post, timeout=CACHE_TTL)
-        else:
-            cache_key = "post_users"
-            post = cache.get(cache_key)
-            if not post:
-                post = Post.objects.all()
-                cache.set(cache_key, post, timeout=CACHE_TTL)
-        return post
+            return Post.objects.exclude(author=self.request.user)
+        return Post.objects.all()
 
+    def get_cache_user(self):
+        if self.request.auth:
+            return self.request.user.id
+        return None
 
-class UserListViews(generics.ListCreateAPIView):
+
+class PostSearchView(SparseFieldsMixin, ValuesListMixin, generics.ListAPIView):
+    """
+    Full-text search of posts by the `q` parameter,
+    best matches first with keyset pagination
+    """
+
+    serializer_class = PostSerializer
+    values_serializer_class = PostValuesSerializer
+    renderer_classes = [FastJSONRenderer]
+    pagination_class = KeysetPagination
+    filter_backends = ()
+    cursor_ordering = ("-rank", "-id")
+
+    def get_queryset(self):
+        text = self.request.query_params.get("q", "").strip()
+        if not text:
+            raise ValidationError({"q": ["This parameter is required."]})
+        return search_posts(Post.objects.all(), text)
+
+
+class UserListViews(
+    ReplicaReadMixin,
+    ConditionalListMixin,
+    CachedListMixin,
+    ValuesListMixin,
+    generics.ListCreateAPIView,
+):
     """
     Shows all authors. You can filter the authors
     by the number of posts.
@@ -58,42 +121,79 @@ class UserListViews(generics.ListCreateAPIView):
     """
 
     serializer_class = AuthorSerializer
+    values_serializer_class = AuthorValuesSerializer
+    renderer_classes = [FastJSONRenderer]
     permission_classes = [IsAuthenticatedOrReadOnly]
+    pagination_class = LimitOffsetCountPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = AuthorFilter
+    throttle_scopes = {"POST": "subscribe"}
+    cache_prefix = "authors"
+    cache_generations = ("post", "user")
 
     def get_queryset(self):
-        """Cached method"""
-        authors = cache.get("authors")
-        if not authors:
-            authors = User.objects.annotate(count_post=Count("post"))
-            cache.set("authors", authors, timeout=CACHE_TTL)
-        return authors
+        """
+        The number of posts is read from the author counters, which
+        every user has. The inner join lets their index order and filter.
+        """
+        return User.objects.filter(stats__post_count__isnull=False).annotate(
+            count_post=F("stats__post_count")
+        )
 
 
-class SubscribeView(APIView):
+class SubscribeView(ReplicaReadMixin, APIView):
     """Only for authorized users"""
 
     permission_classes = [IsAuthenticated]
+    renderer_classes = [FastJSONRenderer]
+    throttle_scopes = {"POST": "subscribe", "DELETE": "subscribe"}
 
     def get(self, request):
         """Method showing who is subscribed"""
-        subscribe = Subscribe.objects.filter(subscriber=request.user)
-        serializer = SubscribeSerializer(subscribe, many=True)
+        subscribe = Subscribe.objects.filter(subscriber=request.user).values(
+            *SubscribeValuesSerializer.columns
+        )
+        serializer = SubscribeValuesSerializer(subscribe, many=True)
         return Response(serializer.data)
 
+    def post(self, request):
+        """Subscribes to a list of authors given by username"""
+        serializer = BulkSubscribeSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        results = subscribe(request.user, serializer.validated_data["authors"])
+        return Response(format_results(results))
+
     def delete(self, request):
-        """Remove subscription"""
-        subscribe = Subscribe.objects.filter(
+        """
+        Remove subscription: the author id,
+        or a list of authors given by username
+        """
+        if "authors" in request.data:
+            serializer = BulkSubscribeSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            results = unsubscribe(request.user, serializer.validated_data["authors"])
+            return Response(format_results(results))
+        subscription = Subscribe.objects.filter(
             subscriber=request.user, author=request.data.get("author")
         )
-        if subscribe.exists():
-            subscribe.delete()
+        if subscription.exists():
+            subscription.delete()
             return Response(status=status.HTTP_200_OK)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class PostSubscribeListViews(generics.ListAPIView):
+def format_results(results):
+    return [{"author": author, "status": result} for author, result in results.items()]
+
+
+class PostSubscribeListViews(
+    ReplicaReadMixin,
+    ConditionalListMixin,
+    CachedListMixin,
+    SparseFieldsMixin,
+    ValuesListMixin,
+    generics.ListAPIView,
+):
     """
     Only for authorized users.
     Shows all posts of the authors on which it is subscribed.
@@ -102,40 +202,208 @@ class PostSubscribeListViews(generics.ListAPIView):
     """
 
     serializer_class = PostSubscribeSerializer
+    values_serializer_class = PostSubscribeValuesSerializer
+    renderer_classes = [FastJSONRenderer]
     permission_classes = [IsAuthenticated]
     pagination_class = PostSubscribePagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = PostIsReadFilter
+    cursor_ordering = ("-feed_time", "-feed_post")
+    cache_prefix = "feed"
+    throttle_scope = "feed"
+    merged_feed = None
 
     def get_queryset(self):
-        user = self.request.user
-        subscribe = Subscribe.objects.select_related().filter(subscriber=user)
-        author = [subscribe.author for subscribe in subscribe]
+        """
+        The feed is read from the materialized feed entries.
+        Posts of authors with fan-out on read are merged in, by
+        filter_queryset for unfiltered pages, by the query otherwise.
+        """
+        self.merged_feed = get_feed(self.request.user)
+        if self.merged_feed is not None:
+            return (
+                Post.objects.select_related("author")
+                .filter(
+                    Q(author_id__in=self.merged_feed.authors)
+                    | Exists(
+                        FeedEntry.objects.filter(
+                            subscriber=self.request.user, post=OuterRef("pk")
+                        )
+                    )
+                )
+                .annotate(feed_time=F("time_create"), feed_post=F("id"))
+                .order_by(*self.cursor_ordering)
+            )
         post = (
-            Post.objects.select_related()
-            .filter(author__username__in=author)
-            .prefetch_related("read_users")
+            Post.objects.select_related("author")
+            .filter(feed_entries__subscriber=self.request.user)
+            .annotate(
+                feed_time=F("feed_entries__time_create"),
+                feed_post=F("feed_entries__post"),
+            )
+            .order_by(*self.cursor_ordering)
         )
         return post
 
+    def filter_queryset(self, queryset):
+        filtered = any(
+            self.request.query_params.get(name)
+            for name in self.filterset_class.base_filters
+        )
+        if self.merged_feed is not None and not filtered:
+            return self.merged_feed
+        return super().filter_queryset(queryset)
+
+    def get_cache_user(self):
+        return self.request.user.id
+
+    def get_cache_generations(self):
+        return ("post", "subscribe", "user", "read:%s" % self.request.user.id)
+
+    def get_serializer(self, *args, **kwargs):
+        """The read status of the whole page is resolved in one query"""
+        fields = self.get_fields() if self.values_mode else None
+        if kwargs.get("many") and (fields is None or "is_read" in fields):
+            kwargs["context"] = self.get_serializer_context()
+            kwargs["context"]["read_post_ids"] = get_read_post_ids(
+                self.request.user, [get_row_value(post, "id") for post in args[0]]
+            )
+        return super().get_serializer(*args, **kwargs)
+
 
-class PostSubscribeDetailViews(generics.RetrieveUpdateAPIView):
+class UnreadSummaryView(APIView):
+    """
+    Only for authorized users.
+    Unread posts of the subscriptions, in total and per author.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(get_unread_summary(request.user))
+
+
+class PostSubscribeDetailViews(ConditionalUpdateMixin, generics.RetrieveUpdateAPIView):
     """
     Only for authorized users.
     Shows a post. Adds and removes read status.
+    Updates can be made safe with the If-Match header.
     """
 
     serializer_class = PostSubscribeSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        subscribe = Subscribe.objects.select_related().filter(
-            subscriber=self.request.user
+        """Posts of the followed authors, fan-out on read ones included"""
+        return Post.objects.select_related("author").filter(
+            author__author_post__subscriber=self.request.user
         )
-        author = [subscribe.author for subscribe in subscribe]
-        post = (
-            Post.objects.select_related()
-            .filter(author__username__in=author)
-            .prefetch_related("read_users")
+
+
+class PostReadStatusView(APIView):
+    """
+    Only for authorized users.
+    Marks posts of the subscriptions as read or unread in bulk:
+    the listed posts or all posts created up to `before`.
+    """
+
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = ReadStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # Posts of the followed authors, also those without feed entries
+        posts = Post.objects.filter(author__author_post__subscriber=request.user)
+        if "posts" in serializer.validated_data:
+            posts = posts.filter(id__in=serializer.validated_data["posts"])
+        else:
+            before = serializer.validated_data["before"]
+            posts = posts.filter(time_create__lte=before)
+            if serializer.validated_data["is_read"]:
+                # Moves the read marks instead of writing every post
+                mark_read_before(request.user, before)
+                return Response({"is_read": True, "posts": posts.count()})
+        count = set_read_status(
+            request.user,
+            posts.values_list("id", flat=True),
+            serializer.validated_data["is_read"],
         )
-        return post
+        return Response(
+            {"is_read": serializer.validated_data["is_read"], "posts": count}
+        )
+
+
+class ExportView(APIView):
+    """
+    Only for admins.
+    Streams posts, subscriptions and read events as NDJSON.
+    Filters: type (repeated), author and the `since` watermark
+    on time_update of the posts.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        serializer = ExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        return StreamingHttpResponse(
+            export_lines(
+                serializer.validated_data.get("type") or EXPORT_TYPES,
+                author=serializer.validated_data.get("author"),
+                since=serializer.validated_data.get("since"),
+            ),
+            content_type="application/x-ndjson",
+        )
+
+
+class ImportView(APIView):
+    """
+    Only for admins.
+    Imports users, posts, subscriptions and read events in batches
+    from an NDJSON body, or from a CSV body of the `type` rows.
+    Returns the numbers of imported rows and the invalid rows.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def post(self, request):
+        if request.stream is None:
+            return Response({"errors": "Empty body"}, status.HTTP_400_BAD_REQUEST)
+        lines = (line.decode("utf-8", "replace") for line in request.stream)
+        if request.content_type.startswith("text/csv"):
+            name = request.query_params.get("type")
+            if name not in IMPORT_TYPES:
+                return Response(
+                    {"type": ["Required for CSV, one of %s" % ", ".join(IMPORT_TYPES)]},
+                    status.HTTP_400_BAD_REQUEST,
+                )
+            report = Importer().import_csv(lines, name)
+        else:
+            report = Importer().import_ndjson(lines)
+        return Response(report)
+
+
+class MetricsView(APIView):
+    """
+    Only for admins.
+    Request metrics of this process in the Prometheus text format.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(
+            registry.render_prometheus(), content_type="text/plain; version=0.0.4"
+        )
+
+
+class SlowRequestsView(APIView):
+    """
+    Only for admins.
+    The slowest requests of this process with their SQL.
+    """
+
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(registry.get_slowest())
@@ -1,3 +1,4 @@
+import sys
 from os import getenv
 from pathlib import Path
 
@@ -37,6 +38,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "app.middleware.InstrumentationMiddleware",
+    "app.middleware.ReplicaPinMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -66,10 +69,23 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "blog.wsgi.application"
 
+# Serve the cached list pages from the event loop under ASGI
+ASYNC_READ_VIEWS = bool(getenv("ASYNC_READ_VIEWS"))
+
+# Feed fan-out and search indexing: immediate, thread or database
+TASK_BACKEND = getenv("TASK_BACKEND", "immediate")
+
 
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
+DB_POOL_SIZE = int(getenv("DB_POOL_SIZE") or 0)
+
+# Persistent connections are not safe under ASGI, use the pool there
+DB_CONN_MAX_AGE = int(getenv("DB_CONN_MAX_AGE") or 60)
+if DB_POOL_SIZE or getenv("DJANGO_ASGI"):
+    DB_CONN_MAX_AGE = 0
+
 DATABASES = {
     "default": {
         "ENGINE": str(getenv("DB_ENGINE")),
@@ -78,9 +94,40 @@ DATABASES = {
         "PASSWORD": str(getenv("POSTGRES_PASSWORD")),
         "HOST": str(getenv("DB_HOST")),
         "PORT": 5432,
+        "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+        "CONN_HEALTH_CHECKS": getenv("DB_CONN_HEALTH_CHECKS", "1") == "1",
+        # Connections of the pool of each worker process
+        "POOL_SIZE": DB_POOL_SIZE,
+        # Seconds to wait for a pooled connection when all are in use
+        "POOL_TIMEOUT": int(getenv("DB_POOL_TIMEOUT") or 10),
     }
 }
 
+if DATABASES["default"]["ENGINE"].endswith("postgresql"):
+    DATABASES["default"]["ENGINE"] = (
+        "app.backends.postgresql_pool" if DB_POOL_SIZE else "app.backends.postgresql"
+    )
+
+# Comma separated hosts of the read replicas (database files with SQLite)
+READ_REPLICAS = []
+replicas = filter(None, str(getenv("DB_REPLICAS", "")).split(","))
+for number, replica in enumerate(replicas, 1):
+    name = "replica%s" % number
+    DATABASES[name] = dict(DATABASES["default"], TEST={"MIRROR": "default"})
+    field = "NAME" if "sqlite3" in DATABASES[name]["ENGINE"] else "HOST"
+    DATABASES[name][field] = replica
+    READ_REPLICAS.append(name)
+
+# Tests read through a replica alias that mirrors the test database
+if sys.argv[1:2] == ["test"]:
+    DATABASES.setdefault(
+        "replica1", dict(DATABASES["default"], TEST={"MIRROR": "default"})
+    )
+
+DATABASE_ROUTERS = ["app.routers.ReplicaRouter"]
+
+REPLICA_PIN_SECONDS = int(getenv("REPLICA_PIN_SECONDS", 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.0/ref/settings/#auth-password-validators
@@ -141,12 +188,21 @@ REST_FRAMEWORK = {
     "PAGE_SIZE": 10,
 
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework.authentication.TokenAuthentication",
+        "app.authentication.CachedTokenAuthentication",
         "rest_framework.authentication.BasicAuthentication",
         "rest_framework.authentication.SessionAuthentication",
     ),
 
     "DEFAULT_FILTER_BACKENDS": ("django_filters.rest_framework.DjangoFilterBackend",),
+
+    "DEFAULT_THROTTLE_CLASSES": ("app.throttling.SlidingWindowThrottle",),
+
+    "DEFAULT_THROTTLE_RATES": {
+        "anon": "600/min",
+        "user": "1200/min",
+        "feed": "300/min",
+        "subscribe": "60/min",
+    },
     
     "DEFAULT_RENDERER_CLASSES": [
         "rest_framework.renderers.JSONRenderer",
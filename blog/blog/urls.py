@@ -1,21 +1,46 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 
+from app.async_views import async_list_view
 from app.views import (
+    ExportView,
+    ImportView,
+    MetricsView,
     PostAPIViews,
+    PostReadStatusView,
+    PostSearchView,
     PostSubscribeDetailViews,
     PostSubscribeListViews,
+    SlowRequestsView,
     SubscribeView,
+    UnreadSummaryView,
     UserListViews,
 )
 
+if settings.ASYNC_READ_VIEWS:
+    post_view = async_list_view(PostAPIViews)
+    authors_view = async_list_view(UserListViews)
+    post_subscribe_view = async_list_view(PostSubscribeListViews)
+else:
+    post_view = PostAPIViews.as_view()
+    authors_view = UserListViews.as_view()
+    post_subscribe_view = PostSubscribeListViews.as_view()
+
 urlpatterns = [
     path("admin/", admin.site.urls),
     path("api/auth/", include("djoser.urls")),
     path("api/auth/", include("djoser.urls.authtoken")),
-    path("api/post/", PostAPIViews.as_view(), name="post"),
+    path("api/post/", post_view, name="post"),
+    path("api/post/search/", PostSearchView.as_view(), name="post_search"),
     path("api/subscribe/", SubscribeView.as_view(), name="subscribe"),
-    path("api/authors/", UserListViews.as_view(), name="authors"),
-    path("api/post_subscribe/", PostSubscribeListViews.as_view(), name="post_subscribe"),
+    path("api/authors/", authors_view, name="authors"),
+    path("api/post_subscribe/", post_subscribe_view, name="post_subscribe"),
+    path("api/post_subscribe/read/", PostReadStatusView.as_view(), name="post_subscribe_read"),
+    path("api/post_subscribe/unread/", UnreadSummaryView.as_view(), name="post_subscribe_unread"),
     path("api/post_subscribe/<int:pk>/", PostSubscribeDetailViews.as_view(), name="post_subscribe_detail"),
+    path("api/export/", ExportView.as_view(), name="export"),
+    path("api/import/", ImportView.as_view(), name="import"),
+    path("api/metrics/", MetricsView.as_view(), name="metrics"),
+    path("api/metrics/slow/", SlowRequestsView.as_view(), name="metrics_slow"),
 ]